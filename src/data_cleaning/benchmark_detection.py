@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+CPU benchmarks for the face-detection stage.
+
+Downloads (or reads from the download cache) the first N images of a school's
+URL list, then times detection paths on the same decoded images:
+
+  batch      per-image DeepFace/MTCNN vs. batched MTCNN detection
+  downscale  full-resolution vs. downscale-before-detect, with a check that the
+             recovered face count stays within tolerance of the full-resolution run
+
+Usage:
+    python benchmark_detection.py
+    python benchmark_detection.py --mode downscale --max-side 1024 --tolerance 0.05
+    python benchmark_detection.py --csv ../../data/raw/scecina-school-image-urls-unique.csv --limit 100
+"""
+
+import argparse
+import os
+import time
+
+# Keep the comparison on CPU
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from face_detection import detect_faces, detect_faces_batch, get_batch_detector, DETECTION_MAX_SIDE
+from image_downloader import ImageDownloader
+
+DEFAULT_CSV = "../../data/raw/cardinalritter-school-image-urls-unique.csv"
+MIN_CONFIDENCE = 0.9
+
+
+def load_images(csv_file, limit):
+    """Downloads and decodes up to `limit` images from the CSV."""
+    df = pd.read_csv(csv_file)
+    urls = df['Image URL'].dropna().astype(str).tolist()
+    downloader = ImageDownloader(max_workers=8)
+    images = []
+    for _, url, image_bytes in downloader.download_all(urls):
+        if image_bytes is None:
+            continue
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype="uint8"), cv2.IMREAD_COLOR)
+        if image is not None:
+            images.append(image)
+        if len(images) >= limit:
+            break
+    downloader.close()
+    return images
+
+
+def count_confident(faces):
+    return sum(1 for face in faces if face["confidence"] >= MIN_CONFIDENCE)
+
+
+def time_per_image(images, max_side=None):
+    """Runs per-image detection on every image; returns (seconds, per-image seconds, face counts)."""
+    counts = []
+    durations = []
+    for image in images:
+        started = time.perf_counter()
+        try:
+            counts.append(count_confident(detect_faces(image, max_side=max_side)))
+        except Exception as e:
+            print(f"Per-image detection failed: {e}")
+            counts.append(0)
+        durations.append(time.perf_counter() - started)
+    return sum(durations), durations, counts
+
+
+def benchmark_batch(images, batch_size):
+    """Compares per-image DeepFace/MTCNN detection with batched MTCNN detection."""
+    # Warm both paths so model loading is not part of the timings
+    detect_faces(images[0])
+    get_batch_detector()
+    detect_faces_batch(images[:1])
+
+    single_seconds, _, single_counts = time_per_image(images)
+
+    started = time.perf_counter()
+    batch_counts = [count_confident(faces) for faces in detect_faces_batch(images, batch_size=batch_size)]
+    batch_seconds = time.perf_counter() - started
+
+    matching = sum(1 for a, b in zip(single_counts, batch_counts) if a == b)
+    print("\nDetection benchmark (CPU)")
+    print(f" - per-image: {single_seconds:7.2f}s  {len(images) / single_seconds:6.2f} images/s  faces={sum(single_counts)}")
+    print(f" - batched:   {batch_seconds:7.2f}s  {len(images) / batch_seconds:6.2f} images/s  faces={sum(batch_counts)}"
+          f"  (batch size {batch_size})")
+    print(f" - speedup:   {single_seconds / batch_seconds:.2f}x")
+    print(f" - images with the same face count: {matching}/{len(images)}")
+
+
+def benchmark_downscale(images, max_side, tolerance):
+    """
+    Compares full-resolution detection with downscale-before-detect on the images
+    whose longer side exceeds `max_side`. Returns True if the total face count of
+    the downscaled run is within `tolerance` (relative) of the full-resolution run.
+    """
+    large = [image for image in images if max(image.shape[:2]) > max_side]
+    if not large:
+        print(f"\nNo images larger than {max_side}px in the sample; nothing to compare.")
+        return True
+    detect_faces(large[0])  # Warm-up
+
+    full_seconds, full_durations, full_counts = time_per_image(large)
+    small_seconds, small_durations, small_counts = time_per_image(large, max_side=max_side)
+
+    speedups = sorted(f / s for f, s in zip(full_durations, small_durations) if s > 0)
+    full_total, small_total = sum(full_counts), sum(small_counts)
+    drift = abs(full_total - small_total) / full_total if full_total else 0.0
+    within = drift <= tolerance
+
+    print(f"\nDownscale-before-detect benchmark (CPU, {len(large)} images larger than {max_side}px)")
+    print(f" - full resolution: {full_seconds:7.2f}s  {1000 * full_seconds / len(large):7.1f} ms/image  faces={full_total}")
+    print(f" - max side {max_side:<5}: {small_seconds:7.2f}s  {1000 * small_seconds / len(large):7.1f} ms/image  faces={small_total}")
+    print(f" - per-image speedup: median {speedups[len(speedups) // 2]:.2f}x, "
+          f"min {speedups[0]:.2f}x, max {speedups[-1]:.2f}x")
+    print(f" - face count drift: {100 * drift:.1f}% (tolerance {100 * tolerance:.1f}%) -> {'OK' if within else 'FAIL'}")
+    return within
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["batch", "downscale", "all"], default="all")
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="School image-URL CSV to sample")
+    parser.add_argument("--limit", type=int, default=64, help="Number of images to benchmark")
+    parser.add_argument("--batch-size", type=int, default=16, help="Images per batched forward pass")
+    parser.add_argument("--max-side", type=int, default=DETECTION_MAX_SIDE, help="Longest side for downscaled detection")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="Allowed relative face-count drift")
+    args = parser.parse_args()
+
+    print(f"Loading up to {args.limit} images from {args.csv}")
+    images = load_images(args.csv, args.limit)
+    if not images:
+        print("No images could be loaded.")
+        return
+    print(f"Loaded {len(images)} images")
+
+    if args.mode in ("batch", "all"):
+        benchmark_batch(images, args.batch_size)
+    if args.mode in ("downscale", "all"):
+        if not benchmark_downscale(images, args.max_side, args.tolerance):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -98,124 +98,361 @@
 #     print(f"All cropped faces are saved in: {output_folder}")
 
 
+import argparse
+import functools
+import io
 import os
+import sys
+import threading
 import cv2
-import requests
 import numpy as np
 import pandas as pd
-from deepface import DeepFace
+from face_detection import detect_faces, detect_faces_batch, crop_with_margin, DETECTION_MAX_SIDE
+from image_downloader import ImageDownloader
+from pipeline import Pipeline, Stage
+from deduplicate import open_store
 
-def download_image(url):
+def decode_image(image_bytes):
+    """Decodes downloaded image bytes into a NumPy array (None if they are not a raster image)."""
+    image_bytes = np.frombuffer(image_bytes, dtype="uint8")
+    return cv2.imdecode(image_bytes, cv2.IMREAD_COLOR)
+
+def download_image(url, downloader=None):
     """Downloads an image from a URL and returns it as a NumPy array."""
-    try:
-        # Extract the website domain for the referer header
-        domain_parts = url.split('/')
-        if len(domain_parts) >= 3:
-            domain = f"{domain_parts[0]}//{domain_parts[2]}"
-        else:
-            domain = "https://www.roncalli.org"  # Default domain
-
-        # Set up headers to mimic a browser request
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Referer': domain,  # This is crucial - tells the server where the request is coming from
-            'Connection': 'keep-alive'
-        }
-        
-        # Create a session to maintain cookies
-        session = requests.Session()
-        response = session.get(url, headers=headers, stream=True)
-        
-        if response.status_code == 200:
-            image_bytes = np.asarray(bytearray(response.content), dtype="uint8")
-            image = cv2.imdecode(image_bytes, cv2.IMREAD_COLOR)
-            return image
-        else:
-            print(f"Failed to download image. Status code: {response.status_code}")
-            return None
-    except Exception as e:
-        print(f"Exception occurred while downloading image: {str(e)}")
+    downloader = downloader or ImageDownloader()
+    image_bytes = downloader.fetch(url)
+    if image_bytes is None:
         return None
+    return decode_image(image_bytes)
 
-# The rest of your code remains the same
-def detect_and_crop_faces(image, output_folder, base_filename):
+def use_image_analysis():
+    """Makes the modules in ../image_analysis importable."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "image_analysis"))
+
+def connect_model_server(address):
+    """Connects to image_analysis/model_server.py so detection reuses its warm models."""
+    use_image_analysis()
+    from model_server import ModelClient
+    return ModelClient(address)
+
+def near_duplicate_clusters(max_distance):
+    """Clusters downloaded images by perceptual hash (image_analysis/hash_index.py)."""
+    use_image_analysis()
+    from hash_index import NearDuplicateClusters
+    return NearDuplicateClusters(max_distance)
+
+# Held while a cluster changes representative and while a cluster member's crops are written,
+# so the crops of a replaced representative are never written after they were removed
+_crop_lock = threading.Lock()
+
+def is_near_duplicate(clusters, index, url, image_bytes, output_folder):
     """
-    Detects faces in an image (as a NumPy array) using DeepFace's MTCNN,
-    crops them with a margin, and saves each cropped face in the given output folder.
+    True if the image is a near-identical copy (another size or URL) of one already
+    seen that is no larger, in which case its faces are cropped from the representative.
+    A larger copy replaces the representative: it is processed, and the crops of the
+    smaller one are removed from the output folder.
+    """
+    if clusters is None:
+        return False
+    from PIL import Image
+    from perceptual_hash import compute_hash
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        size = image.size[0] * image.size[1]
+        value = compute_hash(image)
+    except Exception:
+        return False  # Not decodable by PIL; let the decode stage report it
+    with _crop_lock:
+        representative = clusters.assign((index, url), value, size)
+        replaced = clusters.replaced.get((index, url))
+        if replaced is not None:
+            removed = remove_faces(output_folder, base_filename=f"img{replaced[0]+1}")
+            print(f"Image {index+1} is a larger copy of image {replaced[0]+1}, "
+                  f"replacing its {removed} cropped faces: {url}")
+    if representative is not None:
+        print(f"Skipping image {index+1}, near-duplicate of image {representative[0]+1}: {url}")
+        return True
+    return False
+
+def crop_faces(image, max_side=None, model_server=None):
+    """
+    Detects faces in an image (as a NumPy array) using DeepFace's MTCNN and
+    returns the confident ones cropped with a margin. Detection runs on a copy
+    downscaled to `max_side`, but the crops are taken from the original pixels.
+
+    Returns:
+        list: (face number, cropped face array) tuples
     """
     if image is None:
         raise ValueError("Invalid image array provided.")
-    
+
     try:
         # DeepFace.extract_faces accepts a numpy array for face detection.
-        faces = DeepFace.extract_faces(img_path=image, detector_backend='mtcnn', enforce_detection=False)
+        faces = detect_faces(image, max_side=max_side, model_server=model_server)
     except Exception as e:
         print(f"Error in face detection: {str(e)}")
-        return 0
+        return []
+
+    return select_faces(image, faces)
 
-    face_count = 0
+def select_faces(image, faces):
+    """Keeps confident detections and crops each with a 30px margin."""
+    crops = []
     for i, face in enumerate(faces):
         if face['confidence'] < 0.9:  # Skip detections with low confidence
             continue
+        crops.append((i + 1, crop_with_margin(image, face['facial_area'])))
+    return crops
 
-        facial_area = face['facial_area']
-        x, y, w, h = facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h']
-
-        # Add a margin to the crop
-        margin = 30
-        x = max(0, x - margin)
-        y = max(0, y - margin)
-        w = min(image.shape[1] - x, w + 2 * margin)
-        h = min(image.shape[0] - y, h + 2 * margin)
+def crop_faces_batch(images, batch_size=16):
+    """
+    Batched version of crop_faces: runs MTCNN once per batch of same-sized
+    (letterboxed) images and returns the crops for each input image.
+    """
+    try:
+        detections = detect_faces_batch(images, batch_size=batch_size)
+    except Exception as e:
+        # A failed batch is not "no faces": detect its images one at a time instead
+        print(f"Error in batched face detection, retrying one image at a time: {str(e)}")
+        return [crop_faces(image) for image in images]
+    return [select_faces(image, faces) for image, faces in zip(images, detections)]
 
-        face_img = image[y:y+h, x:x+w]
-        # Save each face in the common output folder
-        output_path = os.path.join(output_folder, f"{base_filename}_face_{i+1}.jpg")
+def save_faces(crops, output_folder, base_filename):
+    """Saves cropped faces in the common output folder and returns how many were written."""
+    for face_number, face_img in crops:
+        output_path = os.path.join(output_folder, f"{base_filename}_face_{face_number}.jpg")
         cv2.imwrite(output_path, face_img)
-        face_count += 1
+    return len(crops)
 
-    return face_count
+def remove_faces(output_folder, base_filename):
+    """Deletes the crops saved for one image; returns how many there were."""
+    prefix = f"{base_filename}_face_"
+    removed = 0
+    for name in os.listdir(output_folder):
+        if name.startswith(prefix):
+            os.remove(os.path.join(output_folder, name))
+            removed += 1
+    return removed
 
-if __name__ == "__main__":
-    # Prompt for the school name and build the CSV file path dynamically.
-    school_name = input("Enter the school name: ").strip().lower().replace(" ", "")
-    csv_file = f"../../data/raw/{school_name}-school-image-urls-unique.csv"
-    
-    # Load the CSV file containing image URLs.
-    try:
-        df = pd.read_csv(csv_file)
-    except Exception as e:
-        print(f"Error reading CSV file {csv_file}: {str(e)}")
-        exit(1)
-    
-    if 'Image URL' not in df.columns:
-        print("CSV file must have a 'url' column.")
-        exit(1)
-    
-    # Create a single output folder for the school
-    output_folder = f"../../data/processed/cropped_faces_{school_name}"
-    os.makedirs(output_folder, exist_ok=True)
-    
+def save_representative_faces(clusters, index, url, crops, output_folder):
+    """
+    Saves an image's crops unless a larger near-duplicate replaced it while its faces
+    were being detected (without `clusters`, always saves).
+    """
+    base_filename = f"img{index+1}"
+    if clusters is None:
+        return save_faces(crops, output_folder, base_filename)
+    with _crop_lock:
+        item = (index, url)
+        if clusters.representative_of.get(item, item) != item:
+            print(f"Dropping the faces of image {index+1}, replaced by a larger copy")
+            return 0
+        return save_faces(crops, output_folder, base_filename)
+
+def list_crop_versions(output_folder):
+    """{crop file: modification time} of the crops already in the output folder."""
+    return {name: os.stat(os.path.join(output_folder, name)).st_mtime_ns for name in os.listdir(output_folder)}
+
+def detect_and_crop_faces(image, output_folder, base_filename, max_side=None, model_server=None):
+    """
+    Detects faces in an image (as a NumPy array) using DeepFace's MTCNN,
+    crops them with a margin, and saves each cropped face in the given output folder.
+    """
+    return save_faces(crop_faces(image, max_side, model_server), output_folder, base_filename)
+
+def detect_stage(item, max_side=None, model_server=None):
+    """Pipeline detect stage (runs in a worker process): (index, url, image) -> (index, url, crops)."""
+    index, url, image = item
+    return index, url, crop_faces(image, max_side, model_server)
+
+def run_pipeline(urls, output_folder, detect_workers=None, download_workers=8, max_side=None,
+                 model_server=None, clusters=None):
+    """
+    Runs download -> decode -> face-detect -> write as a staged pipeline.
+    With `clusters` (NearDuplicateClusters), near-identical images are dropped
+    before decoding, so each picture is cropped only once.
+
+    Downloads, decoding and writes run on threads, MTCNN runs on a process pool
+    sized to the CPU count, and bounded queues between the stages keep memory flat.
+    With a `model_server`, detection is sent to that warm worker from threads instead.
+
+    Returns:
+        int: Total number of faces cropped
+    """
+    downloader = ImageDownloader(max_workers=download_workers)
+
+    def download_stage(item):
+        index, url = item
+        image_bytes = downloader.fetch(url)
+        if image_bytes is None:
+            print(f"Skipping image {index+1} due to download error: {url}")
+            return None
+        if is_near_duplicate(clusters, index, url, image_bytes, output_folder):
+            return None
+        return index, url, image_bytes
+
+    def decode_stage(item):
+        index, url, image_bytes = item
+        image = decode_image(image_bytes)
+        if image is None:
+            print(f"Skipping image {index+1}, not a decodable image: {url}")
+            return None
+        return index, url, image
+
+    def write_stage(item):
+        index, url, crops = item
+        num_faces = save_representative_faces(clusters, index, url, crops, output_folder)
+        print(f"Number of faces detected and cropped for image {index+1}: {num_faces}")
+        return num_faces
+
+    if model_server is not None:
+        detect = Stage("detect", functools.partial(detect_stage, max_side=max_side, model_server=model_server),
+                       workers=detect_workers or 2)
+    else:
+        detect = Stage("detect", functools.partial(detect_stage, max_side=max_side),
+                       workers=detect_workers or os.cpu_count() or 1, processes=True)
+    pipeline = Pipeline([
+        Stage("download", download_stage, workers=download_workers),
+        Stage("decode", decode_stage, workers=2),
+        detect,
+        Stage("write", write_stage, workers=2),
+    ])
+    total_face_count = sum(pipeline.run(enumerate(urls)))
+    downloader.close()
+
+    print(f"\nDownloads: {downloader.report()}")
+    print(pipeline.report())
+    return total_face_count
+
+def run_batched(urls, output_folder, batch_size=16, clusters=None):
+    """Downloads concurrently and detects faces in batches of `batch_size` images."""
+    total_face_count = 0
+    downloader = ImageDownloader(max_workers=8)
+    pending = []
+
+    def flush():
+        nonlocal total_face_count
+        crops_per_image = crop_faces_batch([image for _, _, image in pending], batch_size=batch_size)
+        for (index, url, _), crops in zip(pending, crops_per_image):
+            num_faces = save_representative_faces(clusters, index, url, crops, output_folder)
+            total_face_count += num_faces
+            print(f"Number of faces detected and cropped for image {index+1}: {num_faces}")
+        pending.clear()
+
+    for index, url, image_bytes in downloader.download_all(urls):
+        image = decode_image(image_bytes) if image_bytes is not None else None
+        if image is None:
+            print(f"Skipping image {index+1} due to download error: {url}")
+            continue
+        if is_near_duplicate(clusters, index, url, image_bytes, output_folder):
+            continue
+        pending.append((index, url, image))
+        if len(pending) == batch_size:
+            flush()
+    if pending:
+        flush()
+
+    downloader.close()
+    print(f"Downloads: {downloader.report()}")
+    return total_face_count
+
+def run_serial(urls, output_folder, max_side=None, model_server=None, clusters=None):
+    """Downloads concurrently but detects faces one image at a time in this process."""
     total_face_count = 0
-    # Process each image URL from the CSV file
-    for index, row in df.iterrows():
-        url = row['Image URL']
+    downloader = ImageDownloader(max_workers=8)
+    for index, url, image_bytes in downloader.download_all(urls):
         print(f"Processing image {index+1}: {url}")
-        
-        image = download_image(url)
+
+        image = decode_image(image_bytes) if image_bytes is not None else None
         if image is None:
             print("Skipping due to download error.")
             continue
-        
+        if is_near_duplicate(clusters, index, url, image_bytes, output_folder):
+            continue
+
         # Use the image index in the file name to avoid collisions.
-        num_faces = detect_and_crop_faces(image, output_folder, base_filename=f"img{index+1}")
+        num_faces = save_representative_faces(clusters, index, url, crop_faces(image, max_side, model_server),
+                                              output_folder)
         total_face_count += num_faces
         print(f"Number of faces detected and cropped for image {index+1}: {num_faces}")
-    
-    print(f"Total faces cropped: {total_face_count}")
-    print(f"All cropped faces are saved in: {output_folder}")
 
+    downloader.close()
+    print(f"Downloads: {downloader.report()}")
+    return total_face_count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download school images and crop the faces in them.")
+    parser.add_argument("--school", help="School name (prompted for if omitted)")
+    parser.add_argument("--serial", action="store_true", help="Detect faces in this process, one image at a time")
+    parser.add_argument("--detect-workers", type=int, help="Face-detection processes (default: CPU count)")
+    parser.add_argument("--max-side", type=int, default=None,
+                        help=f"Downscale images to this longest side before detection (default: full resolution, "
+                             f"as before; e.g. {DETECTION_MAX_SIDE} once benchmark_detection.py --mode downscale "
+                             f"shows no face-count change on your images)")
+    parser.add_argument("--batch-size", type=int, help="Detect faces in batches of this many images (in this process); "
+                             "images larger than 1024px are downscaled for detection")
+    parser.add_argument("--model-server", metavar="HOST:PORT",
+                        help="Detect faces with the warm models of a running image_analysis/model_server.py")
+    parser.add_argument("--near-duplicates", action="store_true",
+                        help="Crop only the largest image per cluster of near-identical images (perceptual hash)")
+    parser.add_argument("--hash-distance", type=int, default=4,
+                        help="Perceptual-hash Hamming distance treated as the same image")
+    parser.add_argument("--store", default="../../data/store", help="Parquet store directory")
+    parser.add_argument("--no-store", action="store_true", help="Read the URL CSV and skip writing the faces table")
+    args = parser.parse_args()
+    if args.batch_size and (args.max_side is not None or args.model_server):
+        # Batched detection letterboxes into its own buckets with an in-process MTCNN
+        parser.error("--batch-size cannot be combined with --max-side or --model-server")
 
+    # Prompt for the school name and build the CSV file path dynamically.
+    school_name = (args.school or input("Enter the school name: ")).strip().lower().replace(" ", "")
+    csv_file = f"../../data/raw/{school_name}-school-image-urls-unique.csv"
+    store = None if args.no_store else open_store(args.store)
 
+    if store is not None and store.has_partition("images", school_name):
+        # Only the image_url column of this school's partition is read
+        urls = store.read_column("images", school_name, "image_url")
+    else:
+        # Load the CSV file containing image URLs.
+        try:
+            df = pd.read_csv(csv_file)
+        except Exception as e:
+            print(f"Error reading CSV file {csv_file}: {str(e)}")
+            exit(1)
+
+        if 'Image URL' not in df.columns:
+            print("CSV file must have a 'url' column.")
+            exit(1)
+        urls = df['Image URL'].fillna("").astype(str).tolist()
+
+    # Create a single output folder for the school
+    output_folder = f"../../data/processed/cropped_faces_{school_name}"
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Crops left by earlier runs may come from another URL list, so only this run's crops are mapped
+    before = list_crop_versions(output_folder)
+
+    model_server = connect_model_server(args.model_server) if args.model_server else None
+    clusters = near_duplicate_clusters(args.hash_distance) if args.near_duplicates else None
+    if args.batch_size:
+        total_face_count = run_batched(urls, output_folder, batch_size=args.batch_size, clusters=clusters)
+    elif args.serial:
+        total_face_count = run_serial(urls, output_folder, max_side=args.max_side, model_server=model_server,
+                                      clusters=clusters)
+    else:
+        total_face_count = run_pipeline(urls, output_folder, detect_workers=args.detect_workers,
+                                        max_side=args.max_side, model_server=model_server, clusters=clusters)
+    if model_server is not None:
+        model_server.close()
+    if clusters is not None:
+        print(f"Near-duplicate images: {clusters.report()}")
+
+    if store is not None:
+        from parquet_store import faces_rows
+        # Crop names carry the 1-based index of their image in `urls`
+        written_now = [name for name, mtime in list_crop_versions(output_folder).items() if before.get(name) != mtime]
+        written = store.write("faces", school_name, faces_rows(written_now, urls))
+        print(f"Faces table: {written} crops written to the store at: {args.store}")
+
+    print(f"Total faces cropped: {total_face_count}")
+    print(f"All cropped faces are saved in: {output_folder}")
@@ -1,60 +1,303 @@
 #!/usr/bin/env python3
 """
-Script to remove duplicate image URLs from a CSV file.
+Script to remove duplicate image URLs from the schools' crawled CSV files.
+
+All school CSVs are streamed row by row in one pass, and each unique row is
+written out as soon as it is read. Rows are compared on a normalized URL: the
+scheme, "www.", the query string and fragment, and CDN size suffixes such as
+"-300x200" are stripped, so resized copies of one image count once.
+
+Seen URLs are kept in memory by default. For incremental crawls they can be kept
+in a persisted Bloom filter (fixed size, tiny false-positive rate) or an on-disk
+hash set (exact, SQLite). Later runs then skip every URL handled by earlier runs
+without loading the history into memory.
+
+The unique rows are also written to the Parquet store (images and pages
+partitions of each school, see ../data_store/parquet_store.py); this replaces
+the school's images partition, so sacred.py's flags are set again by its next run.
+
+With --history only the URLs no earlier run has seen come out. They are written
+to <school>-school-image-urls-new.csv and appended to the school's -unique.csv
+and to its store partitions, which keep the rows (and sacred flags) of earlier runs.
+
+Usage:
+    python deduplicate.py                                   # every data/raw school CSV -> data/raw/deduplicate/
+    python deduplicate.py --inputs ../../data/raw/roncalli-school-image-urls.csv
+    python deduplicate.py --scope global                    # a URL is kept only for the first school it appears in
+    python deduplicate.py --history ../../data/cache/seen-image-urls.bloom
+    python deduplicate.py --history ../../data/cache/seen-image-urls.sqlite --history-type disk
 """
 
+import argparse
 import csv
+import glob
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+import sys
+from collections import Counter
+from urllib.parse import urlsplit
+
+RAW_DIR = "../../data/raw"
+OUTPUT_DIR = "../../data/raw/deduplicate"
+
+# WordPress/CDN resized variants: photo-300x200.jpg, photo-1024x683.jpg, photo-scaled.jpg
+SIZE_SUFFIX = re.compile(r"-(?:\d+x\d+|scaled)(?=\.[a-z0-9]+$)", re.IGNORECASE)
 
-def remove_duplicate_image_urls(input_file, output_file):
+
+def open_store(root):
+    """The ParquetStore from ../data_store."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_store"))
+    from parquet_store import ParquetStore
+    return ParquetStore(root)
+
+
+def normalize_image_url(url):
     """
-    Reads a CSV file, removes rows with duplicate image URLs,
+    Dedup key for an image URL: host (lowercased, without "www.") plus path, without
+    scheme, query, fragment or CDN size suffix.
+    """
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = SIZE_SUFFIX.sub("", parts.path)
+    return f"{host}{path}"
+
+
+class MemorySet:
+    """Seen keys in a Python set (the history is lost when the run ends)."""
+
+    def __init__(self):
+        self._keys = set()
+
+    def add(self, key):
+        """Adds a key; returns True if it was not seen before."""
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        return True
+
+    def close(self):
+        pass
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter persisted to `path`: a JSON header line followed by the bit array.
+    A "seen" answer can be a false positive (about `error_rate` at `capacity` keys); "new" is exact.
+    """
+
+    def __init__(self, path, capacity=1_000_000, error_rate=1e-4):
+        self.path = path
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                header = json.loads(f.readline())
+                self.bits = bytearray(f.read())
+            self.num_bits, self.num_hashes, self.count = header["num_bits"], header["num_hashes"], header["count"]
+        else:
+            self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+            self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+            self.bits = bytearray((self.num_bits + 7) // 8)
+            self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        new = False
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                new = True
+        self.count += int(new)
+        return new
+
+    def close(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            header = {"num_bits": self.num_bits, "num_hashes": self.num_hashes, "count": self.count}
+            f.write(json.dumps(header).encode() + b"\n")
+            f.write(self.bits)
+        os.replace(tmp_path, self.path)
+
+
+class DiskHashSet:
+    """Exact seen-set on disk: 16-byte key digests in an indexed SQLite table."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS seen (digest BLOB PRIMARY KEY) WITHOUT ROWID")
+        self._pending = 0
+
+    def add(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).digest()[:16]
+        new = self._conn.execute("INSERT OR IGNORE INTO seen (digest) VALUES (?)", (digest,)).rowcount == 1
+        self._pending += 1
+        if self._pending >= 10_000:
+            self._conn.commit()
+            self._pending = 0
+        return new
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+
+def open_seen_set(history=None, history_type=None, capacity=1_000_000):
+    """MemorySet without a history path; otherwise a BloomFilter or DiskHashSet (guessed from the extension)."""
+    if not history:
+        return MemorySet()
+    history_type = history_type or ("disk" if history.endswith((".sqlite", ".db")) else "bloom")
+    if history_type == "disk":
+        return DiskHashSet(history)
+    return BloomFilter(history, capacity=capacity)
+
+
+def get_school_name(csv_path):
+    name = os.path.basename(csv_path)
+    for suffix in ("-school-image-urls-unique.csv", "-school-image-urls.csv"):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+def discover_inputs(raw_dir=RAW_DIR):
+    """One CSV per school, preferring the crawler's raw output over an older -unique file."""
+    by_school = {}
+    for path in sorted(glob.glob(os.path.join(raw_dir, "*-school-image-urls*.csv"))):
+        school = get_school_name(path)
+        if school not in by_school or path.endswith("-school-image-urls.csv"):
+            by_school[school] = path
+    return [by_school[school] for school in sorted(by_school)]
+
+
+def remove_duplicate_image_urls(input_file, output_file, seen=None, key_prefix="", on_unique=None):
+    """
+    Streams a CSV file, dropping rows whose normalized image URL was already seen,
     and writes the unique rows to a new CSV file.
-    
+
     Args:
         input_file (str): Path to the input CSV file
         output_file (str): Path to the output CSV file
+        seen: Seen-set shared across files (and runs); a fresh MemorySet if omitted
+        key_prefix (str): Prepended to each key, e.g. the school name for per-school dedup
+        on_unique (callable): Called with (row, normalized URL) for each row written
+
+    Returns:
+        tuple: (rows read, rows written)
     """
+    seen = seen or MemorySet()
+    rows_in = rows_out = 0
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    tmp_file = output_file + ".tmp"
+    with open(input_file, 'r', newline='', encoding='utf-8') as infile, \
+            open(tmp_file, 'w', newline='', encoding='utf-8') as outfile:
+        reader = csv.DictReader(infile)
+        writer = csv.DictWriter(outfile, fieldnames=reader.fieldnames or ['Image URL'])
+        writer.writeheader()
+        for row in reader:
+            rows_in += 1
+            image_url = (row.get('Image URL') or "").strip()
+            normalized = normalize_image_url(image_url)
+            if image_url and seen.add(key_prefix + normalized):
+                writer.writerow(row)
+                rows_out += 1
+                if on_unique:
+                    on_unique(row, normalized)
+    os.replace(tmp_file, output_file)
+    return rows_in, rows_out
+
+
+def append_csv_rows(input_file, output_file):
+    """Appends the rows of `input_file` to `output_file` (created with the input's header if missing)."""
+    if not os.path.exists(output_file):
+        shutil.copyfile(input_file, output_file)
+        return
+    with open(output_file, 'r', newline='', encoding='utf-8') as f:
+        fieldnames = csv.DictReader(f).fieldnames or ['Image URL']
+    with open(input_file, 'r', newline='', encoding='utf-8') as infile, \
+            open(output_file, 'a', newline='', encoding='utf-8') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writerows(csv.DictReader(infile))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--inputs", nargs="+", help="CSV files to deduplicate (default: every school CSV in data/raw)")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Where <school>-school-image-urls-unique.csv goes")
+    parser.add_argument("--scope", choices=["school", "global"], default="school",
+                        help="Dedup within each school, or across all schools (first school wins)")
+    parser.add_argument("--history", help="Persisted seen-set (.bloom or .sqlite) shared with earlier runs")
+    parser.add_argument("--history-type", choices=["bloom", "disk"], help="Seen-set kind (default: from extension)")
+    parser.add_argument("--capacity", type=int, default=1_000_000, help="Expected URLs in a new Bloom filter")
+    parser.add_argument("--store", default="../../data/store", help="Parquet store directory")
+    parser.add_argument("--no-store", action="store_true", help="Only write the CSV files")
+    args = parser.parse_args()
+
+    inputs = args.inputs or discover_inputs()
+    if not inputs:
+        print(f"No school CSVs found in {RAW_DIR}")
+        return
+
+    store = None if args.no_store else open_store(args.store)
+    seen = open_seen_set(args.history, args.history_type, args.capacity)
+    total_in = total_out = 0
     try:
-        # Open input file and read all rows
-        with open(input_file, 'r', newline='', encoding='utf-8') as infile:
-            reader = csv.DictReader(infile)
-            
-            # Store all rows
-            all_rows = list(reader)
-            
-        print(f"Total rows before removing duplicates: {len(all_rows)}")
-        
-        # Process rows to remove duplicates
-        unique_rows = []
-        image_urls = set()
-        
-        for row in all_rows:
-            # Check if this image URL is already seen
-            image_url = row.get('Image URL')
-            if image_url and image_url not in image_urls:
-                image_urls.add(image_url)
-                unique_rows.append(row)
-        
-        print(f"Total rows after removing duplicates: {len(unique_rows)}")
-        print(f"Number of unique image URLs: {len(image_urls)}")
-        
-        # Write unique rows to output file
-        if unique_rows:
-            with open(output_file, 'w', newline='', encoding='utf-8') as outfile:
-                writer = csv.DictWriter(outfile, fieldnames=unique_rows[0].keys())
-                writer.writeheader()
-                writer.writerows(unique_rows)
-            
-            print(f"Successfully wrote {len(unique_rows)} unique rows to {output_file}")
-        else:
-            print("No unique rows found")
-            
-    except Exception as e:
-        print(f"Error: {str(e)}")
+        for input_file in inputs:
+            school = get_school_name(input_file)
+            output_file = os.path.join(args.output_dir, f"{school}-school-image-urls-unique.csv")
+            # With a history, only the delta comes out: keep it apart and append it to the full list
+            target_file = os.path.join(args.output_dir, f"{school}-school-image-urls-new.csv") \
+                if args.history else output_file
+            key_prefix = f"{school}\x00" if args.scope == "school" else ""
+            if store is None:
+                rows_in, rows_out = remove_duplicate_image_urls(input_file, target_file, seen, key_prefix)
+            else:
+                page_counts = Counter()
+                # With a history the earlier rows are streamed over in batches and the delta follows
+                with store.writer("images", school, keep_existing=bool(args.history)) as images:
+                    def add_image(row, normalized):
+                        page_url = row.get('Page URL') or None
+                        images.write({"image_url": row['Image URL'].strip(), "page_url": page_url,
+                                      "normalized_url": normalized, "sacred": None})
+                        if page_url:
+                            page_counts[page_url] += 1
+                    rows_in, rows_out = remove_duplicate_image_urls(input_file, target_file, seen, key_prefix,
+                                                                    on_unique=add_image)
+                with store.writer("pages", school) as pages:
+                    if args.history:
+                        for batch in store.iter_batches("pages", school):
+                            for page, count in zip(batch.column("page_url").to_pylist(),
+                                                   batch.column("image_count").to_pylist()):
+                                pages.write({"page_url": page, "image_count": count + page_counts.pop(page, 0)})
+                    pages.write_many({"page_url": page, "image_count": count} for page, count in page_counts.items())
+            if args.history:
+                append_csv_rows(target_file, output_file)
+            total_in += rows_in
+            total_out += rows_out
+            print(f"{school}: {rows_in} rows -> {rows_out} unique ({rows_in - rows_out} duplicates) -> {target_file}")
+    finally:
+        seen.close()
+
+    print(f"\nTotal rows before removing duplicates: {total_in}")
+    print(f"Total rows after removing duplicates: {total_out}")
+    if args.history:
+        print(f"Seen-set saved at: {args.history}")
+    if store is not None:
+        print(f"Images and pages written to the store at: {args.store}")
 
-# Set your input and output filenames here
-input_file = "data_collection/popeaceschools-school-image-urls.csv"  # Input file path
-output_file = "data_collection/popeaceschools-school-image-urls-unique.csv"  # Output file path
 
-# Run the function to remove duplicates
-remove_duplicate_image_urls(input_file, output_file)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Face detection helpers shared by data-cleaning.py and the detection benchmarks.
+
+`detect_faces` is the original one-image-at-a-time DeepFace/MTCNN call; given a
+`max_side` it detects on a downscaled copy and maps the boxes back to full
+resolution, so crops are still cut from the original pixels.
+`detect_faces_batch` loads the MTCNN networks once per process and runs them on
+batches of same-sized images: every image is letterboxed into the smallest size
+bucket that holds it, each bucket is detected in one call, and the boxes are
+mapped back to the coordinates of the source image.
+"""
+
+import cv2
+import numpy as np
+
+# Square canvas sizes (px) images are letterboxed into for batched detection
+DETECTION_BUCKETS = (320, 640, 1024)
+
+CROP_MARGIN = 30
+
+# Suggested longest side (px) for downscaled per-image detection. data-cleaning.py only downscales when
+# --max-side is given (full resolution by default); benchmark_detection.py checks a value on real images
+DETECTION_MAX_SIDE = 1280
+
+_batch_detector = None
+_batch_supported = None  # Whether the installed mtcnn takes a stack of images; found on the first call
+
+
+def downscale_for_detection(image, max_side=DETECTION_MAX_SIDE):
+    """
+    Shrinks an image so its longer side is at most `max_side` (never upscales).
+
+    Returns:
+        tuple: (image to detect on, scale factor from original to detection coordinates)
+    """
+    longest = max(image.shape[:2])
+    if not max_side or longest <= max_side:
+        return image, 1.0
+    scale = max_side / longest
+    size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+
+def remap_facial_area(facial_area, scale, image_shape):
+    """Maps an (x, y, w, h) box found at `scale` back onto the full-resolution image."""
+    if scale == 1.0:
+        return dict(facial_area)
+    height, width = image_shape[:2]
+    x = max(0, int(round(facial_area["x"] / scale)))
+    y = max(0, int(round(facial_area["y"] / scale)))
+    w = min(width - x, int(round(facial_area["w"] / scale)))
+    h = min(height - y, int(round(facial_area["h"] / scale)))
+    return {"x": x, "y": y, "w": w, "h": h}
+
+
+def detect_faces(image, max_side=None, model_server=None):
+    """
+    Runs DeepFace's MTCNN backend on one BGR image and returns its face dicts.
+
+    With `max_side`, detection runs on a downscaled copy and every `facial_area`
+    is remapped to the coordinates of the original image. With `model_server` (a
+    ModelClient), detection runs in the long-lived model worker and deepface is
+    never imported here.
+    """
+    small, scale = downscale_for_detection(image, max_side)
+    if model_server is not None:
+        faces = model_server.extract_faces(small, backend='mtcnn')
+    else:
+        from deepface import DeepFace
+        faces = DeepFace.extract_faces(img_path=small, detector_backend='mtcnn', enforce_detection=False)
+    if scale != 1.0:
+        for face in faces:
+            face["facial_area"] = remap_facial_area(face["facial_area"], scale, image.shape)
+    return faces
+
+
+def get_batch_detector():
+    """Loads the MTCNN model once per process."""
+    global _batch_detector
+    if _batch_detector is None:
+        from mtcnn import MTCNN
+        _batch_detector = MTCNN()
+    return _batch_detector
+
+
+def bucket_for(image, buckets=DETECTION_BUCKETS):
+    """Returns the smallest bucket that holds the image's longer side (or the largest bucket)."""
+    longest = max(image.shape[:2])
+    for size in buckets:
+        if longest <= size:
+            return size
+    return buckets[-1]
+
+
+def letterbox(image, size):
+    """
+    Fits a BGR image into a size x size RGB canvas without upscaling, padding the
+    bottom and right edges, so the original coordinates are just `box / scale`.
+
+    Returns:
+        tuple: (canvas, scale)
+    """
+    height, width = image.shape[:2]
+    scale = min(1.0, size / max(height, width))
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    canvas = np.zeros((size, size, 3), dtype=np.uint8)
+    canvas[:image.shape[0], :image.shape[1]] = image[:, :, ::-1]  # MTCNN expects RGB
+    return canvas, scale
+
+
+def _to_face(detection, scale, image_shape):
+    """Converts an MTCNN detection on a letterboxed canvas into a DeepFace-style face dict."""
+    x, y, w, h = detection["box"]
+    facial_area = remap_facial_area({"x": x, "y": y, "w": w, "h": h}, scale, image_shape)
+    return {"facial_area": facial_area, "confidence": float(detection["confidence"])}
+
+
+def _detect_stack(detector, batch, canvases):
+    """
+    One MTCNN call on a stack of canvases. Older mtcnn releases only take one image
+    per call and reject a stack (0.1.x raises its own InvalidImage); that is found
+    on the first call and every later batch goes one canvas at a time.
+    """
+    global _batch_supported
+    if _batch_supported is not False:
+        try:
+            detections = detector.detect_faces(batch)
+            _batch_supported = True
+            return detections
+        except Exception:
+            if _batch_supported:
+                raise
+            _batch_supported = False
+    return [detector.detect_faces(canvas) for canvas in canvases]
+
+
+def detect_faces_batch(images, batch_size=16, buckets=DETECTION_BUCKETS):
+    """
+    Detects faces in many BGR images with one MTCNN model and batched forward passes.
+
+    Args:
+        images (list): Decoded BGR images (any sizes)
+        batch_size (int): Images per forward pass
+        buckets (tuple): Letterbox sizes images are grouped by
+
+    Returns:
+        list: For each input image, a list of {"facial_area", "confidence"} dicts in its own coordinates
+    """
+    detector = get_batch_detector()
+    results = [[] for _ in images]
+
+    by_bucket = {}
+    for index, image in enumerate(images):
+        if image is not None:
+            by_bucket.setdefault(bucket_for(image, buckets), []).append(index)
+
+    for size, indices in by_bucket.items():
+        for start in range(0, len(indices), batch_size):
+            chunk = indices[start:start + batch_size]
+            boxed = [letterbox(images[index], size) for index in chunk]
+            batch = np.stack([canvas for canvas, _ in boxed])
+            detections = _detect_stack(detector, batch, [canvas for canvas, _ in boxed])
+            for index, (_, scale), image_detections in zip(chunk, boxed, detections):
+                results[index] = [_to_face(d, scale, images[index].shape) for d in image_detections]
+    return results
+
+
+def crop_with_margin(image, facial_area, margin=CROP_MARGIN):
+    """Crops a detected face plus a margin, clipped to the image."""
+    x, y, w, h = facial_area['x'], facial_area['y'], facial_area['w'], facial_area['h']
+    x = max(0, x - margin)
+    y = max(0, y - margin)
+    w = min(image.shape[1] - x, w + 2 * margin)
+    h = min(image.shape[0] - y, h + 2 * margin)
+    return image[y:y+h, x:x+w]
@@ -0,0 +1,249 @@
+"""
+Concurrent image download stage with pooled sessions and an on-disk cache.
+
+Sessions are kept per host so connections are reused, requests have timeouts and
+are retried with exponential backoff, and every response body is stored in a
+content-addressed cache. Cached URLs are revalidated with ETag / Last-Modified,
+so re-running a school does not download unchanged images again; entries whose
+server sent neither validator are reused for `max_age` seconds instead. A URL
+that answers 404 or 410 is evicted, and other client errors are not answered
+from the cache: a stale copy is only served when the server is unreachable.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CACHE_DIR = "../../data/cache/images"
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Connection': 'keep-alive'
+}
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+GONE_STATUS_CODES = {404, 410}
+DEFAULT_MAX_AGE = 7 * 24 * 3600  # Seconds an entry without ETag / Last-Modified is used without a request
+
+
+class DownloadCache:
+    """
+    Content-addressed store for downloaded images.
+
+    Bodies live in `blobs/<sha[:2]>/<sha256>`, and a small JSON entry per URL in
+    `index/` records the blob hash, the ETag / Last-Modified validators and when it was fetched.
+    Identical images served under different URLs share one blob.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(os.path.join(cache_dir, "index"), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, "blobs"), exist_ok=True)
+
+    def _entry_path(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "index", f"{key}.json")
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, "blobs", digest[:2], digest)
+
+    def lookup(self, url):
+        """Returns the cache entry for a URL, or None if it is missing or its blob is gone."""
+        try:
+            with open(self._entry_path(url), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if os.path.exists(self._blob_path(entry["sha256"])) else None
+
+    def read(self, entry):
+        with open(self._blob_path(entry["sha256"]), "rb") as f:
+            return f.read()
+
+    def store(self, url, content, etag=None, last_modified=None):
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            tmp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, blob_path)
+
+        entry = {"url": url, "sha256": digest, "etag": etag, "last_modified": last_modified,
+                 "fetched_at": time.time()}
+        entry_path = self._entry_path(url)
+        tmp_path = f"{entry_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, entry_path)
+        return entry
+
+    def evict(self, url):
+        """Forgets a URL (its blob stays, it may be shared with other URLs)."""
+        try:
+            os.remove(self._entry_path(url))
+        except FileNotFoundError:
+            pass
+
+
+class ImageDownloader:
+    """
+    Downloads images concurrently through per-host pooled sessions and a DownloadCache.
+
+    Args:
+        cache_dir (str): Directory of the on-disk cache (None disables caching)
+        max_workers (int): Concurrent downloads
+        timeout (tuple): (connect, read) timeout in seconds
+        retries (int): Extra attempts for timeouts, connection errors, 429 and 5xx
+        backoff (float): Base delay in seconds for the exponential backoff
+        max_age (float): Seconds a cached image without validators is served without a request
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_workers=8, timeout=(5, 20), retries=3, backoff=0.5,
+                 max_age=DEFAULT_MAX_AGE):
+        self.cache = DownloadCache(cache_dir) if cache_dir else None
+        self.max_age = max_age
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = Counter()
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _session(self, url):
+        """Returns the pooled session for the URL's host, creating it on first use."""
+        parts = urlsplit(url)
+        host = parts.netloc.lower()
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.headers.update(HEADERS)
+                # Tells the server where the request is coming from; some hosts refuse hotlinks without it
+                session.headers['Referer'] = f"{parts.scheme}://{parts.netloc}"
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+            return session
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _sleep_before_retry(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = float(retry_after)
+        else:
+            delay = self.backoff * (2 ** attempt)
+        time.sleep(delay + random.uniform(0, self.backoff))
+
+    def fetch(self, url):
+        """
+        Downloads one image, using the cache when the server reports it unchanged.
+
+        Returns:
+            bytes or None: The image bytes, or None if the download failed
+        """
+        entry = self.cache.lookup(url) if self.cache else None
+        if entry and not entry.get("etag") and not entry.get("last_modified") and \
+                time.time() - entry.get("fetched_at", 0) < self.max_age:
+            # Nothing to revalidate with: trust the copy until it is max_age old
+            self._count("cache_hit")
+            return self.cache.read(entry)
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        session = self._session(url)
+        for attempt in range(self.retries + 1):
+            try:
+                response = session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                if attempt == self.retries:
+                    print(f"Exception occurred while downloading image: {str(e)}")
+                    break
+                self._sleep_before_retry(attempt)
+                continue
+            except requests.RequestException as e:
+                print(f"Exception occurred while downloading image: {str(e)}")
+                break
+
+            if response.status_code == 304 and entry:
+                self._count("cache_hit")
+                return self.cache.read(entry)
+            if response.status_code == 200:
+                content = response.content
+                if self.cache:
+                    self.cache.store(url, content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+                self._count("downloaded")
+                return content
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.retries:
+                self._sleep_before_retry(attempt, response)
+                continue
+            print(f"Failed to download image. Status code: {response.status_code}")
+            if response.status_code in GONE_STATUS_CODES and entry:
+                self.cache.evict(url)  # The image was deleted; don't keep serving it
+            if response.status_code < 500 and response.status_code != 429:
+                self._count("failed")
+                return None
+            break
+
+        # Serve a stale copy rather than nothing when the server is unreachable
+        if entry:
+            self._count("stale_cache_hit")
+            return self.cache.read(entry)
+        self._count("failed")
+        return None
+
+    def download_all(self, urls):
+        """
+        Downloads URLs concurrently, keeping at most 2 x max_workers requests in flight.
+
+        Yields:
+            tuple: (index, url, bytes or None) in completion order
+        """
+        url_iter = iter(enumerate(urls))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = {}
+
+            def submit_next():
+                try:
+                    index, url = next(url_iter)
+                except StopIteration:
+                    return False
+                in_flight[executor.submit(self.fetch, url)] = (index, url)
+                return True
+
+            for _ in range(2 * self.max_workers):
+                if not submit_next():
+                    break
+            while in_flight:
+                done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    index, url = in_flight.pop(future)
+                    yield index, url, future.result()
+                    submit_next()
+
+    def report(self):
+        return ", ".join(f"{key}={self.stats[key]}" for key in ("downloaded", "cache_hit", "stale_cache_hit", "failed"))
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
@@ -0,0 +1,210 @@
+"""
+Staged pipeline executor with bounded queues between the stages.
+
+Each stage runs on its own pool of worker threads; stages marked `processes=True`
+hand their work to a process pool (one in-flight task per feeder thread), which
+keeps CPU-heavy work such as face detection off the GIL. Every queue is bounded,
+so a slow stage throttles the stages before it and memory stays flat.
+"""
+
+import multiprocessing
+import queue
+import threading
+import time
+import concurrent.futures
+
+_DONE = object()  # Sentinel passed down the pipeline when a stage has finished
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Args:
+        name (str): Label used in the statistics
+        func (callable): Called with one item; returns the item for the next stage,
+            None to drop it, or a list of items when `fan_out` is set
+        workers (int): Threads (or processes) running this stage
+        processes (bool): Run `func` in a process pool instead of in the threads
+        queue_size (int): Capacity of the queue feeding this stage
+        fan_out (bool): Treat the return value as a list of items
+    """
+
+    def __init__(self, name, func, workers=1, processes=False, queue_size=None, fan_out=False,
+                 initializer=None, initargs=()):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.processes = processes
+        self.queue_size = queue_size or 2 * workers
+        self.fan_out = fan_out
+        self.initializer = initializer
+        self.initargs = initargs
+        # Statistics
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+        self.errors = 0
+        self.depth_samples = 0
+        self.depth_total = 0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def _record(self, items_out, seconds, error=False):
+        with self._lock:
+            self.items_in += 1
+            self.items_out += items_out
+            self.busy_seconds += seconds
+            self.errors += int(error)
+
+    def _sample_depth(self, depth):
+        with self._lock:
+            self.depth_samples += 1
+            self.depth_total += depth
+            self.max_depth = max(self.max_depth, depth)
+
+
+class Pipeline:
+    """
+    Runs a source iterable through a list of stages and collects the output of the last one.
+
+    Example:
+        pipeline = Pipeline([Stage("download", fetch, workers=8),
+                             Stage("detect", detect, workers=4, processes=True)])
+        results = pipeline.run(urls)
+        print(pipeline.report())
+    """
+
+    def __init__(self, stages, mp_context="spawn"):
+        self.stages = stages
+        self.mp_context = mp_context
+        self.wall_seconds = 0.0
+
+    def _run_stage(self, stage, in_queue, out_queue, executor, remaining, remaining_lock):
+        while True:
+            item = in_queue.get()
+            if item is _DONE:
+                break
+            started = time.perf_counter()
+            try:
+                if executor is not None:
+                    result = executor.submit(stage.func, item).result()
+                else:
+                    result = stage.func(item)
+            except Exception as e:
+                print(f"[{stage.name}] ❌ Error: {e}")
+                stage._record(0, time.perf_counter() - started, error=True)
+                continue
+            results = (result or []) if stage.fan_out else ([] if result is None else [result])
+            stage._record(len(results), time.perf_counter() - started)
+            for result in results:
+                out_queue.put(result)
+                self._sample(out_queue)
+
+        # The last worker of a stage tells every worker of the next stage to stop
+        with remaining_lock:
+            remaining[stage.name] -= 1
+            last = remaining[stage.name] == 0
+        if last:
+            for _ in range(self._consumers[id(out_queue)]):
+                out_queue.put(_DONE)
+
+    def _sample(self, q):
+        stage = self._queue_owner.get(id(q))
+        if stage is not None:
+            stage._sample_depth(q.qsize())
+
+    def run(self, source, on_result=None):
+        """
+        Feeds every item of `source` through the stages.
+
+        Args:
+            source (iterable): Items for the first stage
+            on_result (callable): Called in the main thread for each output item;
+                if omitted the outputs are collected and returned
+
+        Returns:
+            list: Outputs of the last stage (empty if `on_result` was given)
+        """
+        started = time.perf_counter()
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        results_queue = queue.Queue(maxsize=2 * max(stage.workers for stage in self.stages))
+        queues.append(results_queue)
+
+        # Which stage reads from a queue (for depth stats) and how many readers it has
+        self._queue_owner = {id(q): stage for q, stage in zip(queues, self.stages)}
+        self._consumers = {id(q): stage.workers for q, stage in zip(queues, self.stages)}
+        self._consumers[id(results_queue)] = 1
+
+        remaining = {stage.name: stage.workers for stage in self.stages}
+        remaining_lock = threading.Lock()
+        executors = []
+        threads = []
+        for i, stage in enumerate(self.stages):
+            executor = None
+            if stage.processes:
+                executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=stage.workers,
+                    mp_context=multiprocessing.get_context(self.mp_context),
+                    initializer=stage.initializer,
+                    initargs=stage.initargs,
+                )
+                executors.append(executor)
+            for _ in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._run_stage,
+                    args=(stage, queues[i], queues[i + 1], executor, remaining, remaining_lock),
+                    name=f"{stage.name}-worker",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        def feed():
+            try:
+                for item in source:
+                    queues[0].put(item)
+                    self._sample(queues[0])
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_DONE)
+
+        feeder = threading.Thread(target=feed, name="pipeline-feeder", daemon=True)
+        feeder.start()
+
+        outputs = []
+        try:
+            while True:
+                item = results_queue.get()
+                if item is _DONE:
+                    break
+                if on_result:
+                    on_result(item)
+                else:
+                    outputs.append(item)
+        except BaseException:
+            # Workers are daemon threads; just stop handing out new process work
+            for executor in executors:
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        feeder.join()
+        for thread in threads:
+            thread.join()
+        for executor in executors:
+            executor.shutdown()
+        self.wall_seconds = time.perf_counter() - started
+        return outputs
+
+    def report(self):
+        """Returns per-stage throughput and queue-depth statistics as printable lines."""
+        lines = [f"Pipeline wall time: {self.wall_seconds:.1f}s"]
+        for stage in self.stages:
+            throughput = stage.items_in / self.wall_seconds if self.wall_seconds else 0.0
+            mean_depth = stage.depth_total / stage.depth_samples if stage.depth_samples else 0.0
+            utilization = stage.busy_seconds / (stage.workers * self.wall_seconds) if self.wall_seconds else 0.0
+            lines.append(
+                f" - {stage.name:<10} in={stage.items_in:<6} out={stage.items_out:<6} errors={stage.errors:<4} "
+                f"{throughput:6.2f} items/s  busy={100 * utilization:5.1f}%  "
+                f"queue depth mean={mean_depth:.1f} max={stage.max_depth}/{stage.queue_size}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+asyncio crawl engine that crawls every school site from a single process.
+
+Each site gets its own frontier queue and page budget, every host is guarded by a
+semaphore with a politeness delay, and the blocking fetches (static HTTP first,
+pooled Selenium as fallback) run on worker threads. Output files use the same
+`get_filename` CSV layout as image-scrapping-1.py / image-scrapping-2.py, and rows
+are streamed to them through a CrawlState so `--resume` can continue a crawl.
+
+Usage:
+    python async_crawler.py                      # all schools found in data/raw
+    python async_crawler.py --schools scecina roncalli --max-pages 200
+    python async_crawler.py --resume             # continue after a crash
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import glob
+import logging
+import os
+import time
+from urllib.parse import urljoin, urlparse
+
+from bs4 import BeautifulSoup
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+from crawl_state import CrawlState, get_state_filename
+from driver_pool import DriverPool
+from page_fetcher import StaticFetcher, SELENIUM
+from url_filters import FrontierFilter
+from image_sources import extract_image_urls
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+)
+logger = logging.getLogger(__name__)
+
+# Home pages of the schools whose image lists live in data/raw
+SCHOOL_SITES = {
+    "bishopchatard": "https://www.bishopchatard.org/",
+    "cardinalritter": "https://www.cardinalritter.org/",
+    "cristoreyindy": "https://www.cristoreyindy.org/",
+    "gocathedral": "https://www.gocathedral.com/",
+    "lumenchristischool": "https://www.lumenchristischool.org/",
+    "oldenburgacademy": "https://www.oldenburgacademy.org/",
+    "popeaceschools": "https://www.popeaceschools.org/",
+    "providencehigh": "https://www.providencehigh.net/",
+    "roncalli": "https://www.roncalli.org/",
+    "scecina": "https://scecina.org/",
+    "setonschools": "https://www.setonschools.org/",
+}
+
+RAW_DATA_DIR = "../../data/raw"
+
+# Setup Selenium WebDriver options (shared by every site)
+options = Options()
+options.add_argument("--headless")  # Run in headless mode
+options.add_argument("--disable-blink-features=AutomationControlled")  # Prevent bot detection
+options.add_argument("--disable-gpu")
+options.add_argument("--no-sandbox")
+options.add_argument("--disable-dev-shm-usage")
+options.add_experimental_option("excludeSwitches", ["enable-automation"])
+options.add_experimental_option("useAutomationExtension", False)
+
+STEALTH_SCRIPT = "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+
+
+def discover_schools(raw_dir=RAW_DATA_DIR):
+    """Returns the school names that have an image list in data/raw."""
+    pattern = os.path.join(raw_dir, "*-school-image-urls-unique.csv")
+    return sorted(os.path.basename(path).split("-school-image-urls")[0] for path in glob.glob(pattern))
+
+
+def get_filename(url):
+    """Extracts the main part of the domain from a URL and returns a filename."""
+    parsed_url = urlparse(url)
+    domain = parsed_url.netloc
+    if domain.startswith("www."):
+        domain = domain[4:]
+    domain = domain.split('.')[0]
+    filename = f"{domain}-school-image-urls.csv"
+    return filename
+
+
+def parse_page(driver, url):
+    """Fetches and parses a web page with Selenium and an explicit wait."""
+    try:
+        driver.get(url)
+        try:
+            WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.TAG_NAME, "img")))
+        except TimeoutException:
+            logger.warning(f"Timeout waiting for images on {url}")
+        return BeautifulSoup(driver.page_source, "html.parser")
+    except WebDriverException as e:
+        if not isinstance(e, TimeoutException):
+            raise  # Chrome crashed or lost its session: let the pool discard this driver
+        logger.error(f"Error loading {url}: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"Error loading {url}: {e}")
+        return None
+
+
+def extract_page(soup, url, url_filter):
+    """Returns the image URLs on a page and the canonical links that may enter the frontier."""
+    img_urls = extract_image_urls(soup, url)
+    links = {url_filter.admit(urljoin(url, a["href"])) for a in soup.find_all("a", href=True)}
+    links.discard(None)
+    return img_urls, links
+
+
+class HostLimiter:
+    """
+    Per-host concurrency limit plus a minimum delay between requests to the same host.
+
+    Args:
+        per_host (int): Concurrent requests allowed against one host
+        delay (float): Seconds to keep between the start of two requests to one host
+    """
+
+    def __init__(self, per_host=2, delay=0.5):
+        self.per_host = per_host
+        self.delay = delay
+        self._semaphores = {}
+        self._last_request = {}
+        self._delay_locks = {}
+
+    def _host(self, url):
+        return urlparse(url).netloc.lower()
+
+    async def __call__(self, url, fetch):
+        """Runs `fetch()` in a thread once the host has a free slot and the delay has passed."""
+        host = self._host(url)
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.per_host))
+        delay_lock = self._delay_locks.setdefault(host, asyncio.Lock())
+        async with semaphore:
+            async with delay_lock:
+                wait = self._last_request.get(host, 0.0) + self.delay - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._last_request[host] = time.monotonic()
+            return await asyncio.to_thread(fetch)
+
+
+class SiteCrawler:
+    """
+    Crawls one site through an asyncio frontier queue until it is exhausted
+    or `max_pages` pages have been fetched. Pages and image rows are persisted
+    through `state` as they finish.
+    """
+
+    def __init__(self, base_url, limiter, pool, state, max_pages=100, concurrency=4, fetch_mode="hybrid"):
+        if not base_url.endswith("/"):
+            base_url += "/"
+        self.base_url = base_url
+        self.url_filter = FrontierFilter(base_url)
+        self.limiter = limiter
+        self.pool = pool
+        self.state = state
+        self.max_pages = max_pages
+        self.concurrency = concurrency
+        self.fetcher = StaticFetcher(pool_size=concurrency) if fetch_mode == "hybrid" else None
+        self.frontier = asyncio.Queue()
+        self.visited_urls = set()
+        self.pages_started = 0
+        self.pages_done = 0
+        self._budget_spent = asyncio.Event()
+
+    def _fetch(self, url):
+        """Blocking fetch: static HTML first, pooled WebDriver as fallback."""
+        soup = self.fetcher.fetch(url) if self.fetcher else None
+        if soup is None:
+            try:
+                with self.pool.driver() as driver:
+                    if not driver:
+                        logger.error(f"No WebDriver available, skipping {url}")
+                        return None
+                    soup = parse_page(driver, url)
+            except WebDriverException as e:
+                logger.error(f"WebDriver failed on {url}, replacing it: {e}")
+                return None
+            if soup and self.fetcher:
+                self.fetcher.record(SELENIUM)
+        return soup
+
+    def _enqueue(self, url):
+        if url not in self.visited_urls:
+            self.visited_urls.add(url)
+            self.frontier.put_nowait(url)
+
+    async def _process(self, url, soup):
+        """Persists a fetched page (SQLite, off the event loop) and queues its new links."""
+        if soup:
+            img_urls, links = extract_page(soup, url, self.url_filter)
+            new_links = [link for link in links if link not in self.visited_urls]
+            await asyncio.to_thread(self.state.record_page, url, img_urls, new_links)
+            for link in new_links:
+                self._enqueue(link)
+        else:
+            # Retried by --resume up to MAX_ATTEMPTS times
+            await asyncio.to_thread(self.state.record_failure, url)
+
+    async def _worker(self):
+        while True:
+            url = await self.frontier.get()
+            try:
+                # Reserve a page from the budget before fetching so we never overshoot it
+                if self.pages_started >= self.max_pages:
+                    continue
+                self.pages_started += 1
+                logger.info(f"Crawling: {url}")
+                try:
+                    soup = await self.limiter(url, lambda: self._fetch(url))
+                except Exception as e:
+                    logger.error(f"Error processing {url}: {e}")
+                    soup = None
+                self.pages_done += 1
+                try:
+                    await self._process(url, soup)
+                except Exception as e:
+                    # A bad page must not end this worker, or the frontier stops draining
+                    logger.error(f"Error processing {url}: {e}")
+                if self.pages_done >= self.max_pages:
+                    self._budget_spent.set()
+            finally:
+                self.frontier.task_done()
+
+    async def crawl(self):
+        """Crawls the site, resuming from the unfinished pages in `state`, and returns the image count."""
+        self.visited_urls.update(self.state.visited_urls())
+        self.pages_started = self.pages_done = self.state.page_count()
+        if self.pages_done >= self.max_pages:
+            return self.state.image_count()
+        for url in self.state.seed(self.url_filter.base_url):
+            self._enqueue(url)
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        drained = asyncio.create_task(self.frontier.join())
+        budget = asyncio.create_task(self._budget_spent.wait())
+        try:
+            await asyncio.wait({drained, budget}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # Cancel idle workers (and anything still queued) once the site is done
+            for task in workers + [drained, budget]:
+                task.cancel()
+            await asyncio.gather(*workers, drained, budget, return_exceptions=True)
+            logger.info(self.url_filter.report(self.base_url))
+            if self.fetcher:
+                logger.info(self.fetcher.report(self.base_url))
+                self.fetcher.close()
+        image_count = self.state.image_count()
+        logger.info(f"Finished {self.base_url}: {self.pages_done} pages, {image_count} images")
+        return image_count
+
+
+async def crawl_all(base_urls, max_pages=100, per_host=2, delay=0.5, concurrency=4,
+                    browser_slots=4, fetch_mode="hybrid", output_dir=".", resume=False):
+    """Crawls every site concurrently, streaming one CSV per site, and returns the CSV paths."""
+    loop = asyncio.get_running_loop()
+    # One thread per in-flight fetch across all sites
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(len(base_urls) * concurrency, 1)))
+    limiter = HostLimiter(per_host=per_host, delay=delay)
+
+    filenames = [os.path.join(output_dir, get_filename(url)) for url in base_urls]
+    states = [CrawlState(get_state_filename(filename), filename, resume=resume) for filename in filenames]
+    try:
+        with DriverPool(options, STEALTH_SCRIPT, max_drivers=browser_slots) as pool:
+            crawlers = [SiteCrawler(url, limiter, pool, state, max_pages, concurrency, fetch_mode)
+                        for url, state in zip(base_urls, states)]
+            results = await asyncio.gather(*(crawler.crawl() for crawler in crawlers), return_exceptions=True)
+    finally:
+        for state in states:
+            state.close()
+
+    for crawler, filename, result in zip(crawlers, filenames, results):
+        if isinstance(result, Exception):
+            logger.error(f"Crawl of {crawler.base_url} failed: {result}")
+        else:
+            logger.info(f"Saved {result} image URLs to {filename}")
+    return filenames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crawl all school sites concurrently.")
+    parser.add_argument("--schools", nargs="*", help="School names (default: every school in data/raw)")
+    parser.add_argument("--raw-dir", default=RAW_DATA_DIR, help="Directory with the *-school-image-urls-unique.csv files")
+    parser.add_argument("--max-pages", type=int, default=100, help="Page budget per site")
+    parser.add_argument("--per-host", type=int, default=2, help="Concurrent requests per host")
+    parser.add_argument("--delay", type=float, default=0.5, help="Politeness delay per host in seconds")
+    parser.add_argument("--concurrency", type=int, default=4, help="Worker tasks per site")
+    parser.add_argument("--browser-slots", type=int, default=4, help="Chrome instances shared by all sites")
+    parser.add_argument("--fetch-mode", choices=["hybrid", "selenium"], default="hybrid")
+    parser.add_argument("--output-dir", default=".", help="Where to write the per-site CSV files")
+    parser.add_argument("--resume", action="store_true", help="Continue interrupted crawls from their state files")
+    args = parser.parse_args()
+
+    schools = args.schools or discover_schools(args.raw_dir)
+    unknown = [school for school in schools if school not in SCHOOL_SITES]
+    if unknown:
+        logger.warning(f"No base URL known for: {', '.join(unknown)}")
+    base_urls = [SCHOOL_SITES[school] for school in schools if school in SCHOOL_SITES]
+    if not base_urls:
+        logger.error("Nothing to crawl")
+        return
+
+    asyncio.run(crawl_all(base_urls, args.max_pages, args.per_host, args.delay, args.concurrency,
+                          args.browser_slots, args.fetch_mode, args.output_dir, args.resume))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+SQLite-backed crawl state so that an interrupted crawl can be resumed.
+
+The store keeps the frontier (every URL ever discovered, with its status) and
+the discovered image rows. Each finished page is committed in one transaction
+and its rows are appended to the output CSV immediately, so nothing has to be
+held in memory until the end of the crawl. Pages whose fetch failed are kept
+as failed with an attempt count, and a resumed crawl retries them up to
+`max_attempts` times.
+"""
+
+import csv
+import os
+import sqlite3
+import threading
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+MAX_ATTEMPTS = 3  # Fetches of a failing page (across resumed runs) before it is given up
+
+CSV_COLUMNS = ["Page URL", "Image URL"]
+
+
+def get_state_filename(csv_filename):
+    """Returns the state database path that belongs to an output CSV."""
+    root, _ = os.path.splitext(csv_filename)
+    return f"{root}.crawl-state.sqlite"
+
+
+class CrawlState:
+    """
+    Persistent frontier, visited set and image rows for one site.
+
+    Args:
+        db_path (str): SQLite file holding the state
+        csv_path (str): Output CSV the image rows are streamed to
+        resume (bool): Continue from an existing state file instead of starting over
+        unique_images (bool): Keep only the first page an image URL was seen on
+        max_attempts (int): Fetches of a failed page before a resume stops retrying it
+    """
+
+    def __init__(self, db_path, csv_path, resume=False, unique_images=False, max_attempts=MAX_ATTEMPTS):
+        if not resume:
+            # The WAL and shared-memory files belong to the old database and must go with it
+            for path in (db_path, db_path + "-wal", db_path + "-shm", csv_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.db_path = db_path
+        self.csv_path = csv_path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS frontier (
+                url TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                page_url TEXT NOT NULL,
+                image_url TEXT NOT NULL
+            );
+        """)
+        # State files from before failed pages were tracked have no attempts column
+        if "attempts" not in {row[1] for row in self._conn.execute("PRAGMA table_info(frontier)")}:
+            self._conn.execute("ALTER TABLE frontier ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        if unique_images:
+            self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS images_unique ON images (image_url)")
+        else:
+            self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS images_page ON images (page_url, image_url)")
+        self._conn.commit()
+
+        # Rebuild the CSV from the committed rows so it matches the store exactly,
+        # dropping anything written for a page that never finished.
+        self._csv_file = open(csv_path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._csv_file)
+        self._writer.writerow(CSV_COLUMNS)
+        for row in self._conn.execute("SELECT page_url, image_url FROM images ORDER BY id"):
+            self._writer.writerow(row)
+        self._csv_file.flush()
+
+    def seed(self, base_url):
+        """
+        Returns the URLs the crawl should (re)start from: the base URL for a fresh
+        crawl, or every page that was discovered but not finished for a resumed one,
+        plus the failed pages that have attempts left.
+        """
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO frontier (url, status) VALUES (?, ?)", (base_url, PENDING))
+            self._conn.commit()
+            return [url for (url,) in self._conn.execute(
+                "SELECT url FROM frontier WHERE status = ? OR (status = ? AND attempts < ?) ORDER BY rowid",
+                (PENDING, FAILED, self.max_attempts))]
+
+    def visited_urls(self):
+        """Returns the set of pages that were fully processed in earlier runs."""
+        with self._lock:
+            return {url for (url,) in self._conn.execute("SELECT url FROM frontier WHERE status = ?", (DONE,))}
+
+    def page_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM frontier WHERE status = ?", (DONE,)).fetchone()[0]
+
+    def image_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def record_page(self, page_url, img_urls, links):
+        """
+        Atomically stores the images and outgoing links of a finished page,
+        marks it done and streams the new image rows to the CSV.
+
+        Returns:
+            list: The [page URL, image URL] rows that were new
+        """
+        with self._lock:
+            new_rows = []
+            with self._conn:
+                for img_url in img_urls:
+                    cursor = self._conn.execute(
+                        "INSERT OR IGNORE INTO images (page_url, image_url) VALUES (?, ?)", (page_url, img_url))
+                    if cursor.rowcount:
+                        new_rows.append([page_url, img_url])
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO frontier (url, status) VALUES (?, ?)",
+                    [(link, PENDING) for link in links])
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO frontier (url, status) VALUES (?, ?)", (page_url, DONE))
+            self._writer.writerows(new_rows)
+            self._csv_file.flush()
+            return new_rows
+
+    def record_failure(self, page_url):
+        """Marks a page whose fetch failed, so a resumed crawl retries it (up to `max_attempts` fetches)."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO frontier (url, status, attempts) VALUES (?, ?, 1) "
+                    "ON CONFLICT (url) DO UPDATE SET status = excluded.status, attempts = attempts + 1",
+                    (page_url, FAILED))
+
+    def close(self):
+        with self._lock:
+            self._csv_file.close()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
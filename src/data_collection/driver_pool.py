@@ -0,0 +1,161 @@
+"""
+Bounded pool of long-lived Chrome WebDrivers shared by the crawler threads.
+
+Launching Chrome (and resolving the chromedriver binary) for every page dominated
+crawl time, so the crawlers now borrow a driver from this pool per page and hand
+it back afterwards. Drivers are recycled after a fixed number of pages or as soon
+as they stop responding.
+"""
+
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+logger = logging.getLogger(__name__)
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+
+def get_driver_path():
+    """Resolves the chromedriver binary once per process and caches the path."""
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path is None:
+            _driver_path = ChromeDriverManager().install()
+    return _driver_path
+
+
+class DriverPool:
+    """
+    Keeps at most `max_drivers` Chrome instances alive and lends them out one at a time.
+
+    Size the pool to the number of crawler threads so that every worker effectively
+    owns one long-lived driver.
+
+    Args:
+        options (Options): Chrome options used for every driver in the pool
+        stealth_script (str): JavaScript registered via CDP on every new document
+        max_drivers (int): Upper bound on concurrently running Chrome instances
+        max_pages_per_driver (int): Pages served before a driver is replaced
+    """
+
+    def __init__(self, options, stealth_script=None, max_drivers=5, max_pages_per_driver=50):
+        self.options = options
+        self.stealth_script = stealth_script
+        self.max_pages_per_driver = max_pages_per_driver
+        self._slots = threading.BoundedSemaphore(max_drivers)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._page_counts = {}
+        self._script_ids = {}
+        self._all_drivers = set()
+        self._closed = False
+
+    def _create_driver(self):
+        driver = webdriver.Chrome(service=Service(get_driver_path()), options=self.options)
+        with self._lock:
+            self._page_counts[id(driver)] = 0
+            self._all_drivers.add(driver)
+        self._install_stealth_script(driver)
+        return driver
+
+    def _install_stealth_script(self, driver):
+        if not self.stealth_script:
+            return
+        old_id = self._script_ids.pop(id(driver), None)
+        if old_id is not None:
+            driver.execute_cdp_cmd("Page.removeScriptToEvaluateOnNewDocument", {"identifier": old_id})
+        result = driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
+            "source": self.stealth_script
+        })
+        self._script_ids[id(driver)] = result.get("identifier") if result else None
+
+    def _reset_driver(self, driver):
+        """Clears per-page state so the next page starts from a clean session."""
+        driver.delete_all_cookies()
+        driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+        driver.get("about:blank")
+        self._install_stealth_script(driver)
+
+    def _discard_driver(self, driver):
+        with self._lock:
+            self._page_counts.pop(id(driver), None)
+            self._script_ids.pop(id(driver), None)
+            self._all_drivers.discard(driver)
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Error shutting down WebDriver: {e}")
+
+    def acquire(self):
+        """Borrows a driver from the pool, starting a new one if none is idle."""
+        if self._closed:
+            raise RuntimeError("DriverPool is closed")
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._create_driver()
+        except Exception as e:
+            self._slots.release()
+            logger.error(f"Error creating WebDriver: {e}")
+            return None
+
+    def release(self, driver, broken=False):
+        """
+        Returns a borrowed driver. Drivers that crashed, failed to reset or reached
+        `max_pages_per_driver` are shut down instead of being reused.
+        """
+        if driver is None:
+            return
+        try:
+            with self._lock:
+                self._page_counts[id(driver)] = self._page_counts.get(id(driver), 0) + 1
+                worn_out = self._page_counts[id(driver)] >= self.max_pages_per_driver
+            if broken or worn_out or self._closed:
+                self._discard_driver(driver)
+                return
+            try:
+                self._reset_driver(driver)
+            except Exception as e:
+                logger.warning(f"WebDriver failed to reset, recycling it: {e}")
+                self._discard_driver(driver)
+                return
+            self._idle.put(driver)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def driver(self):
+        """Context manager form of acquire/release; yields None if Chrome failed to start."""
+        driver = self.acquire()
+        broken = False
+        try:
+            yield driver
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self.release(driver, broken=broken)
+
+    def close(self):
+        """Shuts down every driver the pool has started."""
+        self._closed = True
+        with self._lock:
+            drivers = list(self._all_drivers)
+        for driver in drivers:
+            self._discard_driver(driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
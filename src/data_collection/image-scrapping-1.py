@@ -98,20 +98,23 @@
 #     driver.quit()
 
 
+import argparse
 import concurrent.futures
 import threading
 import queue
 import time
 from urllib.parse import urljoin, urlparse
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from bs4 import BeautifulSoup
-import pandas as pd
+from crawl_state import CrawlState, get_state_filename
+from page_fetcher import StaticFetcher, SELENIUM
+from url_filters import FrontierFilter
+from image_sources import extract_image_urls
+from driver_pool import DriverPool
 
 # Setup Selenium WebDriver
 options = Options()
@@ -120,17 +123,17 @@ options.add_argument("--disable-blink-features=AutomationControlled")  # Prevent
 options.add_experimental_option("excludeSwitches", ["enable-automation"])
 options.add_experimental_option("useAutomationExtension", False)
 
-# Initialize WebDriver (each thread gets its own WebDriver)
-def create_driver():
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=options)
+# Modify navigator.webdriver to avoid bot detection
+STEALTH_SCRIPT = "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
 
-    # Modify navigator.webdriver to avoid bot detection
-    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
-        "source": "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
-    })
-    
-    return driver
+MAX_WORKERS = 10
+MAX_PAGES_PER_DRIVER = 50  # Restart Chrome after this many pages to keep memory in check
+FETCH_MODE = "hybrid"  # "hybrid" tries plain HTTP first, "selenium" always uses the browser
+
+def create_driver_pool():
+    """Creates one long-lived WebDriver slot per crawler thread."""
+    return DriverPool(options, STEALTH_SCRIPT, max_drivers=MAX_WORKERS,
+                      max_pages_per_driver=MAX_PAGES_PER_DRIVER)
 
 # Shared resources with threading protection
 visited_urls = set()
@@ -143,47 +146,78 @@ def parse_page(driver, url):
         driver.get(url)
         WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.TAG_NAME, "img")))  # Wait for images to load
         return BeautifulSoup(driver.page_source, "html.parser")
+    except TimeoutException as e:
+        print(f"Error loading {url}: {e}")
+        return None
+    except WebDriverException:
+        # Chrome crashed or lost its session: let the pool discard this driver
+        raise
     except Exception as e:
         print(f"Error loading {url}: {e}")
         return None
 
-def process_url(url, base_url):
+def process_url(url, base_url, pool, url_filter, fetcher=None, state=None):
     """Extracts image URLs and finds new links within the same domain."""
-    driver = create_driver()  # Each thread gets its own WebDriver
-    
     with lock:
         if url in visited_urls:
-            driver.quit()
             return []
         visited_urls.add(url)
         print(f"Crawling: {url}")
 
-    soup = parse_page(driver, url)
+    # Fast path: static HTML, falling back to a pooled WebDriver for JS-rendered pages
+    soup = fetcher.fetch(url) if fetcher else None
+    if soup is None:
+        try:
+            with pool.driver() as driver:
+                if not driver:
+                    print(f"No WebDriver available, skipping {url}")
+                    return []
+                soup = parse_page(driver, url)
+        except WebDriverException as e:
+            print(f"WebDriver failed on {url}, replacing it: {e}")
+            soup = None
+        if soup and fetcher:
+            fetcher.record(SELENIUM)
     if not soup:
-        driver.quit()
+        if state:
+            state.record_failure(url)  # Retried by --resume up to MAX_ATTEMPTS times
         return []
 
-    # Extract image URLs
-    img_urls = [urljoin(url, img.get("src")) for img in soup.find_all("img") if img.get("src")]
-
-    # Extract links and join relative URLs to the base URL
-    links = {urljoin(base_url, a["href"]) for a in soup.find_all("a", href=True)}
-
-    # Store image data safely
-    for img_url in img_urls:
-        image_data.put([url, img_url])
-
-    driver.quit()  # Close the WebDriver instance for this thread
-
-    # Return only new links within the same domain
-    return [link for link in links if base_url in link and link not in visited_urls]
-
-def crawl_site(base_url):
-    """Crawls the site using ThreadPoolExecutor."""
-    url_queue = [base_url]
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {executor.submit(process_url, url, base_url): url for url in url_queue}
+    # Extract image URLs (srcset, <picture>, lazy-load attributes and CSS backgrounds)
+    img_urls = extract_image_urls(soup, url)
+
+    # Extract links, canonicalize them and drop off-site, non-HTML and trap URLs
+    links = {url_filter.admit(urljoin(url, a["href"])) for a in soup.find_all("a", href=True)}
+    links.discard(None)
+
+    # Only new links within the same domain
+    new_links = [link for link in links if link not in visited_urls]
+
+    # Store image data safely (streamed to disk when a crawl state is in use)
+    if state:
+        state.record_page(url, img_urls, new_links)
+    else:
+        for img_url in img_urls:
+            image_data.put([url, img_url])
+
+    return new_links
+
+def crawl_site(base_url, fetch_mode=FETCH_MODE, state=None):
+    """
+    Crawls the site using ThreadPoolExecutor and a shared WebDriver pool.
+    With a CrawlState, the crawl resumes from the pages it left unfinished.
+    """
+    url_filter = FrontierFilter(base_url)
+    if state:
+        visited_urls.update(state.visited_urls())
+        url_queue = state.seed(url_filter.base_url)
+    else:
+        url_queue = [url_filter.base_url]
+    fetcher = StaticFetcher(pool_size=MAX_WORKERS) if fetch_mode == "hybrid" else None
+
+    with create_driver_pool() as pool, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(process_url, url, base_url, pool, url_filter, fetcher, state): url for url in url_queue}
 
         while futures:
             done, _ = concurrent.futures.wait(
@@ -196,10 +230,15 @@ def crawl_site(base_url):
                     for link in new_links:
                         if link not in visited_urls:
                             url_queue.append(link)
-                            futures[executor.submit(process_url, link, base_url)] = link
+                            futures[executor.submit(process_url, link, base_url, pool, url_filter, fetcher, state)] = link
                 except Exception as e:
                     print(f"Error processing {url}: {e}")
 
+    print(url_filter.report(base_url))
+    if fetcher:
+        print(fetcher.report(base_url))
+        fetcher.close()
+
 def get_filename(url):
     """Extracts the main part of the domain from a URL and returns a filename."""
     parsed_url = urlparse(url)
@@ -211,15 +250,17 @@ def get_filename(url):
     return filename
 
 if __name__ == "__main__":
-    base_url = input("Enter the base URL: ").strip()
+    parser = argparse.ArgumentParser(description="Crawl a school site for image URLs.")
+    parser.add_argument("base_url", nargs="?", help="Site to crawl (prompted for if omitted)")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted crawl from its state file")
+    args = parser.parse_args()
+
+    base_url = (args.base_url or input("Enter the base URL: ")).strip()
     if not base_url.endswith("/"):
         base_url += "/"
 
-    crawl_site(base_url)
-
-    # Save data to CSV
+    # Rows are streamed to the CSV as pages finish
     filename = get_filename(base_url)
-    df = pd.DataFrame(list(image_data.queue), columns=["Page URL", "Image URL"])
-    df.to_csv(filename, index=False, encoding="utf-8")
-
-    print(f"Saved image URLs to {filename}")
\ No newline at end of file
+    with CrawlState(get_state_filename(filename), filename, resume=args.resume) as state:
+        crawl_site(base_url, state=state)
+        print(f"Saved {state.image_count()} image URLs to {filename}")
\ No newline at end of file
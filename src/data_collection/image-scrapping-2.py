@@ -1,4 +1,5 @@
 ## This script is used for scrapping websites of (Lumen Christi Catholic, Seton, Our Lady of Providence)
+import argparse
 import concurrent.futures
 import threading
 import queue
@@ -11,10 +12,13 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.common.exceptions import TimeoutException, WebDriverException
 from bs4 import BeautifulSoup
-import pandas as pd
+from crawl_state import CrawlState, get_state_filename
+from page_fetcher import StaticFetcher, SELENIUM
+from url_filters import FrontierFilter
+from image_sources import extract_image_urls
+from driver_pool import DriverPool, get_driver_path
 
 # Set up logging
 logging.basicConfig(
@@ -40,26 +44,34 @@ options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) App
 options.add_experimental_option("excludeSwitches", ["enable-automation"])
 options.add_experimental_option("useAutomationExtension", False)
 
-# Initialize WebDriver (each thread gets its own WebDriver)
+# Modify navigator.webdriver to avoid bot detection
+STEALTH_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+    Object.defineProperty(navigator, 'plugins', {
+        get: () => [1, 2, 3, 4, 5]
+    });
+"""
+
+MAX_WORKERS = 5
+MAX_PAGES_PER_DRIVER = 50  # Restart Chrome after this many pages to keep memory in check
+FETCH_MODE = "hybrid"  # "hybrid" tries plain HTTP first, "selenium" always uses the browser
+
+# Initialize a standalone WebDriver (used by the single page test)
 def create_driver():
     try:
-        service = Service(ChromeDriverManager().install())
+        service = Service(get_driver_path())
         driver = webdriver.Chrome(service=service, options=options)
-
-        # Modify navigator.webdriver to avoid bot detection
-        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
-            "source": """
-                Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-                Object.defineProperty(navigator, 'plugins', {
-                    get: () => [1, 2, 3, 4, 5]
-                });
-            """
-        })
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": STEALTH_SCRIPT})
         return driver
     except Exception as e:
         logger.error(f"Error creating WebDriver: {e}")
         return None
 
+def create_driver_pool():
+    """Creates one long-lived WebDriver slot per crawler thread."""
+    return DriverPool(options, STEALTH_SCRIPT, max_drivers=MAX_WORKERS,
+                      max_pages_per_driver=MAX_PAGES_PER_DRIVER)
+
 # Shared resources with threading protection
 visited_urls = set()
 unique_image_urls = set()  # Global set to store unique image URLs
@@ -87,72 +99,93 @@ def parse_page(driver, url):
         logger.info(f"Successfully retrieved page source for {url}")
         return BeautifulSoup(page_source, "html.parser")
     except WebDriverException as e:
+        if not isinstance(e, TimeoutException):
+            raise  # Chrome crashed or lost its session: let the pool discard this driver
         logger.error(f"WebDriver error loading {url}: {e}")
         return None
     except Exception as e:
         logger.error(f"Unexpected error loading {url}: {e}")
         return None
 
-def process_url(url, base_url):
+def process_url(url, base_url, pool, url_filter, fetcher=None, state=None):
     """Extracts image URLs and finds new links within the same domain."""
-    driver = create_driver()  # Each thread gets its own WebDriver
-    if not driver:
-        logger.error("Failed to create WebDriver, skipping URL")
-        return []
-    
     with lock:
         if url in visited_urls:
-            driver.quit()
             return []
         visited_urls.add(url)
         logger.info(f"Crawling: {url}")
 
-    soup = parse_page(driver, url)
+    # Fast path: static HTML, falling back to a pooled WebDriver for JS-rendered pages
+    soup = fetcher.fetch(url) if fetcher else None
+    if soup is None:
+        try:
+            with pool.driver() as driver:
+                if not driver:
+                    logger.error("Failed to create WebDriver, skipping URL")
+                    return []
+                soup = parse_page(driver, url)
+        except WebDriverException as e:
+            logger.error(f"WebDriver failed on {url}, replacing it: {e}")
+            soup = None
+        if soup and fetcher:
+            fetcher.record(SELENIUM)
     if not soup:
-        driver.quit()
+        if state:
+            state.record_failure(url)  # Retried by --resume up to MAX_ATTEMPTS times
         return []
 
-    # Extract image URLs
-    img_urls = []
-    for img in soup.find_all("img"):
-        src = img.get("src")
-        if src:
-            try:
-                full_url = urljoin(url, src)
-                img_urls.append(full_url)
-            except Exception as e:
-                logger.warning(f"Error processing image URL {src}: {e}")
+    # Extract image URLs (srcset, <picture>, lazy-load attributes and CSS backgrounds)
+    try:
+        img_urls = extract_image_urls(soup, url)
+    except Exception as e:
+        logger.warning(f"Error extracting image URLs from {url}: {e}")
+        img_urls = []
 
-    # Extract links and join relative URLs to the base URL
+    # Extract links, canonicalize them and drop off-site, non-HTML and trap URLs
     links = set()
     for a in soup.find_all("a", href=True):
         try:
-            link = urljoin(base_url, a["href"])
-            if base_url in link:  # Only include links within the same domain
+            link = url_filter.admit(urljoin(url, a["href"]))
+            if link:
                 links.add(link)
         except Exception as e:
             logger.warning(f"Error processing link: {e}")
 
-    # Safely store only unique image URLs
+    # Only new links within the same domain
     with lock:
-        for img_url in img_urls:
-            if img_url not in unique_image_urls:
-                unique_image_urls.add(img_url)
-                image_data.put([url, img_url])
+        new_links = [link for link in links if link not in visited_urls]
 
-    driver.quit()  # Close the WebDriver instance for this thread
+    # Safely store only unique image URLs (the crawl state enforces uniqueness on disk)
+    if state:
+        state.record_page(url, img_urls, new_links)
+    else:
+        with lock:
+            for img_url in img_urls:
+                if img_url not in unique_image_urls:
+                    unique_image_urls.add(img_url)
+                    image_data.put([url, img_url])
 
-    # Return only new links within the same domain
-    with lock:
-        return [link for link in links if link not in visited_urls]
+    return new_links
 
-def crawl_site(base_url, max_pages=100):
-    """Crawls the site using ThreadPoolExecutor with a page limit."""
-    url_queue = [base_url]
-    page_count = 0
+def crawl_site(base_url, max_pages=100, fetch_mode=FETCH_MODE, state=None):
+    """
+    Crawls the site using ThreadPoolExecutor and a shared WebDriver pool, with a page limit.
+    With a CrawlState, the crawl resumes from the pages it left unfinished and pages
+    processed in earlier runs count towards the limit.
+    """
+    url_filter = FrontierFilter(base_url)
+    if state:
+        visited_urls.update(state.visited_urls())
+        url_queue = state.seed(url_filter.base_url)
+        page_count = state.page_count()
+    else:
+        url_queue = [url_filter.base_url]
+        page_count = 0
+    fetcher = StaticFetcher(pool_size=MAX_WORKERS) if fetch_mode == "hybrid" else None
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {executor.submit(process_url, url, base_url): url for url in url_queue}
+    with create_driver_pool() as pool, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(process_url, url, base_url, pool, url_filter, fetcher, state): url for url in url_queue}
         while futures and page_count < max_pages:
             done, _ = concurrent.futures.wait(
                 futures, return_when=concurrent.futures.FIRST_COMPLETED, timeout=60
@@ -169,10 +202,15 @@ def crawl_site(base_url, max_pages=100):
                     for link in new_links:
                         if link not in visited_urls and page_count < max_pages:
                             url_queue.append(link)
-                            futures[executor.submit(process_url, link, base_url)] = link
+                            futures[executor.submit(process_url, link, base_url, pool, url_filter, fetcher, state)] = link
                 except Exception as e:
                     logger.error(f"Error processing {url}: {e}")
 
+    logger.info(url_filter.report(base_url))
+    if fetcher:
+        logger.info(fetcher.report(base_url))
+        fetcher.close()
+
 def get_filename(url):
     """Extracts the main part of the domain from a URL and returns a filename."""
     parsed_url = urlparse(url)
@@ -207,23 +245,29 @@ def test_single_page(url):
         return False
 
 if __name__ == "__main__":
-    base_url = input("Enter the base URL: ").strip()
+    parser = argparse.ArgumentParser(description="Crawl a school site for image URLs.")
+    parser.add_argument("base_url", nargs="?", help="Site to crawl (prompted for if omitted)")
+    parser.add_argument("--max-pages", type=int, help="Maximum number of pages to crawl (prompted for if omitted)")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted crawl from its state file")
+    args = parser.parse_args()
+
+    base_url = (args.base_url or input("Enter the base URL: ")).strip()
     if not base_url.endswith("/"):
         base_url += "/"
-    
+
     # Test single page load before starting crawler
     logger.info("Testing single page load before starting crawler")
     if test_single_page(base_url):
         logger.info("Single page test successful, starting crawler")
-        max_pages = int(input("Enter maximum number of pages to crawl (default 100): ") or 100)
-        crawl_site(base_url, max_pages)
+        max_pages = args.max_pages or int(input("Enter maximum number of pages to crawl (default 100): ") or 100)
 
-        # Save data to CSV
+        # Rows are streamed to the CSV as pages finish
         filename = get_filename(base_url)
-        if not image_data.empty():
-            df = pd.DataFrame(list(image_data.queue), columns=["Page URL", "Image URL"])
-            df.to_csv(filename, index=False, encoding="utf-8")
-            logger.info(f"Saved {len(df)} unique image URLs to {filename}")
+        with CrawlState(get_state_filename(filename), filename, resume=args.resume, unique_images=True) as state:
+            crawl_site(base_url, max_pages, state=state)
+            image_count = state.image_count()
+        if image_count:
+            logger.info(f"Saved {image_count} unique image URLs to {filename}")
         else:
             logger.warning("No image data collected!")
     else:
@@ -0,0 +1,180 @@
+"""
+Image-source extraction for crawled pages.
+
+Reading only `img["src"]` returns placeholder GIFs on lazy-loading sites, which
+we would then download and run face detection on for nothing. This module
+resolves srcset/sizes, <picture> sources, lazy-load attributes and inline CSS
+backgrounds to one real image URL per element, without any extra requests.
+"""
+
+import re
+from urllib.parse import urljoin, urlsplit
+
+# Smallest width (in px) we want for face detection; larger candidates are only
+# picked when nothing at least this wide is available.
+TARGET_WIDTH = 800
+
+# Attributes lazy-loading libraries use for the real image, in order of preference
+LAZY_SRC_ATTRIBUTES = ("data-src", "data-lazy-src", "data-original", "data-lazy", "data-url", "data-image")
+LAZY_SRCSET_ATTRIBUTES = ("data-srcset", "data-lazy-srcset")
+
+PLACEHOLDER_HINTS = ("placeholder", "blank.gif", "spacer", "pixel.gif", "transparent.gif", "loading.gif")
+# "1x1" only as a whole size, so photo-1x1.gif is dropped but IMG_21x14.jpg and 1x1024.jpg are kept
+PLACEHOLDER_SIZE = re.compile(r"(?<![0-9])1x1(?![0-9])")
+
+TRACKING_HOSTS = ("facebook.com", "google-analytics.com", "doubleclick.net", "googletagmanager.com",
+                  "bat.bing.com", "analytics.", "pixel.")
+
+BACKGROUND_URL = re.compile(r"background(?:-image)?\s*:[^;]*?url\(\s*['\"]?([^'\")]+)['\"]?\s*\)", re.IGNORECASE)
+SRCSET_SEPARATORS = re.compile(r"[\s,]*")
+SRCSET_URL = re.compile(r"\S+")
+SRCSET_DESCRIPTOR = re.compile(r"[^,]*")
+SRCSET_DESCRIPTOR_VALUE = re.compile(r"([\d.]+)([wx])")
+SIZES_PX = re.compile(r"(\d+(?:\.\d+)?)px\s*$")
+
+
+def parse_srcset(srcset):
+    """
+    Parses a srcset attribute.
+
+    Returns:
+        list: (url, width, density) tuples; width or density is None depending on the descriptor
+    """
+    candidates = []
+    text = srcset or ""
+    position = 0
+    # Follows the HTML tokenizer: URLs may contain commas, so a URL runs to the next
+    # whitespace and its descriptor runs to the next comma.
+    while True:
+        position = SRCSET_SEPARATORS.match(text, position).end()
+        if position >= len(text):
+            break
+        url = SRCSET_URL.match(text, position).group()
+        position += len(url)
+        descriptor = ""
+        if url.endswith(","):
+            url = url.rstrip(",")
+        else:
+            raw_descriptor = SRCSET_DESCRIPTOR.match(text, position).group()
+            position += len(raw_descriptor)
+            descriptor = raw_descriptor.strip()
+        if not url:
+            continue
+
+        match = SRCSET_DESCRIPTOR_VALUE.fullmatch(descriptor.split()[0]) if descriptor else None
+        if match and match.group(2) == "w":
+            candidates.append((url, float(match.group(1)), None))
+        elif match:
+            candidates.append((url, None, float(match.group(1))))
+        else:
+            candidates.append((url, None, 1.0))
+    return candidates
+
+
+def _slot_width(sizes):
+    """Returns the fallback slot width from a `sizes` attribute if it is given in px."""
+    if not sizes:
+        return None
+    match = SIZES_PX.search(sizes.split(",")[-1].strip())
+    return float(match.group(1)) if match else None
+
+
+def choose_candidate(candidates, target_width=TARGET_WIDTH, sizes=None):
+    """
+    Picks one URL from parsed srcset candidates: the smallest width descriptor that
+    covers `target_width` (or the slot width from `sizes`, if larger), otherwise the
+    largest available; for density descriptors the largest density up to 2x.
+    """
+    if not candidates:
+        return None
+    target = max(target_width, _slot_width(sizes) or 0)
+
+    widths = sorted((c for c in candidates if c[1]), key=lambda c: c[1])
+    if widths:
+        for url, width, _ in widths:
+            if width >= target:
+                return url
+        return widths[-1][0]
+
+    densities = sorted(candidates, key=lambda c: c[2] or 1.0)
+    usable = [c for c in densities if (c[2] or 1.0) <= 2.0]
+    return (usable or densities)[-1][0]
+
+
+def is_placeholder(url):
+    if not url:
+        return True
+    lowered = url.lower()
+    return (lowered.startswith("data:") or any(hint in lowered for hint in PLACEHOLDER_HINTS)
+            or PLACEHOLDER_SIZE.search(lowered) is not None)
+
+
+def is_tracking_pixel(tag, url):
+    """Flags 1x1 beacons and images served by analytics hosts."""
+    host = (urlsplit(url).hostname or "").lower()
+    if any(tracker in host for tracker in TRACKING_HOSTS):
+        return True
+    for attribute in ("width", "height"):
+        value = str(tag.get(attribute, "")).strip().rstrip("px")
+        if value.isdigit() and int(value) <= 2:
+            return True
+    return False
+
+
+def _element_source(tag, target_width):
+    """Resolves the best real URL for an <img> or <source> element, or None."""
+    sizes = tag.get("sizes") or tag.get("data-sizes")
+    for attribute in LAZY_SRCSET_ATTRIBUTES + ("srcset",):
+        chosen = choose_candidate(parse_srcset(tag.get(attribute)), target_width, sizes)
+        if chosen and not is_placeholder(chosen):
+            return chosen
+    for attribute in LAZY_SRC_ATTRIBUTES + ("src",):
+        value = tag.get(attribute)
+        if value and not is_placeholder(value.strip()):
+            return value.strip()
+    return None
+
+
+def extract_image_urls(soup, page_url, target_width=TARGET_WIDTH):
+    """
+    Returns the absolute image URLs on a page, one per image element, in page order.
+
+    Handles srcset/sizes, <picture><source>, lazy-load data-* attributes and inline
+    `background-image` styles, and drops data: URIs, placeholders and tracking pixels.
+    """
+    image_urls = []
+    seen = set()
+
+    def add(tag, url):
+        if not url:
+            return
+        full_url = urljoin(page_url, url)
+        if full_url in seen or is_placeholder(full_url) or is_tracking_pixel(tag, full_url):
+            return
+        seen.add(full_url)
+        image_urls.append(full_url)
+
+    for picture in soup.find_all("picture"):
+        # <source> elements come first and usually carry the responsive variants
+        chosen = None
+        for source in picture.find_all("source"):
+            if "svg" in (source.get("type") or ""):
+                continue
+            chosen = _element_source(source, target_width)
+            if chosen:
+                break
+        img = picture.find("img")
+        if not chosen and img is not None:
+            chosen = _element_source(img, target_width)
+        add(img if img is not None else picture, chosen)
+
+    for img in soup.find_all("img"):
+        if img.find_parent("picture") is not None:
+            continue
+        add(img, _element_source(img, target_width))
+
+    for tag in soup.find_all(style=BACKGROUND_URL):
+        for url in BACKGROUND_URL.findall(tag["style"]):
+            add(tag, url.strip())
+
+    return image_urls
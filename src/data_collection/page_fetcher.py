@@ -0,0 +1,131 @@
+"""
+Static HTML fast path for the crawlers.
+
+Most school sites render their <img> and <a> tags on the server, so a plain HTTP
+GET is enough to harvest them. Pages are only escalated to Selenium when the
+fetched HTML looks like it needs JavaScript to render.
+"""
+
+import logging
+import threading
+from collections import Counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+# Fingerprints of client-side frameworks that render the page after load
+FRAMEWORK_MARKERS = (
+    "__NEXT_DATA__",
+    "__NUXT__",
+    "data-reactroot",
+    "ng-version",
+    "ng-app",
+    '<div id="root"></div>',
+    '<div id="app"></div>',
+    "window.__INITIAL_STATE__",
+)
+
+MIN_BODY_TEXT_LENGTH = 200  # Visible characters below which a page counts as an empty shell
+
+# Names of the two fetch paths, used as keys in the per-site statistics
+STATIC = "static"
+SELENIUM = "selenium"
+
+
+def looks_js_rendered(html, soup):
+    """
+    Guesses whether a statically fetched page still needs a browser to render.
+
+    Returns:
+        str or None: The reason for escalating to Selenium, or None if the static HTML is usable
+    """
+    if soup.body is None:
+        return "no body"
+    for marker in FRAMEWORK_MARKERS:
+        if marker in html:
+            return f"framework marker {marker!r}"
+    if not soup.find("img"):
+        return "no <img> tags"
+    if len(soup.body.get_text(" ", strip=True)) < MIN_BODY_TEXT_LENGTH:
+        return "tiny body"
+    return None
+
+
+class StaticFetcher:
+    """
+    Fetches pages over a pooled HTTP session and records which path served each page.
+
+    Args:
+        pool_size (int): Keep-alive connections kept per host
+        timeout (float): Seconds to wait for a page before giving up on the fast path
+    """
+
+    def __init__(self, pool_size=10, timeout=10):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.path_counts = Counter()
+        self.escalation_reasons = Counter()
+        self._lock = threading.Lock()
+
+    def fetch(self, url):
+        """
+        Fetches a page without a browser.
+
+        Returns:
+            BeautifulSoup or None: Parsed page, or None if the page should go through Selenium
+        """
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            self._escalate(url, f"request failed: {e}")
+            return None
+
+        content_type = response.headers.get("Content-Type", "")
+        if response.status_code != 200 or "html" not in content_type:
+            self._escalate(url, f"status {response.status_code} ({content_type or 'no content type'})")
+            return None
+
+        html = response.text
+        soup = BeautifulSoup(html, "html.parser")
+        reason = looks_js_rendered(html, soup)
+        if reason:
+            self._escalate(url, reason)
+            return None
+
+        self.record(STATIC)
+        return soup
+
+    def _escalate(self, url, reason):
+        logger.debug(f"Escalating {url} to Selenium: {reason}")
+        with self._lock:
+            self.escalation_reasons[reason.split(":")[0]] += 1
+
+    def record(self, path):
+        """Counts a page as served by the given path (STATIC or SELENIUM)."""
+        with self._lock:
+            self.path_counts[path] += 1
+
+    def report(self, site):
+        """Returns a one-line summary of how the pages of `site` were fetched."""
+        total = sum(self.path_counts.values())
+        static = self.path_counts[STATIC]
+        share = (100.0 * static / total) if total else 0.0
+        reasons = ", ".join(f"{reason}={count}" for reason, count in self.escalation_reasons.most_common())
+        return (f"Fetch paths for {site}: static={static}, selenium={self.path_counts[SELENIUM]} "
+                f"({share:.1f}% static){'; escalations: ' + reasons if reasons else ''}")
+
+    def close(self):
+        self.session.close()
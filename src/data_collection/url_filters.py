@@ -0,0 +1,165 @@
+"""
+URL canonicalization and crawler-trap detection for the crawl frontier.
+
+Every discovered link goes through FrontierFilter.admit() before it can enter
+`visited_urls`, so query-string, fragment and www/non-www variants of a page
+collapse to one URL, and calendars or endlessly nesting paths are never fetched.
+"""
+
+import re
+import threading
+from collections import Counter
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Query parameters that actually select different content; everything else is dropped
+ALLOWED_QUERY_PARAMS = {"id", "p", "page_id", "pageid", "post", "cat", "tag"}
+
+# File types that never contain HTML worth crawling
+NON_HTML_EXTENSIONS = (
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".svg", ".bmp", ".ico",
+    ".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".zip",
+    ".mp3", ".mp4", ".mov", ".avi", ".ics", ".css", ".js", ".xml",
+)
+
+CALENDAR_PATTERNS = (
+    # The date must be a whole segment: /events/2024-05-spring-concert is a real page
+    re.compile(r"/(calendar|events?)/([^/?]+/)*\d{4}-\d{2}(-\d{2})?(/|\?|$)"),
+    re.compile(r"/(calendar|events?)/(\d{4})/\d{1,2}(/\d{1,2})?/?$"),
+    re.compile(r"/(day|week|month|list)/\d{4}-\d{2}"),
+    re.compile(r"[?&](date|month|year|day|week|tribe-bar-date|ical)="),
+)
+
+# Names of the rules, used as keys in the per-site report
+CANONICAL_DUPLICATE = "canonical_duplicate"
+NON_HTML = "non_html"
+TRAP_DEPTH = "trap_depth"
+TRAP_REPETITION = "trap_repetition"
+TRAP_CALENDAR = "trap_calendar"
+
+
+def _strip_www(host):
+    return host[4:] if host.startswith("www.") else host
+
+
+def canonicalize_url(url, allowed_params=ALLOWED_QUERY_PARAMS, canonical_host=None):
+    """
+    Normalizes a URL so that equivalent links compare equal.
+
+    Lowercases the scheme and host, drops default ports, fragments, non-whitelisted
+    query parameters and trailing slashes, and sorts the remaining parameters.
+    If `canonical_host` is given, www/non-www variants of it are mapped onto it.
+
+    Returns:
+        str or None: The canonical URL, or None for non-HTTP(S) and malformed links
+    """
+    # Links come from arbitrary markup: a bad port (host:abc) or bracket (http://[::1/) makes them inadmissible
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https"):
+        return None
+
+    host = (parts.hostname or "").lower()
+    if canonical_host and _strip_www(host) == _strip_www(canonical_host):
+        host = canonical_host
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+
+    path = re.sub(r"/{2,}", "/", parts.path) or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if key.lower() in allowed_params)
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def detect_trap(url, max_depth=8, max_repeats=2):
+    """
+    Checks a canonical URL against the crawler-trap rules.
+
+    Returns:
+        str or None: The name of the rule that matched, or None if the URL looks safe
+    """
+    parts = urlsplit(url)
+    segments = [segment for segment in parts.path.lower().split("/") if segment]
+
+    if len(segments) > max_depth:
+        return TRAP_DEPTH
+
+    # The same segment over and over (/news/news/news) or a repeating pair (/a/b/a/b/a/b)
+    counts = Counter(segments)
+    if counts and counts.most_common(1)[0][1] > max_repeats:
+        return TRAP_REPETITION
+    pairs = Counter(zip(segments, segments[1:]))
+    if pairs and pairs.most_common(1)[0][1] > max_repeats - 1 and len(segments) >= 4:
+        return TRAP_REPETITION
+
+    target = parts.path.lower() + ("?" + parts.query.lower() if parts.query else "")
+    if any(pattern.search(target) for pattern in CALENDAR_PATTERNS):
+        return TRAP_CALENDAR
+    return None
+
+
+class FrontierFilter:
+    """
+    Canonicalizes links for one site and rejects off-site, non-HTML and trap URLs,
+    counting how many fetches each rule saved.
+
+    Args:
+        base_url (str): Start URL of the site; its host (with or without www) defines the site
+        allowed_params (set): Query parameters kept during canonicalization
+        max_depth (int): Maximum number of path segments
+        max_repeats (int): Maximum times a path segment may repeat
+    """
+
+    def __init__(self, base_url, allowed_params=ALLOWED_QUERY_PARAMS, max_depth=8, max_repeats=2):
+        self.host = (urlsplit(base_url).hostname or "").lower()
+        self.allowed_params = allowed_params
+        self.max_depth = max_depth
+        self.max_repeats = max_repeats
+        self.base_url = canonicalize_url(base_url, allowed_params, self.host)
+        self.rule_counts = Counter()
+        self._raw_variants = set()
+        self._canonical_seen = set()
+        self._lock = threading.Lock()
+
+    def admit(self, url):
+        """
+        Returns the canonical form of `url` if it may enter the frontier, otherwise None.
+
+        Repeated links to the same raw URL are not counted again, so the report only
+        reflects fetches that the old `base_url in link` filter would have made.
+        """
+        canonical = canonicalize_url(url, self.allowed_params, self.host)
+        with self._lock:
+            if url in self._raw_variants:
+                return canonical if canonical in self._canonical_seen else None
+            self._raw_variants.add(url)
+
+            # Off-site links were never fetched, so they are rejected without being counted
+            if canonical is None or urlsplit(canonical).hostname != self.host:
+                return None
+
+            if urlsplit(canonical).path.lower().endswith(NON_HTML_EXTENSIONS):
+                rule = NON_HTML
+            else:
+                rule = detect_trap(canonical, self.max_depth, self.max_repeats)
+            if rule:
+                self.rule_counts[rule] += 1
+                return None
+
+            if canonical in self._canonical_seen:
+                self.rule_counts[CANONICAL_DUPLICATE] += 1
+            self._canonical_seen.add(canonical)
+            return canonical
+
+    def report(self, site):
+        """Returns a one-line summary of the fetches each rule saved for `site`."""
+        if not self.rule_counts:
+            return f"URL filter for {site}: no fetches saved"
+        rules = ", ".join(f"{rule}={count}" for rule, count in sorted(self.rule_counts.items()))
+        return f"URL filter for {site}: {sum(self.rule_counts.values())} fetches saved ({rules})"
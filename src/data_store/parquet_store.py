@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Columnar store for everything the pipeline produces, as Parquet partitioned by school.
+
+    data/store/<table>/school=<school>/part-0.parquet
+
+Tables (the `school` column comes from the partition directory):
+    pages        page_url, image_count                               (crawl -> deduplicate.py)
+    images       image_url, page_url, normalized_url, sacred         (deduplicate.py; sacred.py sets `sacred`)
+    faces        crop_file, image_index, face_number, image_url      (data-cleaning.py)
+    predictions  crop_file, final_race, final_gender, confidence,
+                 backends, identity                                  (demographs.py)
+
+Each stage replaces its own school partition. Reads go through pyarrow.dataset:
+only the requested columns are decoded, a filter on `school` skips the other
+partitions' files entirely, and other filters are checked against row-group
+statistics before any data is read.
+
+Usage:
+    python parquet_store.py import                       # backfill from data/raw and results/
+    python parquet_store.py tables
+    python parquet_store.py query sacred-race-share
+    python parquet_store.py query sacred-race-share --school roncalli
+"""
+
+import argparse
+import csv
+import glob
+import os
+import re
+import sys
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+DEFAULT_STORE = "../../data/store"
+RAW_DIR = "../../data/raw"
+RESULTS_DIR = "../../results"
+PROCESSED_DIR = "../../data/processed"
+
+SCHEMAS = {
+    "pages": pa.schema([
+        ("page_url", pa.string()),
+        ("image_count", pa.int32()),
+    ]),
+    "images": pa.schema([
+        ("image_url", pa.string()),
+        ("page_url", pa.string()),
+        ("normalized_url", pa.string()),
+        ("sacred", pa.bool_()),          # null until sacred.py has classified the image
+    ]),
+    "faces": pa.schema([
+        ("crop_file", pa.string()),      # img<image_index>_face_<face_number>.jpg
+        ("image_index", pa.int32()),     # 1-based position in the school's image URL list
+        ("face_number", pa.int32()),
+        ("image_url", pa.string()),
+    ]),
+    "predictions": pa.schema([
+        ("crop_file", pa.string()),
+        ("final_race", pa.string()),
+        ("final_gender", pa.string()),
+        ("confidence", pa.float32()),    # null for results imported from the folder tree
+        ("backends", pa.list_(pa.string())),
+        ("identity", pa.string()),       # representative crop when demographs.py ran with --identities
+    ]),
+}
+PARTITIONING = ds.partitioning(pa.schema([("school", pa.string())]), flavor="hive")
+ROW_GROUP_SIZE = 65536
+
+CROP_NAME = re.compile(r"^img(\d+)_face_(\d+)\.\w+$")
+
+_OPERATORS = {
+    "=": lambda field, value: field == value,
+    "==": lambda field, value: field == value,
+    "!=": lambda field, value: field != value,
+    "<": lambda field, value: field < value,
+    "<=": lambda field, value: field <= value,
+    ">": lambda field, value: field > value,
+    ">=": lambda field, value: field >= value,
+    "in": lambda field, value: field.isin(value),
+    "not in": lambda field, value: ~field.isin(value),
+}
+
+
+def to_expression(filters, schema=None):
+    """
+    Converts [(column, op, value), ...] (all must hold) into a pyarrow dataset expression.
+    The value sets of "in"/"not in" are typed from `schema`, so an empty list still matches the column.
+    """
+    expression = None
+    for column, op, value in filters or []:
+        if op in ("in", "not in"):
+            value = pa.array(list(value), type=schema.field(column).type if schema is not None else None)
+        term = _OPERATORS[op](ds.field(column), value)
+        expression = term if expression is None else expression & term
+    return expression
+
+
+class PartitionWriter:
+    """
+    Streams rows (dicts) into one school partition in row groups, replacing the
+    partition atomically on close. Use as a context manager.
+    """
+
+    def __init__(self, path, schema, batch_size=ROW_GROUP_SIZE):
+        self.path = path
+        self.schema = schema
+        self.batch_size = batch_size
+        self.rows = 0
+        self._pending = []
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._writer = pq.ParquetWriter(path + ".tmp", schema, compression="zstd")
+
+    def write(self, row):
+        self._pending.append(row)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def write_many(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def write_batch(self, batch):
+        """Writes a pyarrow RecordBatch (or Table) with this partition's schema as is."""
+        self.flush()
+        self._writer.write_table(pa.Table.from_batches([batch]) if isinstance(batch, pa.RecordBatch) else batch)
+        self.rows += batch.num_rows
+
+    def flush(self):
+        if self._pending:
+            self._writer.write_table(pa.Table.from_pylist(self._pending, schema=self.schema))
+            self.rows += len(self._pending)
+            self._pending = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+        os.replace(self.path + ".tmp", self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._writer.close()
+            os.remove(self.path + ".tmp")
+
+
+class ParquetStore:
+    """
+    Args:
+        root (str): Store directory (one subdirectory per table)
+    """
+
+    def __init__(self, root=DEFAULT_STORE):
+        self.root = root
+
+    def partition_path(self, table, school):
+        return os.path.join(self.root, table, f"school={school}", "part-0.parquet")
+
+    def has_partition(self, table, school):
+        return os.path.exists(self.partition_path(table, school))
+
+    def schools(self, table):
+        prefix = os.path.join(self.root, table, "school=")
+        return sorted(os.path.dirname(path)[len(prefix):] for path in glob.glob(f"{prefix}*/part-0.parquet"))
+
+    def writer(self, table, school, keep_existing=False):
+        """
+        PartitionWriter that replaces `school`'s partition of `table`. With `keep_existing`,
+        the current rows are streamed into it first, a batch at a time, and new rows follow.
+        """
+        writer = PartitionWriter(self.partition_path(table, school), SCHEMAS[table])
+        if keep_existing:
+            for batch in self.iter_batches(table, school):
+                writer.write_batch(batch)
+        return writer
+
+    def iter_batches(self, table, school, columns=None):
+        """Yields `school`'s partition of `table` as RecordBatches (nothing if it does not exist)."""
+        if not self.has_partition(table, school):
+            return
+        parquet_file = pq.ParquetFile(self.partition_path(table, school))
+        try:
+            yield from parquet_file.iter_batches(batch_size=ROW_GROUP_SIZE, columns=columns)
+        finally:
+            parquet_file.close()
+
+    def write(self, table, school, rows):
+        """Replaces `school`'s partition of `table` with `rows` (an iterable of dicts); returns the row count."""
+        with self.writer(table, school) as writer:
+            writer.write_many(rows)
+        return writer.rows
+
+    def dataset(self, table):
+        files = sorted(glob.glob(os.path.join(self.root, table, "school=*", "part-0.parquet")))
+        schema = SCHEMAS[table].append(pa.field("school", pa.string()))
+        return ds.dataset(files, schema=schema, format="parquet", partitioning=PARTITIONING,
+                          partition_base_dir=os.path.join(self.root, table))
+
+    def read(self, table, columns=None, filters=None):
+        """
+        Reads a table (all schools) as a pyarrow.Table.
+
+        Args:
+            table (str): One of SCHEMAS
+            columns (list): Columns to decode (default: all, plus `school`)
+            filters (list): (column, op, value) conditions that must all hold, e.g.
+                [("school", "=", "roncalli"), ("sacred", "=", True)]
+        """
+        dataset = self.dataset(table)
+        if columns is None:
+            columns = SCHEMAS[table].names + ["school"]
+        if not dataset.files:
+            return pa.Table.from_pylist([], schema=pa.schema([dataset.schema.field(c) for c in columns]))
+        return dataset.to_table(columns=columns, filter=to_expression(filters, dataset.schema))
+
+    def read_column(self, table, school, column):
+        """One column of one school's partition as a Python list (empty if the partition does not exist)."""
+        if not self.has_partition(table, school):
+            return []
+        return pq.read_table(self.partition_path(table, school), columns=[column]).column(column).to_pylist()
+
+    def update_column(self, table, school, key, column, values):
+        """
+        Rewrites `school`'s partition with `column` set from `values` ({key value: new value})
+        for the rows whose `key` column is in `values`; other rows keep their value.
+        """
+        path = self.partition_path(table, school)
+        data = pq.read_table(path)
+        keys = data.column(key).to_pylist()
+        current = data.column(column).to_pylist()
+        updated = [values.get(k, old) for k, old in zip(keys, current)]
+        data = data.set_column(data.schema.get_field_index(column), SCHEMAS[table].field(column),
+                               pa.array(updated, type=SCHEMAS[table].field(column).type))
+        pq.write_table(data, path + ".tmp", row_group_size=ROW_GROUP_SIZE, compression="zstd")
+        os.replace(path + ".tmp", path)
+
+
+def faces_rows(crop_files, image_urls):
+    """faces rows for crops named img<index>_face_<n>.jpg, where <index> is 1-based into `image_urls`."""
+    for crop_file in sorted(crop_files):
+        match = CROP_NAME.match(crop_file)
+        if not match:
+            continue
+        image_index, face_number = int(match.group(1)), int(match.group(2))
+        yield {"crop_file": crop_file, "image_index": image_index, "face_number": face_number,
+               "image_url": image_urls[image_index - 1] if 0 < image_index <= len(image_urls) else None}
+
+
+def prediction_rows(debug_logs, identities=None):
+    """predictions rows from a demographs.py debug log (and its {representative: members} identities)."""
+    identity_of = {member: rep for rep, members in (identities or {}).items() for member in members}
+    for entry in debug_logs:
+        yield {"crop_file": entry["image"], "final_race": entry["final_race"], "final_gender": entry["final_gender"],
+               "confidence": entry.get("confidence"), "backends": sorted(entry.get("backends", {})),
+               "identity": identity_of.get(entry["image"])}
+
+
+# --- Import of the existing CSV/JSON/folder outputs --------------------------
+
+def resolve_school(name, schools):
+    """Maps a legacy file prefix (e.g. "popeace") onto a school name (e.g. "popeaceschools")."""
+    if name in schools:
+        return name
+    matches = [school for school in schools if school.startswith(name)]
+    return matches[0] if len(matches) == 1 else name
+
+
+def import_school(store, school, raw_dir=RAW_DIR, results_dir=RESULTS_DIR, processed_dir=PROCESSED_DIR,
+                  sacred_csvs=()):
+    """Backfills one school's partitions from data/raw, data/processed and results/; returns rows per table."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_cleaning"))
+    from deduplicate import normalize_image_url
+
+    written = {}
+    csv_path = os.path.join(raw_dir, "deduplicate", f"{school}-school-image-urls-unique.csv")
+    if not os.path.exists(csv_path):
+        csv_path = os.path.join(raw_dir, f"{school}-school-image-urls-unique.csv")
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        rows = [row for row in csv.DictReader(f) if row.get("Image URL")]
+
+    # Crop names index into the list data-cleaning.py read (blank rows included), not the deduplicated one
+    cleaning_csv = os.path.join(raw_dir, f"{school}-school-image-urls-unique.csv")
+    image_urls = []
+    if os.path.exists(cleaning_csv):
+        with open(cleaning_csv, newline="", encoding="utf-8") as f:
+            image_urls = [row.get("Image URL") or None for row in csv.DictReader(f)]
+
+    sacred = set()
+    for path in sacred_csvs:
+        with open(path, newline="", encoding="utf-8") as f:
+            sacred.update(row["Image URL"] for row in csv.DictReader(f) if row.get("Image URL"))
+    classified = bool(sacred_csvs)
+
+    written["images"] = store.write("images", school, (
+        {"image_url": row["Image URL"], "page_url": row.get("Page URL") or None,
+         "normalized_url": normalize_image_url(row["Image URL"]),
+         "sacred": (row["Image URL"] in sacred) if classified else None} for row in rows))
+    page_counts = {}
+    for row in rows:
+        if row.get("Page URL"):
+            page_counts[row["Page URL"]] = page_counts.get(row["Page URL"], 0) + 1
+    written["pages"] = store.write("pages", school, (
+        {"page_url": page, "image_count": count} for page, count in page_counts.items()))
+
+    # Crops: the data-cleaning output folder if it is still there, else the files placed in results/<school>/
+    crop_files = set()
+    cropped_folder = os.path.join(processed_dir, f"cropped_faces_{school}")
+    if os.path.isdir(cropped_folder):
+        crop_files.update(os.listdir(cropped_folder))
+    labels = []
+    for path in glob.glob(os.path.join(results_dir, school, "*", "*", "*")):
+        race_folder, gender_folder, crop_file = path.split(os.sep)[-3:]
+        if race_folder == "error":
+            continue
+        crop_files.add(crop_file)
+        labels.append({"image": crop_file, "final_race": race_folder.replace("_", " "),
+                       "final_gender": gender_folder.replace("_", " ")})  # Lowercase, as demographs.py writes it
+    written["faces"] = store.write("faces", school, faces_rows(crop_files, image_urls))
+    written["predictions"] = store.write("predictions", school, prediction_rows(sorted(labels, key=lambda e: e["image"])))
+    return written
+
+
+def import_legacy(store, raw_dir=RAW_DIR, results_dir=RESULTS_DIR, processed_dir=PROCESSED_DIR):
+    suffix = "-school-image-urls-unique.csv"
+    schools = sorted({os.path.basename(path)[:-len(suffix)] for pattern in (f"*{suffix}", f"deduplicate/*{suffix}")
+                      for path in glob.glob(os.path.join(raw_dir, pattern))})
+    sacred_csvs = {}
+    for path in glob.glob(os.path.join(results_dir, "*_sacred_images.csv")) + \
+            glob.glob(os.path.join(results_dir, "sacred_images_top_50", "*_sacred_images.csv")):
+        name = os.path.basename(path)[:-len("_sacred_images.csv")]
+        sacred_csvs.setdefault(resolve_school(name, schools), []).append(path)
+
+    for school in schools:
+        written = import_school(store, school, raw_dir, results_dir, processed_dir, sacred_csvs.get(school, ()))
+        print(f"📦 {school}: " + ", ".join(f"{count} {table}" for table, count in written.items()))
+
+
+# --- Queries ---------------------------------------------------------------
+
+def sacred_race_share(store, school=None):
+    """
+    Race share of the faces found in sacred-tagged images, per school.
+    Only the join keys and the label columns are read, and only for the rows that can match.
+
+    Returns:
+        pyarrow.Table: school, final_race, faces, share
+    """
+    school_filter = [("school", "=", school)] if school else []
+    images = store.read("images", ["school", "image_url"], school_filter + [("sacred", "=", True)])
+    faces = store.read("faces", ["school", "crop_file", "image_url"],
+                       school_filter + [("image_url", "in", images.column("image_url").to_pylist())])
+    predictions = store.read("predictions", ["school", "crop_file", "final_race"],
+                             school_filter + [("crop_file", "in", faces.column("crop_file").to_pylist())])
+    joined = predictions.join(faces, ["school", "crop_file"]).join(images, ["school", "image_url"])
+    counts = joined.group_by(["school", "final_race"]).aggregate([("crop_file", "count")])
+    totals = joined.group_by(["school"]).aggregate([("crop_file", "count")])
+    total_of = dict(zip(totals.column("school").to_pylist(), totals.column("crop_file_count").to_pylist()))
+    shares = pc.divide(pc.cast(counts.column("crop_file_count"), pa.float64()),
+                       pa.array([total_of[s] for s in counts.column("school").to_pylist()], pa.float64()))
+    result = pa.table({"school": counts.column("school"), "final_race": counts.column("final_race"),
+                       "faces": counts.column("crop_file_count"), "share": shares})
+    return result.sort_by([("school", "ascending"), ("faces", "descending")])
+
+
+QUERIES = {"sacred-race-share": sacred_race_share}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", default=DEFAULT_STORE, help="Store directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("import", help="Backfill the store from data/raw, data/processed and results/")
+    commands.add_parser("tables", help="Rows and schools per table")
+    query = commands.add_parser("query", help="Run a cross-school query")
+    query.add_argument("name", choices=sorted(QUERIES))
+    query.add_argument("--school", help="Only this school (its partition is the only one read)")
+    args = parser.parse_args()
+
+    store = ParquetStore(args.store)
+    if args.command == "import":
+        import_legacy(store)
+    elif args.command == "tables":
+        for table in SCHEMAS:
+            schools = store.schools(table)
+            rows = store.dataset(table).count_rows() if schools else 0
+            print(f"{table:<12} {rows:>7} rows, {len(schools)} schools")
+    else:
+        result = QUERIES[args.name](store, args.school)
+        current = None
+        for row in result.to_pylist():
+            if row["school"] != current:
+                current = row["school"]
+                print(f"\n{current}:")
+            print(f" - {row['final_race']}: {row['faces']} ({100 * row['share']:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
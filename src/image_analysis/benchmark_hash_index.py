@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Shows how the BK-tree near-duplicate lookup scales compared with a linear scan.
+
+Builds synthetic corpora of 64-bit hashes (random "distinct images" plus
+near-duplicates made by flipping a few bits of one of them), indexes each size
+in a BKTree, and times radius queries against the tree and against a linear
+scan over every hash. Both must return the same matches; the report shows
+insert and query time and the fraction of the corpus each query had to compare.
+
+Usage:
+    python benchmark_hash_index.py
+    python benchmark_hash_index.py --sizes 1000 10000 100000 --radius 4 --queries 200
+"""
+
+import argparse
+import random
+import time
+
+from hash_index import BKTree, hamming
+
+
+def near_copy(value, rng, max_flips):
+    for bit in rng.sample(range(64), rng.randint(0, max_flips)):
+        value ^= 1 << bit
+    return value
+
+
+def make_corpus(size, rng, duplicate_fraction=0.3, max_flips=3):
+    hashes = []
+    for _ in range(size):
+        if hashes and rng.random() < duplicate_fraction:
+            hashes.append(near_copy(rng.choice(hashes), rng, max_flips))
+        else:
+            hashes.append(rng.getrandbits(64))
+    return hashes
+
+
+def linear_search(hashes, value, radius):
+    return sorted(i for i, other in enumerate(hashes) if hamming(value, other) <= radius)
+
+
+def benchmark(sizes, radius, queries, seed):
+    rng = random.Random(seed)
+    print(f"radius {radius}, {queries} queries per size (half near-duplicates of stored hashes)\n")
+    print(f"{'hashes':>8} {'build s':>8} {'tree ms/q':>10} {'scan ms/q':>10} {'speed-up':>9} "
+          f"{'compared':>9} {'matches/q':>10}")
+    for size in sizes:
+        hashes = make_corpus(size, rng)
+        started = time.perf_counter()
+        tree = BKTree()
+        for i, value in enumerate(hashes):
+            tree.add(value, i)
+        build = time.perf_counter() - started
+
+        probes = [near_copy(rng.choice(hashes), rng, radius) if i % 2 else rng.getrandbits(64)
+                  for i in range(queries)]
+        started = time.perf_counter()
+        tree_results = [sorted(item for _, item in tree.search(value, radius)) for value in probes]
+        tree_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        scan_results = [linear_search(hashes, value, radius) for value in probes]
+        scan_time = time.perf_counter() - started
+
+        if tree_results != scan_results:
+            raise AssertionError(f"BK-tree and linear scan disagree at {size} hashes")
+        matches = sum(len(result) for result in tree_results) / queries
+        print(f"{size:>8} {build:>8.2f} {1000 * tree_time / queries:>10.3f} {1000 * scan_time / queries:>10.3f} "
+              f"{scan_time / tree_time if tree_time else 0:>8.1f}x "
+              f"{100 * tree.comparisons / queries / size:>8.1f}% {matches:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--radius", type=int, default=4, help="Hamming radius of each query")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    benchmark(args.sizes, args.radius, args.queries, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Compares single-image and multi-image vision requests against the local mock endpoint.
+
+Starts mock_vision_server in-process (with per-request and per-image latency,
+and optionally malformed batch replies), classifies the same image URLs once per
+image and then in batches of each K, and reports requests per image, wall time,
+request latency and agreement with the single-image verdicts. The response
+cache is disabled so every mode pays for its own requests.
+
+Usage:
+    python benchmark_vision_batching.py
+    python benchmark_vision_batching.py --csv ../../data/raw/roncalli-school-image-urls-unique.csv --batch-sizes 4 8 16
+    python benchmark_vision_batching.py --malformed-rate 0.2
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from mock_vision_server import start_mock_server
+from sacred import vision_prompt, load_urls
+from vision_client import VisionClassifier
+
+DEFAULT_CSV = "../../data/raw/cardinalritter-school-image-urls-unique.csv"
+
+
+async def run_mode(base_url, urls, batch_size, concurrency, rate):
+    classifier = VisionClassifier(vision_prompt, base_url=base_url, model="mock", concurrency=concurrency,
+                                  rate=rate, backoff=0.05, cache=None, batch_size=batch_size)
+    started = time.perf_counter()
+    verdicts = await classifier.classify_many(urls)
+    wall = time.perf_counter() - started
+    await classifier.close()
+    return verdicts, wall, classifier
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def benchmark(urls, batch_sizes, concurrency, rate, latency, per_image_latency, malformed_rate):
+    server, state, base_url = start_mock_server(latency=latency, per_image_latency=per_image_latency,
+                                                malformed_rate=malformed_rate)
+    try:
+        print(f"{len(urls)} images, mock latency {latency * 1000:.0f} ms/request + "
+              f"{per_image_latency * 1000:.0f} ms/image, malformed batch replies {100 * malformed_rate:.0f}%\n")
+        print(f"{'mode':<10} {'requests':>8} {'req/img':>8} {'wall s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'re-splits':>9} {'agree':>7}")
+
+        baseline = None
+        for batch_size in [1] + [k for k in batch_sizes if k > 1]:
+            verdicts, wall, classifier = await run_mode(base_url, urls, batch_size, concurrency, rate)
+            if baseline is None:
+                baseline = verdicts
+            agree = sum(1 for url in urls if verdicts.get(url) == baseline.get(url))
+            latencies = classifier.latencies
+            print(f"{'single' if batch_size == 1 else f'batch {batch_size}':<10} "
+                  f"{classifier.stats['requests']:>8} {classifier.stats['requests'] / len(urls):>8.3f} "
+                  f"{wall:>8.2f} {1000 * statistics.median(latencies) if latencies else 0:>8.0f} "
+                  f"{1000 * percentile(latencies, 0.95):>8.0f} {classifier.stats['resplits']:>9} "
+                  f"{100 * agree / len(urls):>6.1f}%")
+    finally:
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="School image-URL CSV to sample")
+    parser.add_argument("--limit", type=int, default=200, help="Number of image URLs")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=50.0, help="Requests per second")
+    parser.add_argument("--latency", type=float, default=0.3, help="Mock seconds per request")
+    parser.add_argument("--per-image-latency", type=float, default=0.02, help="Mock seconds per image")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of malformed batch replies")
+    args = parser.parse_args()
+
+    urls = load_urls(args.csv, args.limit)
+    asyncio.run(benchmark(urls, args.batch_sizes, args.concurrency, args.rate, args.latency,
+                          args.per_image_latency, args.malformed_rate))
+
+
+if __name__ == "__main__":
+    main()
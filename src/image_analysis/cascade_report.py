@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Replays the early-exit backend cascade on saved demographs debug logs.
+
+For every image whose log entry holds the predictions of all three backends
+(written by full-ensemble runs of demographs.py), the cascade is re-run on those
+stored predictions and compared with the full ensemble: how many backend calls
+it would have skipped, and how many final race/gender labels would change.
+
+Only logs written by the current demographs.py store per-backend predictions (the
+"backends" field); older logs keep just the final labels and gender votes, from
+which a cascade cannot be replayed. To report on a school, run demographs.py for
+it once without --cascade (the full ensemble, so every backend is recorded) and
+point --logs at the new debug log. Entries without the field are counted and skipped.
+
+Usage:
+    python cascade_report.py
+    python cascade_report.py --logs ../../results/roncalli_debug_log.json --order mtcnn opencv retinaface
+"""
+
+import argparse
+import glob
+import json
+import os
+
+from demographs import BACKENDS, CASCADE_ORDER, get_final_demographics, run_cascade
+
+DEFAULT_LOGS = "../../results/*_debug_log.json"
+
+
+def replay(entry, order, ambiguity_gap):
+    """
+    Returns (full labels, cascade labels, backend calls made by the cascade) for one
+    log entry, or None if the entry does not hold every backend's prediction.
+    """
+    stored = entry.get("backends")
+    if not stored or any(backend not in stored for backend in BACKENDS):
+        return None
+    predictions = {backend: dict(prediction, backend=backend)
+                   for backend, prediction in stored.items() if prediction is not None}
+
+    full_race, full_gender, _, _ = get_final_demographics(list(predictions.values()), ambiguity_gap)
+    cascaded, called = run_cascade(predictions.get, order, ambiguity_gap)
+    race, gender, _, _ = get_final_demographics(cascaded, ambiguity_gap)
+    return (full_race, full_gender), (race, gender), len(called)
+
+
+def report_log(path, order, ambiguity_gap):
+    """Prints the replay statistics for one debug log; returns its totals."""
+    with open(path) as f:
+        entries = json.load(f)
+
+    totals = {"images": 0, "unusable": 0, "calls": 0, "full_calls": 0, "race_drift": 0, "gender_drift": 0}
+    for entry in entries:
+        result = replay(entry, order, ambiguity_gap)
+        if result is None:
+            totals["unusable"] += 1
+            continue
+        (full_race, full_gender), (race, gender), calls = result
+        totals["images"] += 1
+        totals["calls"] += calls
+        totals["full_calls"] += len(BACKENDS)
+        totals["race_drift"] += int(race != full_race)
+        totals["gender_drift"] += int(gender != full_gender)
+
+    print_totals(os.path.basename(path), totals)
+    return totals
+
+
+def print_totals(label, totals):
+    images, full_calls = totals["images"], totals["full_calls"]
+    if not images:
+        print(f"{label}: no entries with all backend predictions ({totals['unusable']} without)")
+        print(" - the log predates per-backend logging or came from a --cascade run; "
+              "re-run demographs.py for this school without --cascade to record them")
+        return
+    skipped = full_calls - totals["calls"]
+    print(f"{label}: {images} images"
+          + (f" ({totals['unusable']} without per-backend predictions ignored)" if totals["unusable"] else ""))
+    print(f" - backend calls: {totals['calls']} of {full_calls}, skipped {skipped} ({100 * skipped / full_calls:.1f}%)")
+    print(f" - race label drift:   {totals['race_drift']} ({100 * totals['race_drift'] / images:.1f}%)")
+    print(f" - gender label drift: {totals['gender_drift']} ({100 * totals['gender_drift'] / images:.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logs", default=DEFAULT_LOGS, help="Glob of demographs debug logs")
+    parser.add_argument("--order", nargs="+", default=CASCADE_ORDER, choices=BACKENDS, help="Cascade backend order")
+    parser.add_argument("--ambiguity-gap", type=float, default=0.05)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(args.logs))
+    if not paths:
+        print(f"No debug logs match {args.logs}; run demographs.py first.")
+        return
+
+    overall = {}
+    for path in paths:
+        for key, value in report_log(path, args.order, args.ambiguity_gap).items():
+            overall[key] = overall.get(key, 0) + value
+    if len(paths) > 1:
+        print()
+        print_totals("All schools", overall)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,72 @@
+import argparse
+import concurrent.futures
+import csv
+import errno
+import itertools
+import multiprocessing
 import os
 import json
+import shutil
+import sys
 from collections import Counter
-from deepface import DeepFace
 from PIL import Image
 import numpy as np
 
+from inference_cache import InferenceCache, MultiAttributeAnalyzer, DEFAULT_CACHE_PATH
+from model_runtime import lazy_deepface, warm_up
+from fingerprints import FingerprintManifest
+from hash_index import NearDuplicateClusters
+from face_identity import DEFAULT_EMBEDDING_DIR, SIMILARITY_THRESHOLD
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_cleaning"))
+from deduplicate import open_store
+
+BACKENDS = ["mtcnn", "retinaface", "opencv"]
+
+# How crops are placed into results/<school>/<race>/<gender>:
+#   reencode  decode and re-save the image (original behaviour)
+#   link      hardlink, else reflink, else byte copy of the original file
+#   manifest  no tree; write results/<school>_manifest.csv (or .parquet) instead
+OUTPUT_MODES = ["reencode", "link", "manifest"]
+FICLONE = 0x40049409  # Linux ioctl that makes a copy-on-write clone (btrfs, xfs)
+
+# Cascade mode runs the detectors cheapest first and stops once the answer is clear
+CASCADE_ORDER = ["opencv", "mtcnn", "retinaface"]
+
 def softmax(scores):
     vals = np.array(list(scores.values()), dtype=np.float64)
     exp_scores = np.exp(vals - np.max(vals))  # numerical stability
     probs = exp_scores / np.sum(exp_scores)
     return dict(zip(scores.keys(), probs))
 
-def analyze_with_backends(image_path, backends):
+def to_prediction(result, backend=None):
+    """Turns one DeepFace-style result (raw race percentages) into a per-backend prediction."""
+    scores = result.get("race", {})
+    soft_scores = softmax(scores)
+    dominant_race = max(soft_scores, key=soft_scores.get)
+    return {
+        "backend": backend or result.get("backend"),
+        "race": dominant_race.lower(),
+        "race_scores": soft_scores,
+        "gender": result.get("dominant_gender", "unknown").lower()
+    }
+
+def analyze_with_backends(image_path, backends, analyzer=None):
+    if analyzer is not None:
+        # Single pass: one read/decode, one detection per backend, batched models, cached scores
+        return [to_prediction(result) for result in analyzer.analyze_many([image_path], backends)[image_path]]
+
     all_preds = []
     for backend in backends:
         try:
-            result = DeepFace.analyze(
+            result = lazy_deepface().analyze(
                 img_path=image_path,
                 actions=['race', 'gender'],
                 detector_backend=backend,
                 enforce_detection=False
             )
             result = result[0] if isinstance(result, list) else result
-
-            scores = result.get("race", {})
-            soft_scores = softmax(scores)
-            dominant_race = max(soft_scores, key=soft_scores.get)
-            gender = result.get("dominant_gender", "unknown").lower()
-
-            all_preds.append({
-                "race": dominant_race.lower(),
-                "race_scores": soft_scores,
-                "gender": gender
-            })
+            all_preds.append(to_prediction(result, backend))
 
         except Exception as e:
             print(f"⚠️ Backend '{backend}' failed: {e}")
@@ -69,56 +103,537 @@ def get_final_demographics(predictions, ambiguity_gap=0.05):
 
     return final_race, final_gender, gender_counts, final_confidence
 
-def analyze_and_organize_faces(cropped_folder, results_base_path, school_name):
-    race_counts = Counter()
-    debug_logs = []
+def cascade_settled(predictions, ambiguity_gap=0.05):
+    """True once the predictions so far give an unambiguous race and agree on gender."""
+    if not predictions:
+        return False
+    final_race, _, gender_votes, _ = get_final_demographics(predictions, ambiguity_gap)
+    return final_race != "ambiguous" and len(gender_votes) == 1
 
-    image_files = [f for f in os.listdir(cropped_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+def run_cascade(predict, order=CASCADE_ORDER, ambiguity_gap=0.05):
+    """
+    Calls `predict(backend)` (a prediction dict or None) in `order` until cascade_settled.
 
-    for i, image_file in enumerate(image_files):
-        image_path = os.path.join(cropped_folder, image_file)
+    Returns:
+        tuple: (predictions, backends called)
+    """
+    predictions = []
+    called = []
+    for backend in order:
+        called.append(backend)
+        prediction = predict(backend)
+        if prediction is not None:
+            predictions.append(prediction)
+        if cascade_settled(predictions, ambiguity_gap):
+            break
+    return predictions, called
+
+def analyze_many_safely(analyzer, paths, backends):
+    """analyzer.analyze_many, falling back to one image at a time if the batch fails."""
+    try:
+        return analyzer.analyze_many(paths, backends)
+    except Exception as e:
+        print(f"⚠️ Batched inference failed, falling back to one image at a time: {e}")
+    results = {}
+    for path in paths:
         try:
-            img = Image.open(image_path).convert("RGB")
-            if img.size[0] < 50 or img.size[1] < 50:
-                print(f"[{i+1}] ⛔ Skipping low-res image: {image_file}")
-                race_counts["LowQuality"] += 1
-                continue
+            results[path] = analyzer.analyze_many([path], backends)[path]
+        except Exception as e:
+            print(f"⚠️ Inference failed for {path}: {e}")
+    return results
+
+def prefetch_predictions(analyzer, paths, cascade_order=None, ambiguity_gap=0.05):
+    """
+    Runs the analyzer over a chunk of crops so the race/gender models see batches
+    of faces. With `cascade_order`, each stage of the cascade is one batched call
+    over the crops that are still undecided.
+
+    Returns:
+        dict: {path: (predictions, backends called)}
+    """
+    if not cascade_order:
+        results = analyze_many_safely(analyzer, paths, BACKENDS)
+        return {path: ([to_prediction(r) for r in results.get(path, [])], list(BACKENDS)) for path in paths}
+
+    outcomes = {path: ([], []) for path in paths}
+    undecided = list(paths)
+    for backend in cascade_order:
+        if not undecided:
+            break
+        results = analyze_many_safely(analyzer, undecided, [backend])
+        still_undecided = []
+        for path in undecided:
+            predictions, called = outcomes[path]
+            called.append(backend)
+            predictions.extend(to_prediction(r) for r in results.get(path, []))
+            if not cascade_settled(predictions, ambiguity_gap):
+                still_undecided.append(path)
+        undecided = still_undecided
+    return outcomes
+
+def is_low_res(image_path):
+    # Image.open only parses the header; the pixels are never decoded
+    with Image.open(image_path) as img:
+        width, height = img.size
+    return width < 50 or height < 50
+
+def link_or_copy(src, dst):
+    """
+    Places `src` at `dst` without re-encoding: a hardlink if possible, else a
+    reflink (copy-on-write clone), else a plain byte copy.
+
+    Returns:
+        str: "hardlink", "reflink" or "copy"
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass
+    try:
+        import fcntl  # POSIX only; on Windows the crop is copied
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return "reflink"
+    except ImportError:
+        pass
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.EBADF, errno.ENOSYS):
+            raise
+    shutil.copyfile(src, dst)
+    return "copy"
+
+def place_crop(image_path, target_dir, image_file, output_mode):
+    """Puts one crop into a category folder according to `output_mode`."""
+    os.makedirs(target_dir, exist_ok=True)
+    if output_mode == "link":
+        link_or_copy(image_path, os.path.join(target_dir, image_file))
+    else:
+        Image.open(image_path).convert("RGB").save(os.path.join(target_dir, image_file))
+
+MANIFEST_COLUMNS = ["image", "path", "status", "final_race", "final_gender", "confidence"]
+
+def write_manifest(rows, path):
+    """Writes the image -> label manifest as Parquet (for a .parquet path) or CSV."""
+    if path.endswith(".parquet"):
+        import pandas as pd
+        pd.DataFrame(rows, columns=MANIFEST_COLUMNS).to_parquet(path, index=False)
+        return
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def classify_crop(image_path, cascade_order=None, ambiguity_gap=0.05):
+    """Per-backend predictions for one crop via DeepFace.analyze; returns (predictions, backends called)."""
+    if not cascade_order:
+        return analyze_with_backends(image_path, BACKENDS), list(BACKENDS)
+
+    def predict(backend):
+        predictions = analyze_with_backends(image_path, [backend])
+        return predictions[0] if predictions else None
+
+    return run_cascade(predict, cascade_order, ambiguity_gap)
+
+def backend_log(predictions, called):
+    """Per-backend predictions for the debug log (None for a backend that found no face)."""
+    by_backend = {backend: None for backend in called}
+    for prediction in predictions:
+        by_backend[prediction["backend"]] = {
+            "race": prediction["race"],
+            "race_scores": {race: round(float(score), 6) for race, score in prediction["race_scores"].items()},
+            "gender": prediction["gender"]
+        }
+    return by_backend
+
+def file_crop(i, image_file, cropped_folder, results_base_path, school_name, outcome, ambiguity_gap,
+              race_counts, debug_logs, output_mode="reencode", manifest_rows=None):
+    """
+    Aggregates one crop's predictions, places it into results/<school>/<race>/<gender>
+    (or adds it to the manifest) and updates the counts and debug log.
+
+    Args:
+        outcome (tuple): ("lowres", None), ("ok", (predictions, backends called)) or ("error", message)
+        output_mode (str): One of OUTPUT_MODES
+        manifest_rows (list): Receives one row per crop in "manifest" mode
+    """
+    kind, payload = outcome
+    image_path = os.path.join(cropped_folder, image_file)
+
+    def add_manifest_row(status, final_race="", final_gender="", confidence=""):
+        if manifest_rows is not None:
+            manifest_rows.append({"image": image_file, "path": image_path, "status": status,
+                                  "final_race": final_race, "final_gender": final_gender,
+                                  "confidence": confidence})
+
+    if kind == "lowres":
+        print(f"[{i+1}] ⛔ Skipping low-res image: {image_file}")
+        race_counts["LowQuality"] += 1
+        add_manifest_row("LowQuality")
+        return
 
-            predictions = analyze_with_backends(image_path, ["mtcnn", "retinaface", "opencv"])
-            final_race, final_gender, gender_votes, confidence = get_final_demographics(predictions)
+    try:
+        if kind == "error":
+            raise RuntimeError(payload)
+        predictions, called = payload
+        final_race, final_gender, gender_votes, confidence = get_final_demographics(predictions, ambiguity_gap)
 
-            # Clean folder names
-            race_folder = final_race.lower().replace(" ", "_")
-            gender_folder = final_gender.lower().replace(" ", "_")
+        # Clean folder names
+        race_folder = final_race.lower().replace(" ", "_")
+        gender_folder = final_gender.lower().replace(" ", "_")
 
-            race_counts[f"{race_folder}/{gender_folder}"] += 1
+        race_counts[f"{race_folder}/{gender_folder}"] += 1
 
+        if output_mode == "manifest":
+            add_manifest_row("ok", final_race, final_gender, round(confidence, 4))
+        else:
             target_dir = os.path.join(results_base_path, school_name, race_folder, gender_folder)
-            os.makedirs(target_dir, exist_ok=True)
-            img.save(os.path.join(target_dir, image_file))
+            place_crop(image_path, target_dir, image_file, output_mode)
 
-            debug_logs.append({
-                "image": image_file,
-                "final_race": final_race,
-                "final_gender": final_gender,
-                "confidence": round(confidence, 4),
-                "gender_votes": dict(gender_votes)
-            })
+        debug_logs.append({
+            "image": image_file,
+            "final_race": final_race,
+            "final_gender": final_gender,
+            "confidence": round(confidence, 4),
+            "gender_votes": dict(gender_votes),
+            "backends": backend_log(predictions, called)
+        })
 
-        except Exception as e:
-            print(f"[{i+1}] ❌ Error processing {image_file}: {e}")
-            race_counts["Error"] += 1
-            error_dir = os.path.join(results_base_path, school_name, "error")
-            os.makedirs(error_dir, exist_ok=True)
+    except Exception as e:
+        print(f"[{i+1}] ❌ Error processing {image_file}: {e}")
+        race_counts["Error"] += 1
+        add_manifest_row("Error")
+        if output_mode == "manifest":
+            return
+        error_dir = os.path.join(results_base_path, school_name, "error")
+        try:
+            place_crop(image_path, error_dir, image_file, output_mode)
+        except:
+            pass
+
+def list_crops(cropped_folder):
+    # Sorted so serial and parallel runs produce identical debug logs
+    return sorted(f for f in os.listdir(cropped_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+
+def cluster_crops(cropped_folder, image_files, max_distance=4, method="phash"):
+    """
+    Groups near-identical crops (the same headshot cropped from several pages) by
+    perceptual hash. The largest crop of each cluster is its representative, and
+    only representatives are analyzed and counted.
+
+    Returns:
+        tuple: (representative image files in listing order, NearDuplicateClusters)
+    """
+    from perceptual_hash import compute_hash
+
+    clusters = NearDuplicateClusters(max_distance)
+    hashed = []
+    for image_file in image_files:
+        image_path = os.path.join(cropped_folder, image_file)
+        try:
+            with Image.open(image_path) as img:
+                hashed.append((-img.size[0] * img.size[1], image_file, compute_hash(img, method)))
+        except Exception:
+            # Unreadable crops stay on their own and fail later with a proper error entry
+            clusters.representative_of[image_file] = image_file
+    for _, image_file, value in sorted(hashed):
+        clusters.assign(image_file, value)
+    representatives = [f for f in image_files if clusters.representative_of[f] == f]
+    return representatives, clusters
+
+def group_identities(cropped_folder, image_files, school_name, embedding_dir, threshold, batch_size=64):
+    """
+    Clusters the crops by face embedding (face_identity.py) so each person is analyzed once.
+    Crops that cannot be embedded stay identities of their own.
+
+    Returns:
+        tuple: (representative image files in listing order, {representative: members}, crops newly embedded)
+    """
+    from face_identity import EmbeddingStore, embed_crops, cluster_identities
+
+    store = EmbeddingStore(embedding_dir, school_name)
+    embedded, embeddings, new = embed_crops(cropped_folder, image_files, store, batch_size=batch_size)
+    identities = cluster_identities(embedded, embeddings, threshold)
+    for image_file in set(image_files) - set(embedded):
+        identities[image_file] = [image_file]
+    return [f for f in image_files if f in identities], identities, new
+
+def per_crop_counts(cropped_folder, identities, debug_logs):
+    """Expands per-identity results to per-crop counts: every crop counts with its identity's label."""
+    labels = {entry["image"]: f"{entry['final_race'].lower().replace(' ', '_')}/"
+                              f"{entry['final_gender'].lower().replace(' ', '_')}" for entry in debug_logs}
+    counts = Counter()
+    for representative, members in identities.items():
+        label = labels.get(representative)
+        if label is None:
+            # Not in the debug log: the representative was skipped as low-res or failed
+            try:
+                label = "LowQuality" if is_low_res(os.path.join(cropped_folder, representative)) else "Error"
+            except Exception:
+                label = "Error"
+        counts[label] += len(members)
+    return dict(counts)
+
+def classify_all(cropped_folder, image_files, analyzer, chunk_size, cascade_order=None, ambiguity_gap=0.05):
+    """Yields (image file, outcome) for each crop, in order."""
+    for start in range(0, len(image_files), chunk_size):
+        chunk = image_files[start:start + chunk_size]
+        outcomes = {}
+        to_analyze = []
+        for image_file in chunk:
+            image_path = os.path.join(cropped_folder, image_file)
             try:
-                img.save(os.path.join(error_dir, image_file))
-            except:
-                pass
+                if is_low_res(image_path):
+                    outcomes[image_file] = ("lowres", None)
+                elif analyzer is None:
+                    outcomes[image_file] = ("ok", classify_crop(image_path, cascade_order, ambiguity_gap))
+                else:
+                    to_analyze.append(image_file)
+            except Exception as e:
+                outcomes[image_file] = ("error", str(e))
+
+        if to_analyze:
+            paths = [os.path.join(cropped_folder, image_file) for image_file in to_analyze]
+            prefetched = prefetch_predictions(analyzer, paths, cascade_order, ambiguity_gap)
+            for image_file, path in zip(to_analyze, paths):
+                outcomes[image_file] = ("ok", prefetched[path])
+
+        for image_file in chunk:
+            yield image_file, outcomes[image_file]
+
+def count_backend_calls(debug_logs):
+    """Returns (backend calls made, calls the full ensemble would have made) for a debug log."""
+    made = sum(len(entry.get("backends", BACKENDS)) for entry in debug_logs)
+    return made, len(BACKENDS) * len(debug_logs)
+
+def analyze_and_organize_faces(cropped_folder, results_base_path, school_name, analyzer=None,
+                               ambiguity_gap=0.05, chunk_size=32, cascade_order=None, output_mode="reencode",
+                               manifest_rows=None, image_files=None):
+    """
+    Classifies every crop in `cropped_folder` and files it under results/<school>/<race>/<gender>.
+
+    Args:
+        analyzer (MultiAttributeAnalyzer): Cached single-pass inference; None calls
+            DeepFace.analyze once per backend as before
+        ambiguity_gap (float): Passed to get_final_demographics
+        chunk_size (int): Crops whose faces are batched through the models together
+        cascade_order (list): Run these backends in order, stopping early once the
+            result is unambiguous; None runs all of BACKENDS
+        output_mode (str): How crops are placed in the results tree (see OUTPUT_MODES)
+        manifest_rows (list): Receives the image -> label rows in "manifest" mode
+        image_files (list): Crops to classify (default: every crop in the folder)
+
+    Returns:
+        tuple: (race/gender counts, per-image debug log)
+    """
+    race_counts = Counter()
+    debug_logs = []
+
+    if image_files is None:
+        image_files = list_crops(cropped_folder)
+    outcomes = classify_all(cropped_folder, image_files, analyzer, chunk_size, cascade_order, ambiguity_gap)
+    for i, (image_file, outcome) in enumerate(outcomes):
+        file_crop(i, image_file, cropped_folder, results_base_path, school_name, outcome, ambiguity_gap,
+                  race_counts, debug_logs, output_mode, manifest_rows)
+
+    return dict(race_counts), debug_logs
+
+# --- Incremental mode ------------------------------------------------------
+
+def get_fingerprint_path(results_base_path, school_name):
+    return os.path.join(results_base_path, f"{school_name}_fingerprints.json")
+
+def remove_placed_crop(results_base_path, school_name, image_file, count_key):
+    """Deletes a retracted crop from the race/gender (or error) tree, if it was placed there."""
+    folder = "error" if count_key == "Error" else count_key
+    if not folder or folder == "LowQuality":
+        return
+    try:
+        os.remove(os.path.join(results_base_path, school_name, *folder.split("/"), image_file))
+    except FileNotFoundError:
+        pass
+
+def analyze_and_organize_faces_incremental(cropped_folder, results_base_path, school_name, manifest,
+                                           analyzer=None, ambiguity_gap=0.05, chunk_size=32, cascade_order=None,
+                                           output_mode="reencode", image_files=None):
+    """
+    Brings a school's results up to date with its crop folder using a FingerprintManifest:
+    only new or changed crops are analyzed, deleted ones are retracted from the counts
+    (and the tree), and the rest keep their stored results. If the ambiguity gap or the
+    output mode differs from the previous run, the stored predictions are re-aggregated
+    and re-placed without inference.
+
+    Returns:
+        tuple: (race/gender counts, debug log, manifest rows, {"new/changed", "deleted", "unchanged", "regrouped"})
+    """
+    # Crops left out of `image_files` (e.g. near-duplicates) are treated as deleted
+    if image_files is None:
+        image_files = list_crops(cropped_folder)
+    changed, unchanged, deleted = manifest.diff(cropped_folder, image_files)
+    # Crops that failed last time are retried
+    retry = [image_file for image_file in unchanged if manifest.entries[image_file]["outcome"][0] == "error"]
+    changed = sorted(changed + retry)
+    unchanged = sorted(set(unchanged) - set(retry))
+    # Manifests from before output modes were recorded may have placed crops in any mode
+    mode_changed = manifest.output_mode != output_mode and (manifest.output_mode or manifest.entries)
+    regroup = unchanged if manifest.ambiguity_gap not in (None, ambiguity_gap) or mode_changed else []
+    regroup_outcomes = [(image_file, manifest.entries[image_file]["outcome"]) for image_file in regroup]
+    manifest.ambiguity_gap = ambiguity_gap
+    manifest.output_mode = output_mode
+
+    for image_file in deleted + changed + regroup:
+        entry = manifest.retract(image_file)
+        if entry is not None:
+            remove_placed_crop(results_base_path, school_name, image_file, entry["count_key"])
+
+    def record(i, image_file, outcome):
+        counts, logs, rows = Counter(), [], []
+        file_crop(i, image_file, cropped_folder, results_base_path, school_name, outcome, ambiguity_gap,
+                  counts, logs, output_mode, rows)
+        manifest.record(cropped_folder, image_file, outcome, next(iter(counts), None),
+                        logs[0] if logs else None, rows[0] if rows else None)
+
+    outcomes = classify_all(cropped_folder, changed, analyzer, chunk_size, cascade_order, ambiguity_gap)
+    for i, (image_file, outcome) in enumerate(outcomes):
+        record(i, image_file, list(outcome))
+    for i, (image_file, outcome) in enumerate(regroup_outcomes, start=len(changed)):
+        record(i, image_file, outcome)
+
+    manifest.save()
+    stats = {"new/changed": len(changed), "deleted": len(deleted), "unchanged": len(unchanged),
+             "regrouped": len(regroup)}
+    return dict(manifest.counts), manifest.debug_logs(), manifest.manifest_rows(), stats
+
+# --- Parallel mode ---------------------------------------------------------
+
+_worker_analyzer = None
+
+def thread_caps(workers, intra_op_threads=None, inter_op_threads=1):
+    """Splits the cores between the workers: returns (intra-op, inter-op) threads per worker."""
+    intra = intra_op_threads or max(1, (os.cpu_count() or 1) // workers)
+    return intra, inter_op_threads
+
+def apply_thread_caps(intra_op_threads, inter_op_threads):
+    """Caps TensorFlow/BLAS threads in this process so parallel workers don't oversubscribe the CPU."""
+    os.environ["OMP_NUM_THREADS"] = str(intra_op_threads)
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(intra_op_threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = str(inter_op_threads)
+    try:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except (ImportError, RuntimeError):
+        # RuntimeError: TensorFlow already initialized; the environment variables still apply
+        pass
+
+def init_worker(intra_op_threads, inter_op_threads, cache_path, batch_size):
+    """Process-pool initializer: caps threads and loads the models once per worker."""
+    global _worker_analyzer
+    apply_thread_caps(intra_op_threads, inter_op_threads)
+    cache = InferenceCache(cache_path) if cache_path else None
+    _worker_analyzer = MultiAttributeAnalyzer(BACKENDS, cache=cache, batch_size=batch_size)
+    _worker_analyzer.warm_up()
+
+def classify_shard(cropped_folder, image_files, cascade_order=None, ambiguity_gap=0.05):
+    """Runs in a worker process: returns [(image file, outcome)] for one shard of crops."""
+    return list(classify_all(cropped_folder, image_files, _worker_analyzer, len(image_files),
+                             cascade_order, ambiguity_gap))
+
+def analyze_and_organize_faces_parallel(cropped_folder, results_base_path, school_name, workers,
+                                        ambiguity_gap=0.05, chunk_size=32, cache_path=DEFAULT_CACHE_PATH,
+                                        intra_op_threads=None, inter_op_threads=1, cascade_order=None,
+                                        output_mode="reencode", manifest_rows=None, image_files=None):
+    """
+    Same results as analyze_and_organize_faces, with inference sharded across a process pool.
+
+    Each worker loads the race/gender models once and returns the prediction dicts for
+    its shard; the parent aggregates and files the crops in listing order, so the counts
+    and debug log do not depend on which worker finished first.
+
+    Args:
+        workers (int): Worker processes
+        chunk_size (int): Crops per shard (and per batched forward pass)
+        cache_path (str): Shared inference cache (None disables it)
+        intra_op_threads (int): Threads per worker for one op (default: cores / workers)
+        inter_op_threads (int): Ops a worker runs concurrently
+        image_files (list): Crops to classify (default: every crop in the folder)
+
+    Returns:
+        tuple: (race/gender counts, per-image debug log)
+    """
+    race_counts = Counter()
+    debug_logs = []
+
+    if image_files is None:
+        image_files = list_crops(cropped_folder)
+    shards = [image_files[start:start + chunk_size] for start in range(0, len(image_files), chunk_size)]
+    intra, inter = thread_caps(workers, intra_op_threads, inter_op_threads)
+    # Set before the workers start so they import TensorFlow with the caps in place
+    for name, value in (("OMP_NUM_THREADS", intra), ("TF_NUM_INTRAOP_THREADS", intra), ("TF_NUM_INTEROP_THREADS", inter)):
+        os.environ[name] = str(value)
+    print(f"⚙️ {workers} workers x {intra} intra-op / {inter} inter-op threads, {len(shards)} shards")
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(intra, inter, cache_path, chunk_size)) as executor:
+        i = 0
+        # map() yields shard results in submission order: deterministic merge
+        for shard_results in executor.map(classify_shard, itertools.repeat(cropped_folder), shards,
+                                          itertools.repeat(cascade_order), itertools.repeat(ambiguity_gap)):
+            for image_file, outcome in shard_results:
+                file_crop(i, image_file, cropped_folder, results_base_path, school_name, outcome, ambiguity_gap,
+                          race_counts, debug_logs, output_mode, manifest_rows)
+                i += 1
 
     return dict(race_counts), debug_logs
 
 if __name__ == '__main__':
-    school_name = input("Enter the school name: ").strip().lower().replace(" ", "")
+    parser = argparse.ArgumentParser(description="Classify cropped faces by race and gender.")
+    parser.add_argument("--school", help="School name (prompted for if omitted)")
+    parser.add_argument("--ambiguity-gap", type=float, default=0.05,
+                        help="Top-two race score gap below which a face is 'ambiguous'")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Inference cache database")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Call DeepFace.analyze per backend without the single-pass cache")
+    parser.add_argument("--batch-size", type=int, default=32, help="Faces per race/gender forward pass")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes for inference (1 runs in this process)")
+    parser.add_argument("--intra-op-threads", type=int,
+                        help="TensorFlow intra-op threads per worker (default: cores / workers)")
+    parser.add_argument("--inter-op-threads", type=int, default=1, help="TensorFlow inter-op threads per worker")
+    parser.add_argument("--model-server", metavar="HOST:PORT",
+                        help="Use the warm models of a running model_server.py instead of loading them here")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Run the detectors cheapest first and skip the rest once the result is unambiguous")
+    parser.add_argument("--cascade-order", nargs="+", default=CASCADE_ORDER, choices=BACKENDS,
+                        help="Backend order for --cascade")
+    parser.add_argument("--output-mode", choices=OUTPUT_MODES, default="reencode",
+                        help="reencode: re-save each crop into the race/gender tree; link: hardlink/reflink/copy "
+                             "the original file; manifest: write an image -> label manifest instead of a tree")
+    parser.add_argument("--manifest-format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only analyze new or changed crops, retract deleted ones (runs in this process)")
+    parser.add_argument("--near-duplicates", action="store_true",
+                        help="Analyze and count only one crop per cluster of near-identical crops (perceptual hash)")
+    parser.add_argument("--hash-distance", type=int, default=4,
+                        help="Perceptual-hash Hamming distance treated as the same crop")
+    parser.add_argument("--identities", action="store_true",
+                        help="Cluster crops by face embedding and analyze one crop per person; per-crop counts "
+                             "give every crop its person's label, per-identity counts go to <school>_identities.json")
+    parser.add_argument("--identity-threshold", type=float, default=SIMILARITY_THRESHOLD,
+                        help="Cosine similarity of face embeddings treated as the same person")
+    parser.add_argument("--embedding-dir", default=DEFAULT_EMBEDDING_DIR, help="Where crop embeddings are stored")
+    parser.add_argument("--store", default="../../data/store", help="Parquet store directory")
+    parser.add_argument("--no-store", action="store_true", help="Do not write the predictions table")
+    parser.add_argument("--warm-up", action="store_true",
+                        help="Load the models before the first image and print a cold/warm startup report")
+    args = parser.parse_args()
+
+    school_name = (args.school or input("Enter the school name: ")).strip().lower().replace(" ", "")
     cropped_folder = f"../../data/processed/cropped_faces_{school_name}"
     results_base_path = "../../results"
 
@@ -126,8 +641,81 @@ if __name__ == '__main__':
         print(f"❌ Folder not found: {cropped_folder}")
         exit(1)
 
+    analyzer = None
+    use_pool = args.workers > 1 and not args.model_server and not args.incremental
+    if args.model_server:
+        from model_server import ModelClient
+        analyzer = ModelClient(args.model_server)
+    elif not use_pool and not args.no_cache:
+        analyzer = MultiAttributeAnalyzer(BACKENDS, cache=InferenceCache(args.cache), batch_size=args.batch_size)
+        if args.warm_up:
+            print(warm_up(analyzer).report())
+
+    cascade_order = args.cascade_order if args.cascade else None
+    manifest_rows = [] if args.output_mode == "manifest" else None
     print(f"🔍 Processing images in: {cropped_folder}")
-    race_summary, debug_logs = analyze_and_organize_faces(cropped_folder, results_base_path, school_name)
+    image_files = list_crops(cropped_folder)
+    if args.near_duplicates:
+        image_files, clusters = cluster_crops(cropped_folder, image_files, args.hash_distance)
+        print(f"🧬 Near-duplicate crops: {clusters.report()}")
+        clusters_path = os.path.join(results_base_path, f"{school_name}_crop_clusters.json")
+        with open(clusters_path, "w") as f:
+            json.dump({rep: members for rep, members in clusters.clusters().items() if len(members) > 1}, f, indent=4)
+        print(f"🧬 Clusters saved at: {clusters_path}")
+    identities = None
+    if args.identities:
+        image_files, identities, embedded = group_identities(cropped_folder, image_files, school_name,
+                                                             args.embedding_dir, args.identity_threshold,
+                                                             args.batch_size)
+        print(f"🧑‍🤝‍🧑 Identities: {sum(len(m) for m in identities.values())} crops -> {len(identities)} people "
+              f"({embedded} crops newly embedded)")
+    if args.incremental:
+        manifest = FingerprintManifest(get_fingerprint_path(results_base_path, school_name))
+        race_summary, debug_logs, all_rows, stats = analyze_and_organize_faces_incremental(
+            cropped_folder, results_base_path, school_name, manifest, analyzer=analyzer,
+            ambiguity_gap=args.ambiguity_gap, chunk_size=args.batch_size, cascade_order=cascade_order,
+            output_mode=args.output_mode, image_files=image_files)
+        if manifest_rows is not None:
+            manifest_rows = all_rows
+        print("♻️ Incremental: " + ", ".join(f"{count} {name}" for name, count in stats.items()))
+    elif use_pool:
+        # Workers always use single-pass inference; --no-cache only turns the memoization off
+        race_summary, debug_logs = analyze_and_organize_faces_parallel(
+            cropped_folder, results_base_path, school_name, args.workers,
+            ambiguity_gap=args.ambiguity_gap, chunk_size=args.batch_size,
+            cache_path=None if args.no_cache else args.cache,
+            intra_op_threads=args.intra_op_threads, inter_op_threads=args.inter_op_threads,
+            cascade_order=cascade_order, output_mode=args.output_mode, manifest_rows=manifest_rows,
+            image_files=image_files)
+    else:
+        race_summary, debug_logs = analyze_and_organize_faces(cropped_folder, results_base_path, school_name,
+                                                              analyzer=analyzer, ambiguity_gap=args.ambiguity_gap,
+                                                              chunk_size=args.batch_size, cascade_order=cascade_order,
+                                                              output_mode=args.output_mode, manifest_rows=manifest_rows,
+                                                              image_files=image_files)
+    if cascade_order:
+        made, full = count_backend_calls(debug_logs)
+        print(f"🪜 Cascade: {made} backend calls, {full - made} of {full} skipped "
+              f"({100 * (full - made) / full if full else 0:.1f}%)")
+    if args.model_server:
+        stats = analyzer.stats()
+        analyzer.close()
+        print(f"🗃️ Model server: {stats['requests']} requests, up {stats['uptime_seconds']:.0f}s, "
+              f"cache {stats['cache_hits']} hits / {stats['cache_misses']} misses")
+    elif analyzer is not None:
+        analyzer.cache.close()
+        print(f"🗃️ Inference cache: {analyzer.cache_hits} hits, {analyzer.cache_misses} misses "
+              f"(image x backend)")
+
+    identity_summary = None
+    if identities is not None:
+        # Counts so far are one per person; the summary JSON keeps its per-crop meaning
+        identity_summary = race_summary
+        race_summary = per_crop_counts(cropped_folder, identities, debug_logs)
+        identities_path = os.path.join(results_base_path, f"{school_name}_identities.json")
+        with open(identities_path, "w") as f:
+            json.dump({"identity_counts": identity_summary, "crop_counts": race_summary,
+                       "identities": identities}, f, indent=4)
 
     # Save summary
     summary_path = os.path.join(results_base_path, f"{school_name}_demographs.json")
@@ -139,10 +727,29 @@ if __name__ == '__main__':
     with open(debug_path, "w") as f:
         json.dump(debug_logs, f, indent=4)
 
+    if manifest_rows is not None:
+        manifest_path = os.path.join(results_base_path, f"{school_name}_manifest.{args.manifest_format}")
+        write_manifest(manifest_rows, manifest_path)
+        print(f"🗂️ Manifest saved at: {manifest_path}")
+
+    if not args.no_store:
+        store = open_store(args.store)
+        from parquet_store import prediction_rows
+        written = store.write("predictions", school_name, prediction_rows(debug_logs, identities))
+        print(f"🗄️ Predictions table: {written} crops written to the store at: {args.store}")
+
     print("\n📊 Final Race/Gender Summary:")
     for key, count in race_summary.items():
         print(f" - {key}: {count}")
 
+    if identity_summary is not None:
+        print("\n🧑‍🤝‍🧑 Per-identity Race/Gender Summary:")
+        for key, count in identity_summary.items():
+            print(f" - {key}: {count}")
+
     print(f"\n✅ Demographics JSON saved at: {summary_path}")
     print(f"🧪 Debug log saved at: {debug_path}")
-    print(f"🖼️ Categorized images saved in: {os.path.join(results_base_path, school_name)}")
+    if identity_summary is not None:
+        print(f"🧑‍🤝‍🧑 Identities saved at: {identities_path}")
+    if manifest_rows is None:
+        print(f"🖼️ Categorized images saved in: {os.path.join(results_base_path, school_name)}")
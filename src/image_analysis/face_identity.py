@@ -0,0 +1,205 @@
+"""
+Groups a school's face crops by identity, so a person photographed at many events is analyzed once.
+
+Each crop is embedded once with a face-recognition model (Facenet, 128-d) in
+batched CPU inference. The L2-normalized embeddings are kept in a float32 .npy
+file (one row per crop) next to a JSON index of file names and content hashes,
+so a re-run only embeds new or changed crops.
+
+Identities are found by greedy leader clustering: a crop joins the most similar
+identity whose representative is within `threshold` cosine similarity, or
+starts a new identity. Candidate representatives come from a random-hyperplane
+LSH index (several tables of sign bits), so each lookup compares against the few
+representatives sharing a bucket instead of all of them.
+"""
+
+import json
+import os
+
+import cv2
+import numpy as np
+
+from inference_cache import _pinned_models, content_hash
+
+EMBEDDING_MODEL = "Facenet"
+DEFAULT_EMBEDDING_DIR = "../../results/cache/embeddings"
+SIMILARITY_THRESHOLD = 0.6  # Cosine similarity; DeepFace's Facenet cosine-distance threshold is 0.40
+
+
+def build_recognition_model(name=EMBEDDING_MODEL):
+    """Builds a DeepFace face-recognition model once per process and pins it."""
+    if name not in _pinned_models:
+        try:
+            from deepface.modules import modeling
+            _pinned_models[name] = modeling.build_model(task="facial_recognition", model_name=name)
+        except (ImportError, TypeError):
+            from deepface import DeepFace
+            _pinned_models[name] = DeepFace.build_model(name)
+    return _pinned_models[name]
+
+
+def model_input_size(model):
+    """(height, width) the model expects, e.g. (160, 160) for Facenet."""
+    # DeepFace's model wrappers give (height, width); a bare Keras model gives (None, height, width, 3)
+    shape = tuple(model.input_shape)
+    return shape[1:3] if len(shape) == 4 else shape
+
+
+def prepare_crop(image, size):
+    """
+    Converts a BGR crop into the recognition model input: RGB, letterboxed to `size`,
+    standardized per image (Facenet's normalization). The crops already hold one face
+    with a margin, so no detection is run again.
+    """
+    height, width = size
+    face = image[:, :, ::-1].astype(np.float32)
+    factor = min(height / face.shape[0], width / face.shape[1])
+    resized = cv2.resize(face, (max(1, int(face.shape[1] * factor)), max(1, int(face.shape[0] * factor))))
+    canvas = np.zeros((height, width, 3), dtype=np.float32)
+    top = (height - resized.shape[0]) // 2
+    left = (width - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return (canvas - canvas.mean()) / max(float(canvas.std()), 1e-6)
+
+
+class EmbeddingStore:
+    """
+    Embeddings of one crop folder: <name>.npy (float32, rows L2-normalized) and
+    <name>.json ({"model", "files": [[file, content hash], ...]}) in `directory`.
+    """
+
+    def __init__(self, directory, name, model_name=EMBEDDING_MODEL):
+        self.array_path = os.path.join(directory, f"{name}.npy")
+        self.index_path = os.path.join(directory, f"{name}.json")
+        self.model_name = model_name
+        self.rows = {}  # (file, content hash) -> row in self.vectors
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        if os.path.exists(self.array_path) and os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index.get("model") == model_name:
+                self.vectors = np.load(self.array_path, mmap_mode="r")
+                self.rows = {tuple(key): row for row, key in enumerate(index["files"])}
+
+    def lookup(self, image_file, digest):
+        row = self.rows.get((image_file, digest))
+        return None if row is None else np.asarray(self.vectors[row])
+
+    def save(self, keys, vectors):
+        """Replaces the store with `vectors` (rows in the order of `keys`)."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.array_path)), exist_ok=True)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with open(self.array_path + ".tmp", "wb") as f:
+            np.save(f, vectors)
+        with open(self.index_path + ".tmp", "w") as f:
+            json.dump({"model": self.model_name, "files": [list(key) for key in keys]}, f)
+        os.replace(self.array_path + ".tmp", self.array_path)
+        os.replace(self.index_path + ".tmp", self.index_path)
+        self.vectors = vectors
+        self.rows = {key: row for row, key in enumerate(keys)}
+
+
+def embed_crops(cropped_folder, image_files, store=None, model_name=EMBEDDING_MODEL, batch_size=64):
+    """
+    Embeds every readable crop, reusing stored embeddings of unchanged files.
+
+    Returns:
+        tuple: (embedded image files, float32 array of shape (len(files), dim), number newly embedded)
+    """
+    keys, vectors = [], {}
+    pending = []  # (position in keys, image)
+    for image_file in image_files:
+        path = os.path.join(cropped_folder, image_file)
+        try:
+            with open(path, "rb") as f:
+                image_bytes = f.read()
+        except OSError as e:
+            print(f"⚠️ Could not read {path}: {e}")
+            continue
+        key = (image_file, content_hash(image_bytes))
+        stored = store.lookup(*key) if store is not None else None
+        if stored is not None:
+            vectors[len(keys)] = stored
+        else:
+            image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                continue
+            pending.append((len(keys), image))
+        keys.append(key)
+
+    if pending:
+        model = build_recognition_model(model_name)
+        keras_model = getattr(model, "model", model)
+        size = model_input_size(model)
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batch = np.stack([prepare_crop(image, size) for _, image in chunk])
+            embeddings = np.asarray(keras_model.predict(batch, verbose=0), dtype=np.float32)
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+            for (position, _), embedding in zip(chunk, embeddings):
+                vectors[position] = embedding
+
+    matrix = np.stack([vectors[i] for i in range(len(keys))]) if keys else np.zeros((0, 128), dtype=np.float32)
+    if store is not None and pending:
+        store.save(keys, matrix)
+    return [image_file for image_file, _ in keys], matrix, len(pending)
+
+
+class LSHIndex:
+    """
+    Random-hyperplane LSH for cosine similarity: each of `tables` tables hashes a
+    vector to the sign pattern of `bits` random projections.
+
+    Two vectors at angle θ share a table's bucket with probability (1 - θ/π)^bits.
+    With 20 tables of 7 bits, faces at cosine similarity 0.6 meet in some table
+    ~84% of the time (0.7: ~94%), while an unrelated face is a candidate ~15% of
+    the time. A missed match only splits a person into two identities.
+    """
+
+    def __init__(self, dim, tables=20, bits=7, seed=0):
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((tables, bits, dim)).astype(np.float32)
+        self.weights = 1 << np.arange(bits, dtype=np.int64)
+        self.buckets = [{} for _ in range(tables)]
+
+    def codes(self, vectors):
+        """Bucket key per table for each vector: int64 array of shape (n, tables)."""
+        signs = np.einsum("nd,tbd->ntb", vectors, self.planes) > 0
+        return signs.astype(np.int64) @ self.weights
+
+    def add(self, item, codes):
+        for table, code in zip(self.buckets, codes):
+            table.setdefault(int(code), []).append(item)
+
+    def candidates(self, codes):
+        found = set()
+        for table, code in zip(self.buckets, codes):
+            found.update(table.get(int(code), ()))
+        return found
+
+
+def cluster_identities(image_files, embeddings, threshold=SIMILARITY_THRESHOLD, tables=20, bits=7, seed=0):
+    """
+    Greedy leader clustering of the embeddings (in listing order) through an LSH index.
+
+    Returns:
+        dict: {representative image file: [member image files, representative first]}
+    """
+    identities = {}
+    if not image_files:
+        return identities
+    index = LSHIndex(embeddings.shape[1], tables, bits, seed)
+    all_codes = index.codes(embeddings)
+    leaders = []  # Row of each representative
+    for row, (image_file, codes) in enumerate(zip(image_files, all_codes)):
+        candidates = sorted(index.candidates(codes))
+        if candidates:
+            similarities = embeddings[[leaders[c] for c in candidates]] @ embeddings[row]
+            best = int(np.argmax(similarities))
+            if similarities[best] >= threshold:
+                identities[image_files[leaders[candidates[best]]]].append(image_file)
+                continue
+        index.add(len(leaders), codes)
+        leaders.append(row)
+        identities[image_file] = [image_file]
+    return identities
@@ -0,0 +1,117 @@
+"""
+Per-school fingerprint manifest for incremental demographs runs.
+
+Maps each crop's file name to its (size, mtime, content hash) and the result
+stored for it: the per-backend predictions, the count key it added to the
+summary, its debug-log entry and its output-manifest row. A crop is re-hashed
+only when its size or mtime changed, and re-analyzed only when its content did.
+The summary counts are kept in the manifest as well, so applying a change costs
+O(changed crops). The ambiguity gap and output mode of the last run are stored
+too, so a change of either regroups the stored results.
+"""
+
+import hashlib
+import json
+import os
+from collections import Counter
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FingerprintManifest:
+    """
+    Args:
+        path (str): JSON file the manifest is kept in (created on first save)
+    """
+
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.counts = Counter()
+        self.ambiguity_gap = None
+        self.output_mode = None
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self.entries = data["entries"]
+                self.counts = Counter(data["counts"])
+                self.ambiguity_gap = data.get("ambiguity_gap")
+                self.output_mode = data.get("output_mode")
+
+    def diff(self, folder, image_files):
+        """
+        Compares the crops on disk with the manifest.
+
+        Returns:
+            tuple: (new or changed file names, unchanged file names, deleted file names)
+        """
+        changed, unchanged = [], []
+        for image_file in image_files:
+            path = os.path.join(folder, image_file)
+            stat = os.stat(path)
+            entry = self.entries.get(image_file)
+            if entry is None:
+                changed.append(image_file)
+            elif entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                unchanged.append(image_file)
+            elif entry["sha256"] == file_sha256(path):
+                # Touched but identical: refresh the stat so it is not hashed again next time
+                entry["size"], entry["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+                unchanged.append(image_file)
+            else:
+                changed.append(image_file)
+        on_disk = set(image_files)
+        deleted = [image_file for image_file in self.entries if image_file not in on_disk]
+        return changed, unchanged, deleted
+
+    def retract(self, image_file):
+        """Removes a crop and subtracts its contribution from the counts; returns its old entry."""
+        entry = self.entries.pop(image_file, None)
+        if entry and entry.get("count_key"):
+            self.counts[entry["count_key"]] -= 1
+            if self.counts[entry["count_key"]] <= 0:
+                del self.counts[entry["count_key"]]
+        return entry
+
+    def record(self, folder, image_file, outcome, count_key, log, manifest_row):
+        """Stores a crop's fingerprint and result and adds it to the counts."""
+        path = os.path.join(folder, image_file)
+        stat = os.stat(path)
+        self.retract(image_file)
+        self.entries[image_file] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": file_sha256(path),
+            "outcome": outcome,
+            "count_key": count_key,
+            "log": log,
+            "manifest_row": manifest_row,
+        }
+        if count_key:
+            self.counts[count_key] += 1
+
+    def debug_logs(self):
+        return [self.entries[image_file]["log"] for image_file in sorted(self.entries)
+                if self.entries[image_file]["log"] is not None]
+
+    def manifest_rows(self):
+        return [self.entries[image_file]["manifest_row"] for image_file in sorted(self.entries)
+                if self.entries[image_file]["manifest_row"] is not None]
+
+    def save(self):
+        """Writes the manifest atomically."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": self.VERSION, "ambiguity_gap": self.ambiguity_gap,
+                       "output_mode": self.output_mode, "counts": dict(self.counts), "entries": self.entries}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,148 @@
+"""
+Hamming-distance index over 64-bit perceptual hashes, and near-duplicate clustering on top of it.
+
+A BK-tree stores each hash under its parent at the edge labelled with their
+distance. By the triangle inequality a query within radius r only has to follow
+edges labelled d-r .. d+r, so a small-radius lookup touches a small fraction of
+the tree instead of every stored hash.
+
+NearDuplicateClusters does greedy leader clustering: an item joins the cluster
+of the closest representative within `max_distance`, or becomes the
+representative of a new cluster. Only the first item of each cluster is indexed.
+Items given with a size (e.g. pixel count) let a larger arrival take over its
+cluster, so a streamed thumbnail does not stand in for the full-size image.
+"""
+
+import threading
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    BK-tree keyed by Hamming distance. Each node is [hash, items, {distance: child node}].
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+        self.comparisons = 0  # Distance computations made by searches (for benchmarking)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value, item=None):
+        """Stores `item` under hash `value` (items with identical hashes share a node)."""
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """
+        Returns:
+            list: (distance, item) for every stored item within `max_distance`, closest first
+        """
+        matches = []
+        if self.root is None:
+            return matches
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            self.comparisons += 1
+            if distance <= max_distance:
+                matches.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+    def nearest(self, value, max_distance):
+        """The closest stored item within `max_distance`, or None."""
+        matches = self.search(value, max_distance)
+        return matches[0][1] if matches else None
+
+
+class NearDuplicateClusters:
+    """
+    Groups items by perceptual hash; thread-safe, so pipeline stages can share one instance.
+
+    Args:
+        max_distance (int): Hamming distance (of 64 bits) at which two hashes count as the same image
+
+    Attributes:
+        representative_of (dict): item -> representative item of its cluster
+        replaced (dict): item that took over a cluster -> the representative it replaced
+    """
+
+    def __init__(self, max_distance=4):
+        self.max_distance = max_distance
+        self.index = BKTree()
+        self.representative_of = {}
+        self.replaced = {}
+        self._members = {}  # Indexed (first) item -> every item of its cluster
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def assign(self, item, value, size=None):
+        """
+        Puts `item` into a cluster. With `size`, an item larger than its cluster's
+        representative becomes the representative (recorded in `replaced`).
+
+        Returns:
+            The representative of an existing cluster, or None if `item` starts a new one or takes one over
+        """
+        with self._lock:
+            self._sizes[item] = size
+            leader = self.index.nearest(value, self.max_distance)
+            if leader is None:
+                self.index.add(value, item)
+                self.representative_of[item] = item
+                self._members[item] = [item]
+                return None
+            members = self._members[leader]
+            members.append(item)
+            representative = self.representative_of[leader]
+            current_size = self._sizes.get(representative)
+            if size is not None and current_size is not None and size > current_size:
+                for member in members:
+                    self.representative_of[member] = item
+                self.replaced[item] = representative
+                return None
+            self.representative_of[item] = representative
+            return representative
+
+    def clusters(self):
+        """{representative: [members, representative first]}"""
+        groups = {}
+        for item, representative in self.representative_of.items():
+            groups.setdefault(representative, [representative])
+            if item != representative:
+                groups[representative].append(item)
+        return groups
+
+    def duplicates(self):
+        return sum(1 for item, representative in self.representative_of.items() if item != representative)
+
+    def report(self):
+        total = len(self.representative_of)
+        report = (f"{total} items -> {len(self.index)} clusters, {self.duplicates()} near-duplicates "
+                  f"(distance <= {self.max_distance})")
+        if self.replaced:
+            report += f", {len(self.replaced)} representatives replaced by larger copies"
+        return report
@@ -0,0 +1,158 @@
+"""
+Cheap local prefilter run before the remote sacred-iconography classifier.
+
+Each image is downloaded once (through the shared data-cleaning download cache)
+and only its header is parsed for the format and dimensions. Icons, spacer
+pixels and other tiny images, SVGs and small GIF sprites are dropped. Images
+the local PIL build cannot read (AVIF, some WEBP) are never dropped: they are
+sent to the classifier like images that could not be downloaded. Near-
+identical survivors are collapsed by perceptual hash (looked up in a BK-tree): only one representative
+per group is sent to the classifier, and its verdict is fanned back out to the
+rest of the group.
+"""
+
+import hashlib
+import io
+import os
+import sys
+from collections import Counter
+
+from PIL import Image
+
+from perceptual_hash import compute_hash
+from hash_index import BKTree
+
+MIN_SIDE = 100          # Images narrower or shorter than this (px) are logos, icons or spacers
+SPRITE_MAX_SIDE = 300   # GIFs whose longer side is below this are treated as sprites/decorations
+MAX_HASH_DISTANCE = 4   # Hamming distance (of 64 bits) at which two images count as the same
+DROP_FORMATS = {"SVG", "ICO"}
+
+
+def get_downloader(max_workers=8):
+    """The data-cleaning ImageDownloader, so downloads share its on-disk cache."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_cleaning"))
+    from image_downloader import ImageDownloader
+    return ImageDownloader(max_workers=max_workers)
+
+
+def inspect_header(image_bytes, url=""):
+    """
+    Returns (format, width, height) from the image header without decoding pixels.
+    SVG is recognised from the URL or the markup; undecodable data gives (None, 0, 0).
+    """
+    head = image_bytes[:256].lstrip().lower()
+    if url.lower().split("?")[0].endswith(".svg") or head.startswith(b"<svg") or \
+            (head.startswith(b"<?xml") and b"<svg" in image_bytes[:1024].lower()):
+        return "SVG", 0, 0
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            return img.format, img.size[0], img.size[1]
+    except Exception:
+        return None, 0, 0
+
+
+def drop_reason(image_format, width, height, min_side=MIN_SIDE, sprite_max_side=SPRITE_MAX_SIDE):
+    """
+    Why an image is not worth a remote call, or None if it should be classified.
+    An unreadable header (format None) gives None: its size cannot be measured.
+    """
+    if image_format in DROP_FORMATS:
+        return image_format.lower()
+    if image_format is None:
+        return None
+    if image_format == "GIF" and max(width, height) < sprite_max_side:
+        return "gif_sprite"
+    if min(width, height) < min_side:
+        return "tiny"
+    return None
+
+
+class PrefilterResult:
+    """
+    Attributes:
+        representatives (list): (url, content hash) pairs to send to the classifier
+        group_of (dict): url -> representative url, for every kept image
+        dropped (dict): url -> drop reason
+        unfetched (list): urls that could not be downloaded or decoded (sent to the classifier as-is)
+        counts (Counter): images per outcome
+    """
+
+    def __init__(self):
+        self.representatives = []
+        self.group_of = {}
+        self.dropped = {}
+        self.unfetched = []
+        self.counts = Counter()
+
+    def remote_calls(self):
+        return len(self.representatives) + len(self.unfetched)
+
+    def fan_out(self, verdicts):
+        """Maps representative verdicts back to every url (dropped images are not sacred)."""
+        results = {url: False for url in self.dropped}
+        results.update({url: verdicts.get(url) for url in self.unfetched})
+        results.update({url: verdicts.get(rep) for url, rep in self.group_of.items()})
+        return results
+
+    def report(self, total):
+        avoided = total - self.remote_calls()
+        reasons = ", ".join(f"{count} {reason}" for reason, count in sorted(self.counts.items()))
+        return (f"{total} images -> {self.remote_calls()} remote calls, {avoided} avoided "
+                f"({100 * avoided / total if total else 0:.1f}%): {reasons}")
+
+
+def prefilter(urls, downloader, min_side=MIN_SIDE, sprite_max_side=SPRITE_MAX_SIDE,
+              max_distance=MAX_HASH_DISTANCE, method="phash"):
+    """
+    Downloads the images and decides which ones need a remote classification.
+
+    Args:
+        urls (list): Image URLs of one school
+        downloader (ImageDownloader): Concurrent, cached downloader
+        max_distance (int): Perceptual-hash distance for "near-identical"
+
+    Returns:
+        PrefilterResult
+    """
+    result = PrefilterResult()
+    by_content = {}   # sha256 -> representative url
+    hashes = BKTree()  # perceptual hash -> representative url
+
+    for _, url, image_bytes in downloader.download_all(urls):
+        if image_bytes is None:
+            result.unfetched.append(url)
+            result.counts["unfetched"] += 1
+            continue
+        image_format, width, height = inspect_header(image_bytes, url)
+        if image_format is None:
+            # PIL cannot read it here, but the remote model may (e.g. AVIF): classify it as-is
+            result.unfetched.append(url)
+            result.counts["undecodable"] += 1
+            continue
+        reason = drop_reason(image_format, width, height, min_side, sprite_max_side)
+        if reason:
+            result.dropped[url] = reason
+            result.counts[reason] += 1
+            continue
+
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        representative = by_content.get(digest)
+        if representative is None:
+            try:
+                value = compute_hash(image_bytes, method)
+            except Exception:
+                value = None
+            if value is not None:
+                representative = hashes.nearest(value, max_distance)
+            if representative is None:
+                result.representatives.append((url, digest))
+                if value is not None:
+                    hashes.add(value, url)
+                by_content[digest] = url
+                result.group_of[url] = url
+                result.counts["classified"] += 1
+                continue
+            by_content[digest] = representative
+        result.group_of[url] = representative
+        result.counts["duplicate"] += 1
+    return result
@@ -0,0 +1,228 @@
+"""
+Single-pass race/gender inference with a persistent score cache.
+
+DeepFace.analyze re-reads the file, re-detects the face and re-runs both
+attribute models for every backend. MultiAttributeAnalyzer instead reads and
+decodes each image once, runs each detector backend once, and pushes all the
+aligned faces through the Race and Gender models in batches. Raw scores are
+memoized by (image content hash, backend, model version), so re-running a
+school, or re-aggregating with a different ambiguity gap, does no inference.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+import cv2
+import numpy as np
+
+DEFAULT_CACHE_PATH = "../../results/cache/inference.sqlite"
+
+RACE_LABELS = ["asian", "indian", "black", "white", "middle eastern", "latino hispanic"]
+GENDER_LABELS = ["Woman", "Man"]
+MODEL_INPUT_SIZE = 224
+
+# Attribute models stay pinned here for the life of the process once built
+_pinned_models = {}
+
+
+def content_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def _deepface_version():
+    try:
+        import deepface
+        return getattr(deepface, "__version__", "unknown")
+    except ImportError:
+        return "unavailable"
+
+
+def build_attribute_model(name):
+    """Builds the 'Race' or 'Gender' model once per process and pins it."""
+    if name not in _pinned_models:
+        try:
+            from deepface.modules import modeling
+            _pinned_models[name] = modeling.build_model(task="facial_attribute", model_name=name)
+        except (ImportError, TypeError):
+            from deepface import DeepFace
+            _pinned_models[name] = DeepFace.build_model(name)
+    return _pinned_models[name]
+
+
+def prepare_face(face):
+    """
+    Converts an aligned RGB face from DeepFace.extract_faces into the model input:
+    BGR, letterboxed to 224x224, float32 in [0, 1].
+    """
+    face = np.asarray(face, dtype=np.float32)
+    if face.max() > 1:
+        face = face / 255.0
+    face = face[:, :, ::-1]
+    height, width = face.shape[:2]
+    factor = min(MODEL_INPUT_SIZE / height, MODEL_INPUT_SIZE / width)
+    resized = cv2.resize(face, (max(1, int(width * factor)), max(1, int(height * factor))))
+    canvas = np.zeros((MODEL_INPUT_SIZE, MODEL_INPUT_SIZE, 3), dtype=np.float32)
+    top = (MODEL_INPUT_SIZE - resized.shape[0]) // 2
+    left = (MODEL_INPUT_SIZE - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return canvas
+
+
+class InferenceCache:
+    """SQLite store of raw model outputs keyed by (content hash, backend, model version)."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Parallel demographs workers share one database; WAL lets them read while another writes
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS predictions (
+                content_hash TEXT NOT NULL,
+                backend TEXT NOT NULL,
+                model_version TEXT NOT NULL,
+                result TEXT NOT NULL,
+                PRIMARY KEY (content_hash, backend, model_version)
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, digest, backend, model_version):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM predictions WHERE content_hash = ? AND backend = ? AND model_version = ?",
+                (digest, backend, model_version)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_many(self, rows):
+        """Stores (content hash, backend, model version, result dict) rows in one transaction."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO predictions (content_hash, backend, model_version, result) VALUES (?, ?, ?, ?)",
+                [(digest, backend, version, json.dumps(result)) for digest, backend, version, result in rows])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MultiAttributeAnalyzer:
+    """
+    Runs every detector backend once per image and the Race/Gender models once per
+    batch of faces, caching the raw scores.
+
+    Args:
+        backends (list): Detector backends, e.g. ["mtcnn", "retinaface", "opencv"]
+        cache (InferenceCache): Score cache (None disables memoization)
+        batch_size (int): Faces per Race/Gender forward pass
+    """
+
+    def __init__(self, backends, cache=None, batch_size=32):
+        self.backends = list(backends)
+        self.cache = cache
+        self.batch_size = batch_size
+        self.model_version = f"deepface-{_deepface_version()}/race+gender"
+        self._race_model = None
+        self._gender_model = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _models(self):
+        if self._race_model is None:
+            self._race_model = build_attribute_model("Race")
+            self._gender_model = build_attribute_model("Gender")
+        return self._race_model, self._gender_model
+
+    def warm_up(self):
+        """Loads the attribute models now instead of on the first image."""
+        self._models()
+
+    def _detect(self, image, backend):
+        """Returns the first aligned face found by `backend`, as DeepFace.analyze would use it."""
+        from deepface import DeepFace
+        faces = DeepFace.extract_faces(img_path=image, detector_backend=backend,
+                                       enforce_detection=False, align=True)
+        return faces[0]["face"] if faces else None
+
+    def _predict(self, model, batch):
+        keras_model = getattr(model, "model", model)
+        return np.asarray(keras_model.predict(batch, verbose=0))
+
+    def _score_faces(self, faces):
+        """Runs both attribute models over the faces in batches; returns one result dict per face."""
+        race_model, gender_model = self._models()
+        results = []
+        for start in range(0, len(faces), self.batch_size):
+            batch = np.stack([prepare_face(face) for face in faces[start:start + self.batch_size]])
+            race_probs = self._predict(race_model, batch)
+            gender_probs = self._predict(gender_model, batch)
+            for race, gender in zip(race_probs, gender_probs):
+                race = 100 * race / np.sum(race)
+                gender = 100 * gender
+                results.append({
+                    "race": {label: float(score) for label, score in zip(RACE_LABELS, race)},
+                    "gender": {label: float(score) for label, score in zip(GENDER_LABELS, gender)},
+                    "dominant_gender": GENDER_LABELS[int(np.argmax(gender))],
+                })
+        return results
+
+    def analyze_many(self, image_paths, backends=None):
+        """
+        Returns {image path: [result per backend that found a face]} where each result
+        holds the raw `race` scores (percentages), `gender` scores and `dominant_gender`,
+        in the same shape as a DeepFace.analyze result, plus the `backend` it came from.
+
+        Args:
+            image_paths (list): Crops to analyze
+            backends (list): Subset of the backends to run (default: all of them)
+        """
+        backends = list(backends or self.backends)
+        outputs = {path: [None] * len(backends) for path in image_paths}
+        pending_faces = []
+        pending_keys = []
+
+        for path in image_paths:
+            try:
+                with open(path, "rb") as f:
+                    image_bytes = f.read()
+            except OSError as e:
+                print(f"⚠️ Could not read {path}: {e}")
+                continue
+            digest = content_hash(image_bytes)
+            image = None
+            for i, backend in enumerate(backends):
+                cached = self.cache.get(digest, backend, self.model_version) if self.cache else None
+                if cached is not None:
+                    self.cache_hits += 1
+                    outputs[path][i] = cached
+                    continue
+                self.cache_misses += 1
+                if image is None:
+                    # Decode once, shared by every backend that needs it
+                    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+                try:
+                    face = self._detect(image, backend)
+                except Exception as e:
+                    print(f"⚠️ Backend '{backend}' failed: {e}")
+                    continue
+                if face is not None:
+                    pending_faces.append(face)
+                    pending_keys.append((path, i, digest, backend))
+
+        if pending_faces:
+            scored = self._score_faces(pending_faces)
+            for (path, i, _, _), result in zip(pending_keys, scored):
+                outputs[path][i] = result
+            if self.cache:
+                self.cache.put_many([(digest, backend, self.model_version, result)
+                                     for (_, _, digest, backend), result in zip(pending_keys, scored)])
+
+        return {path: [dict(result, backend=backend) for backend, result in zip(backends, results) if result is not None]
+                for path, results in outputs.items()}
+
+    def analyze(self, image_path, backends=None):
+        return self.analyze_many([image_path], backends)[image_path]
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat-completions endpoint, for exercising the
+vision client without network access or API cost.
+
+Answers are deterministic per image URL: YES when the URL mentions a sacred
+keyword (cross, church, chapel, mass, saint, mary, jesus, priest, ...), NO
+otherwise. A request with several images and an indexed prompt gets one
+"<index>: YES|NO" line per image. Latency, a fraction of 429/500 replies and a
+fraction of malformed batch replies can be injected to test the rate limiting,
+retries and batch re-splitting.
+
+Usage:
+    python mock_vision_server.py --port 8089 --latency 0.2 --error-rate 0.1
+    python sacred.py --school roncalli --base-url http://127.0.0.1:8089/v1
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SACRED_KEYWORDS = ("cross", "crucifix", "church", "chapel", "mass", "saint", "st-", "mary", "jesus",
+                   "priest", "nun", "rosary", "sacrament", "altar", "pope", "bishop", "faith", "pray")
+
+
+def mock_answer(image_url):
+    """YES/NO the mock gives for an image URL."""
+    return "YES" if any(keyword in image_url.lower() for keyword in SACRED_KEYWORDS) else "NO"
+
+
+def image_urls(messages):
+    """Returns the image URLs of a chat-completions request, in order."""
+    urls = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            urls.extend(part["image_url"]["url"] for part in content if part.get("type") == "image_url")
+    return urls
+
+
+def prompt_text(messages):
+    return " ".join(part.get("text", "") for message in messages if isinstance(message.get("content"), list)
+                    for part in message["content"] if part.get("type") == "text")
+
+
+def build_reply(messages, malformed=False):
+    """Single image: YES/NO. Several images with an indexed prompt: one "<i>: YES|NO" line per image."""
+    urls = image_urls(messages)
+    if len(urls) > 1 and re.search(r"<image number>", prompt_text(messages)):
+        lines = [f"{i}: {mock_answer(url)}" for i, url in enumerate(urls, start=1)]
+        if malformed:
+            # Drop an answer, as a model that loses count would
+            lines = lines[:-1]
+        return "\n".join(lines)
+    return mock_answer(urls[0]) if urls else "NO"
+
+
+class MockState:
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0, malformed_rate=0.0, per_image_latency=0.0):
+        self.latency = latency
+        self.per_image_latency = per_image_latency
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.images = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+
+def make_handler(state, reply_builder=build_reply):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, headers=None):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            with state.lock:
+                state.requests += 1
+                fail = state.random.random() < state.error_rate
+                status = state.random.choice([429, 500, 503]) if fail else 200
+                if fail:
+                    state.errors += 1
+                malformed = state.random.random() < state.malformed_rate
+            messages = request.get("messages", [])
+            delay = state.latency + state.per_image_latency * len(image_urls(messages))
+            if delay:
+                time.sleep(delay)
+            if status != 200:
+                self._send(status, {"error": {"message": "injected failure", "type": "mock"}},
+                           {"Retry-After": "0.05"} if status == 429 else None)
+                return
+
+            with state.lock:
+                state.images += len(image_urls(messages))
+            self._send(200, {
+                "id": f"chatcmpl-mock-{state.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply_builder(messages, malformed)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+    return Handler
+
+
+def start_mock_server(port=0, latency=0.0, error_rate=0.0, seed=0, reply_builder=build_reply,
+                      malformed_rate=0.0, per_image_latency=0.0):
+    """
+    Starts the mock on a background thread.
+
+    Returns:
+        tuple: (server, state, base_url) — call server.shutdown() when done
+    """
+    state = MockState(latency, error_rate, seed, malformed_rate, per_image_latency)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state, reply_builder))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every reply")
+    parser.add_argument("--per-image-latency", type=float, default=0.0, help="Seconds added per image in a request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered 429/500/503")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of batch replies missing an answer")
+    args = parser.parse_args()
+
+    server, state, base_url = start_mock_server(args.port, args.latency, args.error_rate,
+                                                malformed_rate=args.malformed_rate,
+                                                per_image_latency=args.per_image_latency)
+    print(f"Mock chat-completions endpoint at {base_url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"{state.requests} requests, {state.images} images, {state.errors} injected errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Startup handling for the DeepFace/TensorFlow stack.
+
+Importing deepface pulls in TensorFlow and Keras, and the first analyze call
+builds the models on demand, so the cost used to land on the first image of
+every run. This module imports the stack lazily (only code paths that run
+inference pay for it), warms the detectors and attribute models explicitly, and
+records a cold-start vs. warm-start timing breakdown.
+
+Usage:
+    python model_runtime.py                  # print the startup timing report
+    python model_runtime.py --backends mtcnn
+"""
+
+import argparse
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+_deepface = None
+
+
+class StartupProfile:
+    """Collects (phase, seconds) timings for the startup report."""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def seconds(self, prefix):
+        return sum(seconds for name, seconds in self.phases if name.startswith(prefix))
+
+    def report(self):
+        """Returns the timing breakdown as printable lines."""
+        lines = ["Startup timings:"]
+        for name, seconds in self.phases:
+            lines.append(f" - {name:<42} {seconds:8.3f}s")
+        cold = self.seconds("cold")
+        warm = self.seconds("warm")
+        lines.append(f" = cold start {cold:.2f}s vs. warm start {warm:.2f}s"
+                     + (f" ({cold / warm:.0f}x)" if warm else ""))
+        return "\n".join(lines)
+
+
+def lazy_deepface(profile=None):
+    """Imports deepface (and with it TensorFlow) on first use and returns the DeepFace module."""
+    global _deepface
+    if _deepface is None:
+        with (profile.phase("cold: import deepface + tensorflow") if profile else _no_phase()):
+            from deepface import DeepFace
+            _deepface = DeepFace
+    return _deepface
+
+
+@contextmanager
+def _no_phase():
+    yield
+
+
+def warm_up(analyzer, profile=None):
+    """
+    Builds and pins the race/gender models, loads every detector backend and runs one
+    inference through each, so the first real image is as fast as the rest. The same
+    calls are then repeated to measure the warm cost.
+
+    Args:
+        analyzer (MultiAttributeAnalyzer): Analyzer whose backends and models to warm
+        profile (StartupProfile): Receives the timings (a new one is made if omitted)
+
+    Returns:
+        StartupProfile: The recorded timings
+    """
+    profile = profile or StartupProfile()
+    DeepFace = lazy_deepface(profile)
+    rng = np.random.default_rng(0)
+    dummy_image = rng.integers(0, 255, (320, 320, 3), dtype=np.uint8)
+    dummy_faces = [rng.random((224, 224, 3), dtype=np.float32) for _ in range(analyzer.batch_size)]
+
+    with profile.phase("cold: build race + gender models"):
+        analyzer.warm_up()
+
+    for stage in ("cold", "warm"):
+        for backend in analyzer.backends:
+            with profile.phase(f"{stage}: detector {backend}"):
+                try:
+                    DeepFace.extract_faces(img_path=dummy_image, detector_backend=backend, enforce_detection=False)
+                except Exception as e:
+                    print(f"⚠️ Could not warm backend '{backend}': {e}")
+        with profile.phase(f"{stage}: race + gender batch of {len(dummy_faces)}"):
+            analyzer._score_faces(dummy_faces)
+    return profile
+
+
+def main():
+    from inference_cache import MultiAttributeAnalyzer
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["mtcnn", "retinaface", "opencv"])
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    analyzer = MultiAttributeAnalyzer(args.backends, batch_size=args.batch_size)
+    print(warm_up(analyzer).report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Long-lived local model worker.
+
+Start it once and every demographs.py / data-cleaning.py run reuses its warm
+models instead of importing TensorFlow and rebuilding them per school:
+
+    python model_server.py serve                # warms up, prints timings, then serves
+    python demographs.py --school roncalli --model-server 127.0.0.1:6009
+    python ../data_cleaning/data-cleaning.py --school roncalli --model-server 127.0.0.1:6009
+    python model_server.py stop
+
+Requests are pickled over a localhost multiprocessing connection protected by an
+auth key: DEMOGRAPHS_AUTHKEY if set, otherwise a random key that `serve` writes
+to results/cache/model_server.key (mode 0600) and clients read back. Anyone
+holding the key can run code in the server, so it only binds to loopback unless
+DEMOGRAPHS_AUTHKEY is set explicitly. Paths must be readable by the server, so
+the client sends them as absolute paths.
+"""
+
+import argparse
+import os
+import secrets
+import stat
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+from inference_cache import InferenceCache, MultiAttributeAnalyzer, DEFAULT_CACHE_PATH
+from model_runtime import StartupProfile, lazy_deepface, warm_up
+
+DEFAULT_ADDRESS = "127.0.0.1:6009"
+BACKENDS = ["mtcnn", "retinaface", "opencv"]
+AUTHKEY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "results", "cache",
+                            "model_server.key")
+LOOPBACK_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+
+def parse_address(address):
+    host, port = address.rsplit(":", 1)
+    return host.strip("[]"), int(port)
+
+
+def get_authkey(create=False, path=AUTHKEY_PATH):
+    """
+    The connection auth key: DEMOGRAPHS_AUTHKEY, else the key file.
+
+    Args:
+        create (bool): Generate a random key file (mode 0600) if there is none (the server does this)
+    """
+    if os.environ.get("DEMOGRAPHS_AUTHKEY"):
+        return os.environ["DEMOGRAPHS_AUTHKEY"].encode()
+    if create and not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+    if not os.path.exists(path):
+        raise RuntimeError(f"No model server key: set DEMOGRAPHS_AUTHKEY or start the server first ({path})")
+    if os.stat(path).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise RuntimeError(f"Model server key {path} is readable by other users; chmod 600 it")
+    with open(path) as f:
+        return f.read().strip().encode()
+
+
+def check_bind_address(address):
+    """Refuses non-loopback binds unless an explicit DEMOGRAPHS_AUTHKEY is set."""
+    host, _ = parse_address(address)
+    if host.strip("[]") not in LOOPBACK_HOSTS and not os.environ.get("DEMOGRAPHS_AUTHKEY"):
+        raise ValueError(f"Refusing to listen on {host}: only 127.0.0.1/::1 are allowed without DEMOGRAPHS_AUTHKEY")
+
+
+class ModelServer:
+    """
+    Holds one warm MultiAttributeAnalyzer and answers requests from local clients.
+    Inference is serialized behind a lock; connections are handled on threads.
+    """
+
+    def __init__(self, backends=BACKENDS, cache_path=DEFAULT_CACHE_PATH, batch_size=32):
+        self.analyzer = MultiAttributeAnalyzer(backends, cache=InferenceCache(cache_path) if cache_path else None,
+                                               batch_size=batch_size)
+        self.profile = StartupProfile()
+        self.started = time.time()
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _handle(self, request):
+        op, args = request[0], request[1:]
+        if op == "ping":
+            return "pong"
+        if op == "analyze_many":
+            return self.analyzer.analyze_many(*args)
+        if op == "extract_faces":
+            image, backend = args
+            faces = lazy_deepface().extract_faces(img_path=image, detector_backend=backend, enforce_detection=False)
+            # The aligned face arrays are not needed by the clients; keep the replies small
+            return [{"facial_area": face["facial_area"], "confidence": face["confidence"]} for face in faces]
+        if op == "stats":
+            return {
+                "uptime_seconds": time.time() - self.started,
+                "requests": self.requests,
+                "cache_hits": self.analyzer.cache_hits,
+                "cache_misses": self.analyzer.cache_misses,
+                "startup": self.profile.report(),
+            }
+        raise ValueError(f"Unknown request: {op}")
+
+    def _serve_connection(self, conn):
+        with conn:
+            while not self._stop.is_set():
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    return
+                if request[0] == "shutdown":
+                    self._stop.set()
+                    conn.send(("ok", None))
+                    return
+                try:
+                    with self._lock:
+                        self.requests += 1
+                        reply = ("ok", self._handle(request))
+                except Exception as e:
+                    reply = ("error", str(e))
+                conn.send(reply)
+
+    def serve(self, address=DEFAULT_ADDRESS):
+        check_bind_address(address)
+        authkey = get_authkey(create=True)
+        warm_up(self.analyzer, self.profile)
+        print(self.profile.report())
+        with Listener(parse_address(address), authkey=authkey) as listener:
+            print(f"🚀 Model server listening on {address}")
+            # accept() blocks, so the listener runs on a thread and the main thread waits for shutdown
+            def accept_loop():
+                while not self._stop.is_set():
+                    try:
+                        conn = listener.accept()
+                    except OSError:
+                        return
+                    threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+            threading.Thread(target=accept_loop, daemon=True).start()
+            try:
+                self._stop.wait()
+            except KeyboardInterrupt:
+                pass
+        if self.analyzer.cache:
+            self.analyzer.cache.close()
+        print("👋 Model server stopped")
+
+
+class ModelClient:
+    """
+    Client for ModelServer with the same analyze/analyze_many interface as
+    MultiAttributeAnalyzer, so demographs can use either.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS):
+        self.address = address
+        self._conn = Client(parse_address(address), authkey=get_authkey())
+        self._lock = threading.Lock()
+
+    def _call(self, *request):
+        with self._lock:
+            self._conn.send(request)
+            status, payload = self._conn.recv()
+        if status == "error":
+            raise RuntimeError(f"Model server: {payload}")
+        return payload
+
+    def analyze_many(self, image_paths, backends=None):
+        absolute = [os.path.abspath(path) for path in image_paths]
+        results = self._call("analyze_many", absolute, backends)
+        return {path: results[abs_path] for path, abs_path in zip(image_paths, absolute)}
+
+    def analyze(self, image_path, backends=None):
+        return self.analyze_many([image_path], backends)[image_path]
+
+    def warm_up(self):
+        self._call("ping")
+
+    def extract_faces(self, image, backend="mtcnn"):
+        """DeepFace.extract_faces on the server; returns facial_area/confidence dicts."""
+        return self._call("extract_faces", image, backend)
+
+    def stats(self):
+        return self._call("stats")
+
+    def shutdown(self):
+        with self._lock:
+            self._conn.send(("shutdown",))
+            self._conn.recv()
+
+    def close(self):
+        self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["serve", "stats", "stop"])
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="host:port to listen on / connect to (non-loopback hosts need DEMOGRAPHS_AUTHKEY)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Inference cache database")
+    parser.add_argument("--batch-size", type=int, default=32, help="Faces per race/gender forward pass")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        ModelServer(cache_path=args.cache, batch_size=args.batch_size).serve(args.address)
+        return
+
+    client = ModelClient(args.address)
+    if args.command == "stats":
+        stats = client.stats()
+        print(stats.pop("startup"))
+        for key, value in stats.items():
+            print(f" - {key}: {value}")
+        client.close()
+    else:
+        client.shutdown()
+        client.close()
+        print(f"Stopped the model server at {args.address}")
+
+
+if __name__ == "__main__":
+    main()
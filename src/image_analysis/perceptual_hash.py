@@ -0,0 +1,63 @@
+"""
+Perceptual image hashes (64-bit ints) for near-duplicate detection.
+
+  ahash  8x8 grayscale thumbnail thresholded at its mean
+  dhash  9x8 thumbnail, one bit per horizontal gradient sign
+  phash  32x32 thumbnail -> 2-D DCT, low 8x8 frequencies thresholded at their median
+
+Near-identical images (resized, recompressed, lightly cropped) end up a small
+Hamming distance apart; `hamming` counts the differing bits.
+"""
+
+import io
+
+import numpy as np
+from PIL import Image
+
+from hash_index import hamming  # Re-exported for callers of this module
+
+HASH_FUNCTIONS = ("ahash", "dhash", "phash")
+
+
+def _gray(image, size):
+    """Loads bytes / a path / a PIL image as a grayscale float array of `size` (width, height)."""
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image))
+    elif not isinstance(image, Image.Image):
+        image = Image.open(image)
+    # draft() lets JPEG decode at reduced scale, which is much cheaper for thumbnails
+    image.draft("L", (size[0] * 4, size[1] * 4))
+    return np.asarray(image.convert("L").resize(size, Image.BILINEAR), dtype=np.float32)
+
+
+def _to_int(bits):
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def ahash(image):
+    pixels = _gray(image, (8, 8))
+    return _to_int(pixels > pixels.mean())
+
+
+def dhash(image):
+    pixels = _gray(image, (9, 8))
+    return _to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+_DCT_32 = np.array([[np.cos(np.pi * (2 * x + 1) * u / 64) for x in range(32)] for u in range(32)], dtype=np.float32)
+
+
+def phash(image):
+    pixels = _gray(image, (32, 32))
+    dct = _DCT_32 @ pixels @ _DCT_32.T
+    low = dct[:8, :8].ravel()[1:]  # Drop the DC term, which only encodes brightness
+    return _to_int(np.concatenate([[False], low > np.median(low)]))
+
+
+def compute_hash(image, method="phash"):
+    if method not in HASH_FUNCTIONS:
+        raise ValueError(f"Unknown hash method: {method}")
+    return globals()[method](image)
@@ -4,22 +4,42 @@ Batch Catholic Sacred Image Detector using GPT-4o Vision
 
 This script processes a CSV of image URLs and detects Catholic religious iconography
 using OpenAI's GPT-4o model. Images deemed to contain such iconography are saved to a new CSV.
+
+Requests run concurrently under a token-bucket rate limit, failed requests are
+retried with jitter, and every answer is cached, so the full corpus can be
+processed and re-runs cost nothing. The API key is read from OPENAI_API_KEY
+(or a .env file).
+
+A local prefilter drops tiny images, SVGs and GIF sprites from their headers and
+collapses near-identical images by perceptual hash before anything is sent.
+
+Image URLs come from the Parquet store's images table when deduplicate.py has
+filled it, and each image's verdict is written back to its `sacred` column.
+
+Usage:
+    python sacred.py --school roncalli
+    python sacred.py --all --concurrency 16 --rate 8
+    python sacred.py --all --batch-size 8                          # 8 images per request
+    python sacred.py --all --base-url http://127.0.0.1:8089/v1   # against mock_vision_server.py
 """
 
+import argparse
+import asyncio
+import glob
+import os
+import sys
+
 import pandas as pd
 from tqdm import tqdm
-from openai import OpenAI
 
-# ====== SET YOUR OPENAI API KEY HERE ======
-client = OpenAI(api_key=OPENAI_API_KEY)
-# ==========================================
+from vision_client import VisionClassifier, ResponseCache, DEFAULT_CACHE_PATH, DEFAULT_MODEL
+from image_prefilter import prefilter, get_downloader, MIN_SIDE, MAX_HASH_DISTANCE
 
-# Ask for school name
-school_name = input("Enter the school name (used in CSV filename): ").strip()
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_cleaning"))
+from deduplicate import open_store
 
-# File paths
-input_csv_path = f"../../data/raw/deduplicate/{school_name}-school-image-urls-unique.csv"
-output_csv_path = f"../../results/{school_name}_sacred_images.csv"
+RAW_DIR = "../../data/raw"
+RESULTS_DIR = "../../results"
 
 # Vision prompt for GPT-4o
 vision_prompt = (
@@ -28,44 +48,147 @@ vision_prompt = (
     "or Catholic religious symbols? Answer only YES or NO."
 )
 
-def analyze_image_with_gpt4o(image_url):
+
+def get_input_csv(school_name):
+    """Prefers the deduplicated URL list, falling back to the crawler's list in data/raw."""
+    deduplicated = os.path.join(RAW_DIR, "deduplicate", f"{school_name}-school-image-urls-unique.csv")
+    if os.path.exists(deduplicated):
+        return deduplicated
+    return os.path.join(RAW_DIR, f"{school_name}-school-image-urls-unique.csv")
+
+
+def discover_schools(raw_dir=RAW_DIR):
+    suffix = "-school-image-urls-unique.csv"
+    return sorted(os.path.basename(path)[:-len(suffix)] for path in glob.glob(os.path.join(raw_dir, f"*{suffix}")))
+
+
+def load_urls(csv_path, limit=None):
+    df = pd.read_csv(csv_path)
+    if 'Image URL' not in df.columns:
+        raise ValueError("CSV must contain a column named 'Image URL'")
+    urls = df['Image URL'].dropna().astype(str).drop_duplicates().tolist()
+    return urls[:limit] if limit else urls
+
+
+def analyze_image_with_gpt4o(image_url, classifier=None):
     """Send image to GPT-4o Vision and return True if sacred iconography is detected"""
+    async def run():
+        own = classifier is None
+        active = classifier or VisionClassifier(vision_prompt)
+        try:
+            return bool(await active.classify(image_url))
+        finally:
+            if own:
+                await active.close()
+    return asyncio.run(run())
+
+
+async def classify_school(classifier, school_name, limit=None, prefilter_options=None, store=None):
+    """
+    Classifies one school's image URLs and writes results/<school>_sacred_images.csv.
+
+    Args:
+        prefilter_options (dict): Keyword arguments for image_prefilter.prefilter; None sends every URL
+        store (ParquetStore): Read the URLs from, and write the verdicts to, its images table
+
+    Returns:
+        tuple: (sacred image URLs, images, remote calls made for them)
+    """
+    input_csv_path = get_input_csv(school_name)
+    output_csv_path = os.path.join(RESULTS_DIR, f"{school_name}_sacred_images.csv")
+
+    if store is not None and store.has_partition("images", school_name):
+        print(f"\nLoading image URLs from the store: {store.partition_path('images', school_name)}")
+        urls = list(dict.fromkeys(url for url in store.read_column("images", school_name, "image_url") if url))
+        urls = urls[:limit] if limit else urls
+    else:
+        print(f"\nLoading image URLs from: {input_csv_path}")
+        urls = load_urls(input_csv_path, limit)
+
+    if prefilter_options is None:
+        to_send, image_keys, filtered = urls, None, None
+    else:
+        print(f"Prefiltering {len(urls)} images...")
+        downloader = get_downloader()
+        filtered = await asyncio.to_thread(prefilter, urls, downloader, **prefilter_options)
+        downloader.close()
+        print(f"🧹 Prefilter: {filtered.report(len(urls))}")
+        # Representatives are cached by content hash, so the same picture at another URL is free
+        to_send = [url for url, _ in filtered.representatives] + filtered.unfetched
+        image_keys = [digest for _, digest in filtered.representatives] + [None] * len(filtered.unfetched)
+    print(f"Processing {len(to_send)} images...\n")
+
+    with tqdm(total=len(to_send)) as progress:
+        verdicts = await classifier.classify_many(to_send, image_keys, progress=lambda: progress.update())
+    if filtered is not None:
+        verdicts = filtered.fan_out(verdicts)
+
+    sacred_image_urls = [url for url in urls if verdicts.get(url)]
+    failed = sum(1 for url in urls if verdicts.get(url) is None)
+
+    print(f"\nSaving {len(sacred_image_urls)} sacred image URLs to {output_csv_path}"
+          + (f" ({failed} images could not be classified)" if failed else ""))
+    pd.DataFrame(sacred_image_urls, columns=['Image URL']).to_csv(output_csv_path, index=False)
+    if store is not None and store.has_partition("images", school_name):
+        store.update_column("images", school_name, "image_url", "sacred",
+                            {url: verdicts.get(url) for url in urls if verdicts.get(url) is not None})
+    return sacred_image_urls, len(urls), len(to_send)
+
+
+async def run(schools, args):
+    cache = None if args.no_cache else ResponseCache(args.cache)
+    classifier = VisionClassifier(vision_prompt, base_url=args.base_url, model=args.model,
+                                  concurrency=args.concurrency, rate=args.rate, cache=cache,
+                                  batch_size=args.batch_size)
+    prefilter_options = None if args.no_prefilter else {
+        "min_side": args.min_side, "max_distance": args.hash_distance}
+    store = None if args.no_store else open_store(args.store)
+    calls_per_school = {}
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an expert in religious image analysis."},
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": vision_prompt},
-                        {"type": "image_url", "image_url": {"url": image_url}},
-                    ],
-                },
-            ],
-        )
-        answer = response.choices[0].message.content.strip().lower()
-        return answer.startswith("yes")
-    except Exception as e:
-        print(f"[Error] GPT-4o failed for: {image_url}\n{e}")
-        return False
-
-# Load image URLs
-print(f"\nLoading image URLs from: {input_csv_path}")
-df = pd.read_csv(input_csv_path)
-
-if 'Image URL' not in df.columns:
-    raise ValueError("CSV must contain a column named 'Image URL'")
-
-sacred_image_urls = []
-
-# Process only the first 50 image URLs
-print(f"\nProcessing first 50 images...\n")
-for url in tqdm(df['Image URL'].dropna().head(50)):
-    if analyze_image_with_gpt4o(url):
-        sacred_image_urls.append(url)
-
-# Save results
-print(f"\nSaving {len(sacred_image_urls)} sacred image URLs to {output_csv_path}")
-pd.DataFrame(sacred_image_urls, columns=['Image URL']).to_csv(output_csv_path, index=False)
-print("✅ Done.")
+        for school_name in schools:
+            _, images, sent = await classify_school(classifier, school_name, args.limit, prefilter_options, store)
+            calls_per_school[school_name] = (images, sent)
+    finally:
+        await classifier.close()
+        if cache is not None:
+            cache.close()
+    print(f"\nVision client: {classifier.report()}")
+    if prefilter_options is not None:
+        print("\n📉 Remote calls avoided by the prefilter:")
+        for school_name, (images, sent) in calls_per_school.items():
+            print(f" - {school_name}: {images - sent} of {images}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--school", help="School name used in the CSV filename (prompted for if omitted)")
+    parser.add_argument("--all", action="store_true", help="Process every school CSV in data/raw")
+    parser.add_argument("--limit", type=int, help="Only classify the first N URLs per school")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--rate", type=float, default=5.0, help="Requests per second")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Images per request, answered as indexed YES/NO lines (1 = one image per request)")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--base-url", help="OpenAI-compatible endpoint, e.g. the local mock server")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Response cache database")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the API")
+    parser.add_argument("--no-prefilter", action="store_true", help="Send every URL, skipping the local prefilter")
+    parser.add_argument("--min-side", type=int, default=MIN_SIDE, help="Drop images smaller than this (px)")
+    parser.add_argument("--hash-distance", type=int, default=MAX_HASH_DISTANCE,
+                        help="Perceptual-hash Hamming distance treated as a duplicate")
+    parser.add_argument("--store", default="../../data/store", help="Parquet store directory")
+    parser.add_argument("--no-store", action="store_true", help="Read the URL CSVs and skip the store")
+    args = parser.parse_args()
+
+    if args.all:
+        schools = discover_schools()
+    else:
+        # Ask for school name
+        schools = [(args.school or input("Enter the school name (used in CSV filename): ")).strip()]
+
+    asyncio.run(run(schools, args))
+    print("✅ Done.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Vectorized race/gender aggregation over a whole corpus of predictions.
+
+get_final_demographics works on one image's dicts at a time. Here the race
+scores of every image are stored in one dense (images x backends x classes)
+float32 array with a fixed class index, with a presence mask for backends that
+found no face, so softmax, the backend mean, the top-2 margin and the majority
+gender are computed for all images at once. Labels for a list of ambiguity gaps
+come out of a single `sweep` call.
+
+The results match get_final_demographics: ties in the gender vote go to the
+gender seen first, and images without predictions are "unknown".
+
+Usage:
+    python score_aggregation.py --gaps 0.01 0.05 0.1 0.2
+    python score_aggregation.py --logs ../../results/roncalli_debug_log.json
+"""
+
+import argparse
+import glob
+import json
+from collections import Counter
+
+import numpy as np
+
+RACE_CLASSES = ["asian", "indian", "black", "white", "middle eastern", "latino hispanic"]
+GENDER_CLASSES = ["woman", "man", "unknown"]
+RACE_INDEX = {race: i for i, race in enumerate(RACE_CLASSES)}
+GENDER_INDEX = {gender: i for i, gender in enumerate(GENDER_CLASSES)}
+BACKENDS = ["mtcnn", "retinaface", "opencv"]
+
+AMBIGUOUS = -1
+UNKNOWN = -2
+
+
+class ScoreTensor:
+    """
+    Race scores and gender votes for N images from B backends.
+
+    Attributes:
+        scores (ndarray): (N, B, C) float32 race probabilities (softmaxed)
+        present (ndarray): (N, B) bool, False where a backend gave no prediction
+        genders (ndarray): (N, B) int8 index into GENDER_CLASSES (-1 where absent)
+        images (list): Image identifiers, in row order
+    """
+
+    def __init__(self, scores, present, genders, images=None):
+        self.scores = scores
+        self.present = present
+        self.genders = genders
+        self.images = images or list(range(len(scores)))
+
+    @classmethod
+    def from_predictions(cls, per_image, backends=BACKENDS, images=None, softmaxed=True):
+        """
+        Builds the tensor from per-image lists of prediction dicts
+        ({"backend", "race_scores", "gender"}), as produced by demographs.
+
+        Args:
+            per_image (list): One list of predictions per image
+            backends (list): Backend order of the B axis
+            softmaxed (bool): False if race_scores are raw model percentages
+        """
+        backend_index = {backend: i for i, backend in enumerate(backends)}
+        n, b, c = len(per_image), len(backends), len(RACE_CLASSES)
+        scores = np.zeros((n, b, c), dtype=np.float32)
+        present = np.zeros((n, b), dtype=bool)
+        genders = np.full((n, b), -1, dtype=np.int8)
+        for row, predictions in enumerate(per_image):
+            for slot, prediction in enumerate(predictions):
+                col = backend_index.get(prediction.get("backend"), slot)
+                for race, score in prediction["race_scores"].items():
+                    scores[row, col, RACE_INDEX[race.lower()]] = score
+                present[row, col] = True
+                genders[row, col] = GENDER_INDEX.get(prediction["gender"], GENDER_INDEX["unknown"])
+        if not softmaxed:
+            scores = softmax(scores)
+        return cls(scores, present, genders, images)
+
+    def __len__(self):
+        return len(self.scores)
+
+
+def softmax(scores):
+    """Softmax over the class axis of an (..., C) array (what demographs.softmax does per dict)."""
+    shifted = scores - scores.max(axis=-1, keepdims=True)
+    exp_scores = np.exp(shifted, dtype=np.float32)
+    return exp_scores / exp_scores.sum(axis=-1, keepdims=True)
+
+
+def mean_scores(tensor):
+    """(N, C) race scores averaged over the backends that gave a prediction."""
+    weights = tensor.present[..., None].astype(np.float32)
+    counts = np.maximum(tensor.present.sum(axis=1), 1)[:, None]
+    return (tensor.scores * weights).sum(axis=1) / counts
+
+
+def top2(mean):
+    """Returns (top class index, top score, margin over the runner-up) per image."""
+    order = np.argsort(-mean, axis=1, kind="stable")
+    top = order[:, 0]
+    best = np.take_along_axis(mean, order[:, :1], axis=1)[:, 0]
+    second = np.take_along_axis(mean, order[:, 1:2], axis=1)[:, 0]
+    return top, best, best - second
+
+
+def majority_gender(tensor):
+    """
+    (N,) majority gender index; ties go to the gender that appears first, like
+    Counter.most_common. Images without predictions get UNKNOWN.
+    """
+    n, b = tensor.genders.shape
+    g = len(GENDER_CLASSES)
+    one_hot = (tensor.genders[..., None] == np.arange(g)) & tensor.present[..., None]  # (N, B, G)
+    counts = one_hot.sum(axis=1)
+    positions = np.where(one_hot, np.arange(b)[None, :, None], b).min(axis=1)  # first backend voting for g
+    candidates = counts == counts.max(axis=1, keepdims=True)
+    winner = np.where(candidates, positions, b + 1).argmin(axis=1)
+    return np.where(tensor.present.any(axis=1), winner, UNKNOWN)
+
+
+def sweep(tensor, ambiguity_gaps):
+    """
+    Final labels for every image under every ambiguity gap, in one pass.
+
+    Returns:
+        dict: "race" (len(gaps), N) int array of RACE_CLASSES indices, AMBIGUOUS or UNKNOWN;
+              "gender" (N,) GENDER_CLASSES indices or UNKNOWN; "confidence" (N,) top mean score;
+              "margin" (N,) top-2 margin; "gaps" the gaps as an array
+    """
+    gaps = np.asarray(ambiguity_gaps, dtype=np.float32)
+    mean = mean_scores(tensor)
+    top, best, margin = top2(mean)
+    has_predictions = tensor.present.any(axis=1)
+
+    race = np.where(margin[None, :] < gaps[:, None], AMBIGUOUS, top[None, :])
+    race = np.where(has_predictions[None, :], race, UNKNOWN)
+    return {
+        "gaps": gaps,
+        "race": race,
+        "gender": majority_gender(tensor),
+        "confidence": np.where(has_predictions, best, 0.0),
+        "margin": margin,
+    }
+
+
+def race_label(index):
+    if index == AMBIGUOUS:
+        return "ambiguous"
+    if index == UNKNOWN:
+        return "unknown"
+    return RACE_CLASSES[index]
+
+
+def gender_label(index):
+    return "unknown" if index == UNKNOWN else GENDER_CLASSES[index]
+
+
+def summarize(result):
+    """Turns a sweep result into {gap: Counter of "race/gender"} (demographs' folder keys)."""
+    genders = [gender_label(g) for g in result["gender"]]
+    summary = {}
+    for gap, races in zip(result["gaps"], result["race"]):
+        summary[round(float(gap), 6)] = Counter(
+            f"{race_label(r).replace(' ', '_')}/{gender}" for r, gender in zip(races, genders))
+    return summary
+
+
+def load_debug_logs(pattern):
+    """Reads demographs debug logs into a ScoreTensor (entries without per-backend predictions are skipped)."""
+    per_image, images = [], []
+    for path in sorted(glob.glob(pattern)):
+        with open(path) as f:
+            for entry in json.load(f):
+                if "backends" not in entry:
+                    continue
+                per_image.append([dict(prediction, backend=backend)
+                                  for backend, prediction in entry["backends"].items() if prediction is not None])
+                images.append(f"{path}:{entry['image']}")
+    return ScoreTensor.from_predictions(per_image, images=images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logs", default="../../results/*_debug_log.json", help="Glob of demographs debug logs")
+    parser.add_argument("--gaps", type=float, nargs="+", default=[0.0, 0.01, 0.02, 0.05, 0.1, 0.2])
+    args = parser.parse_args()
+
+    tensor = load_debug_logs(args.logs)
+    if not len(tensor):
+        print(f"No per-backend predictions found in {args.logs}; run demographs.py first.")
+        return
+    result = sweep(tensor, args.gaps)
+    print(f"{len(tensor)} images x {tensor.scores.shape[1]} backends x {tensor.scores.shape[2]} classes")
+    for gap, counts in summarize(result).items():
+        ambiguous = sum(count for key, count in counts.items() if key.startswith("ambiguous/"))
+        print(f"\nambiguity_gap={gap}: {ambiguous} ambiguous ({100 * ambiguous / len(tensor):.1f}%)")
+        for key, count in counts.most_common():
+            print(f" - {key}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+Async client for the sacred-iconography vision classifier.
+
+Many image URLs are classified concurrently (bounded by a semaphore) while a
+token bucket keeps the request rate under the API limit. 429 and 5xx replies
+(and connection errors) are retried with exponential backoff and full jitter,
+honouring Retry-After when the server sends one. Every answer is stored in a
+SQLite cache keyed by (image URL or content hash, prompt, model), so a re-run
+only pays for images it has not seen.
+
+With `batch_size` > 1, up to that many images go into one request whose
+prompt asks for one "<index>: YES|NO" line per image. A reply that does not
+answer every index, or a request the API rejects (400/413/422, e.g. too many
+images), splits the batch in half and retries, down to single-image requests.
+A batch whose retries are exhausted fails as a whole; splitting would only
+multiply the requests sent to an endpoint that is already failing.
+
+The client talks to any OpenAI-compatible chat-completions endpoint; point
+`base_url` at mock_vision_server.py to exercise it locally.
+"""
+
+import asyncio
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_MODEL = "gpt-4o"
+DEFAULT_CACHE_PATH = "../../results/cache/vision_responses.sqlite"
+SYSTEM_PROMPT = "You are an expert in religious image analysis."
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+SPLITTABLE_STATUS = {400, 413, 422}  # Rejected batch requests, retried as two smaller ones
+
+BATCH_INSTRUCTIONS = (
+    "You will be shown {n} images, labelled Image 1 to Image {n}. Answer the question below for each "
+    "image separately. Reply with exactly {n} lines, one per image in order, each of the form "
+    "'<image number>: YES' or '<image number>: NO', and nothing else.\n\nQuestion: {question}"
+)
+ANSWER_LINE = re.compile(r"^\W*(?:image\s*)?(\d+)\s*[:.)\-]\s*\**\s*(yes|no)\b", re.IGNORECASE)
+
+
+def load_api_key():
+    """Reads OPENAI_API_KEY from the environment, loading a .env file first if python-dotenv is installed."""
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+    return os.environ.get("OPENAI_API_KEY")
+
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` tokens per second, at most `capacity` saved up.
+
+    Args:
+        rate (float): Sustained requests per second
+        capacity (int): Burst size (default: one second's worth)
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ResponseCache:
+    """SQLite store of classifier answers keyed by sha256(image key, prompt, model)."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                image_key TEXT NOT NULL,
+                model TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(image_key, prompt, model):
+        return hashlib.sha256("\x00".join((image_key, prompt, model)).encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT answer FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, image_key, model, answer):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, image_key, model, answer, created) VALUES (?, ?, ?, ?, ?)",
+                (key, image_key, model, answer, time.time()))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def parse_yes_no(answer):
+    return answer.strip().lower().startswith("yes")
+
+
+def parse_indexed_answers(answer, n):
+    """
+    Parses a batched reply into [bool] * n, or returns None if it does not answer
+    every index from 1 to n exactly once.
+    """
+    verdicts = {}
+    for line in answer.splitlines():
+        match = ANSWER_LINE.match(line.strip())
+        if not match:
+            continue
+        index = int(match.group(1))
+        if index in verdicts or not 1 <= index <= n:
+            return None
+        verdicts[index] = match.group(2).lower() == "yes"
+    if len(verdicts) != n:
+        return None
+    return [verdicts[i] for i in range(1, n + 1)]
+
+
+class VisionClassifier:
+    """
+    Args:
+        prompt (str): Question asked about every image (answered YES or NO)
+        api_key (str): API key (default: OPENAI_API_KEY / .env; required unless `base_url` is set)
+        base_url (str): Chat-completions endpoint root, e.g. http://127.0.0.1:8089/v1 for the mock
+        model (str): Vision model name
+        concurrency (int): Requests in flight at once
+        rate (float): Requests per second allowed by the token bucket
+        max_retries (int): Retries per request on 429/5xx/connection errors
+        cache (ResponseCache): Answer cache (None disables it)
+        batch_size (int): Images per request (1 sends one image per request)
+    """
+
+    def __init__(self, prompt, api_key=None, base_url=None, model=DEFAULT_MODEL, concurrency=8, rate=5.0,
+                 max_retries=5, backoff=1.0, max_backoff=60.0, timeout=60.0, cache=None, batch_size=1):
+        from openai import AsyncOpenAI
+
+        api_key = api_key or load_api_key()
+        if not api_key:
+            if not base_url:
+                raise ValueError("No OpenAI API key: set OPENAI_API_KEY (or add it to .env)")
+            api_key = "not-needed-for-mock"  # Local OpenAI-compatible servers ignore the key
+        self.prompt = prompt
+        self.model = model
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cache = cache
+        self.batch_size = batch_size
+        # Retries are handled here (with jitter and the token bucket), not by the SDK
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=timeout)
+        self.bucket = TokenBucket(rate)
+        self.stats = {"cached": 0, "requests": 0, "retries": 0, "failed": 0, "resplits": 0}
+        self.latencies = []
+
+    def _messages(self, image_url, prompt=None):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt or self.prompt},
+                    {"type": "image_url", "image_url": {"url": image_url}},
+                ],
+            },
+        ]
+
+    def _batch_messages(self, image_urls):
+        content = [{"type": "text", "text": BATCH_INSTRUCTIONS.format(n=len(image_urls), question=self.prompt)}]
+        for i, image_url in enumerate(image_urls, start=1):
+            content.append({"type": "text", "text": f"Image {i}:"})
+            content.append({"type": "image_url", "image_url": {"url": image_url}})
+        return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": content}]
+
+    def _retry_delay(self, attempt, error):
+        """Full-jitter exponential backoff, or the server's Retry-After if it gave one."""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def complete(self, messages):
+        """Sends one chat-completions request with rate limiting and retries; returns the answer text."""
+        import openai
+
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            self.stats["requests"] += 1
+            started = time.perf_counter()
+            try:
+                response = await self.client.chat.completions.create(model=self.model, messages=messages)
+                self.latencies.append(time.perf_counter() - started)
+                return response.choices[0].message.content or ""
+            except (openai.APIConnectionError, openai.APITimeoutError) as e:
+                error = e
+            except openai.APIStatusError as e:
+                if e.status_code not in RETRYABLE_STATUS:
+                    raise
+                error = e
+            if attempt == self.max_retries:
+                raise error
+            self.stats["retries"] += 1
+            await asyncio.sleep(self._retry_delay(attempt, error))
+
+    async def classify(self, image_url, image_key=None):
+        """
+        Returns True/False for one image, or None if every attempt failed.
+
+        Args:
+            image_url (str): URL sent to the model
+            image_key (str): Cache key for the image (e.g. its content hash; default: the URL)
+        """
+        image_key = image_key or image_url
+        key = ResponseCache.make_key(image_key, self.prompt, self.model)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.stats["cached"] += 1
+                return parse_yes_no(cached)
+        try:
+            answer = await self.complete(self._messages(image_url))
+        except Exception as e:
+            print(f"[Error] Vision request failed for: {image_url}\n{e}")
+            self.stats["failed"] += 1
+            return None
+        if self.cache is not None:
+            self.cache.put(key, image_key, self.model, answer)
+        return parse_yes_no(answer)
+
+    def _batch_cache_key(self, image_key):
+        # Batched answers are kept apart from single-image ones so the two modes can be compared
+        return ResponseCache.make_key(image_key, "batch\x00" + self.prompt, self.model)
+
+    async def classify_batch(self, image_urls, image_keys):
+        """
+        Classifies several images in one request; a malformed reply or a rejected
+        request splits the batch in half.
+
+        Returns:
+            list: True, False or None per image (None for all if the request failed)
+        """
+        import openai
+
+        if len(image_urls) == 1:
+            return [await self.classify(image_urls[0], image_keys[0])]
+        try:
+            answer = await self.complete(self._batch_messages(image_urls))
+            verdicts = parse_indexed_answers(answer, len(image_urls))
+        except openai.APIStatusError as e:
+            if e.status_code not in SPLITTABLE_STATUS:
+                return self._batch_failed(image_urls, e)
+            print(f"[Error] Batched vision request rejected for {len(image_urls)} images: {e}")
+            verdicts = None
+        except Exception as e:
+            return self._batch_failed(image_urls, e)
+        if verdicts is None:
+            self.stats["resplits"] += 1
+            middle = len(image_urls) // 2
+            return (await self.classify_batch(image_urls[:middle], image_keys[:middle])
+                    + await self.classify_batch(image_urls[middle:], image_keys[middle:]))
+        if self.cache is not None:
+            for image_url, image_key, verdict in zip(image_urls, image_keys, verdicts):
+                self.cache.put(self._batch_cache_key(image_key or image_url), image_key or image_url, self.model,
+                               "YES" if verdict else "NO")
+        return verdicts
+
+    def _batch_failed(self, image_urls, error):
+        print(f"[Error] Batched vision request failed for {len(image_urls)} images: {error}")
+        self.stats["failed"] += len(image_urls)
+        return [None] * len(image_urls)
+
+    async def _classify_batched(self, image_urls, image_keys, semaphore, progress):
+        results = {}
+        pending = []
+        for url, key in zip(image_urls, image_keys):
+            cached = self.cache.get(self._batch_cache_key(key or url)) if self.cache is not None else None
+            if cached is not None:
+                self.stats["cached"] += 1
+                results[url] = parse_yes_no(cached)
+                if progress:
+                    progress()
+            else:
+                pending.append((url, key))
+
+        async def run(batch):
+            async with semaphore:
+                verdicts = await self.classify_batch([url for url, _ in batch], [key for _, key in batch])
+            for (url, _), verdict in zip(batch, verdicts):
+                results[url] = verdict
+                if progress:
+                    progress()
+
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        await asyncio.gather(*(run(batch) for batch in batches))
+        return {url: results.get(url) for url in image_urls}
+
+    async def classify_many(self, image_urls, image_keys=None, progress=None):
+        """
+        Classifies every URL with at most `concurrency` requests in flight
+        (`batch_size` images per request).
+
+        Args:
+            image_urls (list): URLs to classify
+            image_keys (list): Optional cache key per URL
+            progress (callable): Called once per finished URL (e.g. tqdm.update)
+
+        Returns:
+            dict: {url: True, False or None}
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        image_keys = image_keys or [None] * len(image_urls)
+        if self.batch_size > 1:
+            return await self._classify_batched(image_urls, image_keys, semaphore, progress)
+
+        async def run(url, key):
+            async with semaphore:
+                result = await self.classify(url, key)
+            if progress:
+                progress()
+            return url, result
+
+        results = await asyncio.gather(*(run(url, key) for url, key in zip(image_urls, image_keys)))
+        return dict(results)
+
+    async def close(self):
+        await self.client.close()
+
+    def report(self):
+        return (f"{self.stats['requests']} requests, {self.stats['cached']} cached answers, "
+                f"{self.stats['retries']} retries, {self.stats['failed']} failed"
+                + (f", {self.stats['resplits']} batches re-split" if self.batch_size > 1 else ""))
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Runs the whole pipeline for every school without prompts, as a DAG of (school x stage) tasks.
+
+    crawl -> dedup -> detect -> demographics
+                   \\-> sacred
+
+Each task runs its stage script as a subprocess in the script's own directory
+(so the scripts' ../../ paths hold), with --school passed and stdin closed, so
+nothing can wait on input(). Schools are independent and run concurrently;
+each stage type holds a slot of one resource while it runs, and every resource
+has its own cap:
+
+    browser   crawl (one Chrome instance per slot)
+    detector  detect and demographics (TensorFlow processes; CPU cores are split between the slots)
+    api       sacred (remote vision API)
+    io        dedup
+
+A task whose outputs are all newer than its inputs is skipped (like make);
+--force re-runs everything. detect only rewrites the faces of crops that changed,
+so it is tracked by a stamp file (results/logs/pipeline/<school>.detect.stamp)
+that the runner touches when the task succeeds. Logs go to results/logs/pipeline/<school>.<stage>.log.
+The summary reports each task's status and time, the wall time, and the critical
+path: the chain of tasks, each waiting on the previous one either as a dependency
+or for its resource slot, that ended last and so bounded the run.
+
+Usage:
+    python run_pipeline.py                                    # dedup, detect, demographics, sacred for all schools
+    python run_pipeline.py --schools roncalli scecina --stages dedup detect demographics
+    python run_pipeline.py --stages crawl dedup --browser-slots 2
+    python run_pipeline.py --detector-slots 2 --api-slots 1 --extra demographics="--cascade --output-mode link"
+    python run_pipeline.py --dry-run
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ROOT_DIR = os.path.join(SRC_DIR, "..")
+RAW_DIR = os.path.join(ROOT_DIR, "data", "raw")
+STORE_DIR = os.path.join(ROOT_DIR, "data", "store")
+RESULTS_DIR = os.path.join(ROOT_DIR, "results")
+LOG_DIR = os.path.join(RESULTS_DIR, "logs", "pipeline")
+
+STAGES = ["crawl", "dedup", "detect", "demographics", "sacred"]
+DEFAULT_STAGES = ["dedup", "detect", "demographics", "sacred"]
+DEPENDS_ON = {"crawl": [], "dedup": ["crawl"], "detect": ["dedup"], "demographics": ["detect"], "sacred": ["dedup"]}
+RESOURCE_OF = {"crawl": "browser", "dedup": "io", "detect": "detector", "demographics": "detector", "sacred": "api"}
+
+
+def crawl_csv(school):
+    """Where async_crawler.py writes the school's crawl (named after the site's domain)."""
+    sys.path.insert(0, os.path.join(SRC_DIR, "data_collection"))
+    from async_crawler import SCHOOL_SITES
+    domain = urlparse(SCHOOL_SITES.get(school, school)).netloc or school
+    domain = domain[4:] if domain.startswith("www.") else domain
+    return os.path.join(RAW_DIR, f"{domain.split('.')[0]}-school-image-urls.csv")
+
+
+def discover_schools(raw_dir=RAW_DIR):
+    suffix = "-school-image-urls-unique.csv"
+    return sorted(os.path.basename(path)[:-len(suffix)] for path in glob.glob(os.path.join(raw_dir, f"*{suffix}")))
+
+
+class Task:
+    """One stage of one school: the command to run, its inputs and outputs, and how it went."""
+
+    def __init__(self, school, stage, script_dir, command, inputs, outputs, env=None, stamp=None):
+        self.school = school
+        self.stage = stage
+        self.name = f"{school}.{stage}"
+        self.script_dir = script_dir
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.env = env or {}
+        self.stamp = stamp  # Touched on success, for stages that don't rewrite their outputs on every run
+        self.resource = RESOURCE_OF[stage]
+        self.deps = []
+        self.status = "pending"  # pending | running | ok | skipped | failed | blocked
+        self.seconds = 0.0
+        self.started_at = 0.0
+        self.finished_at = 0.0
+        self.gated_by = None  # The dependency, or the task that freed the resource slot, this task waited for last
+
+    def up_to_date(self):
+        """All outputs exist and none is older than the newest input."""
+        if not self.outputs or not all(os.path.exists(path) for path in self.outputs):
+            return False
+        newest_input = max((os.path.getmtime(path) for path in self.inputs if os.path.exists(path)), default=0)
+        return min(os.path.getmtime(path) for path in self.outputs) >= newest_input
+
+
+def threads_env(threads):
+    return {"OMP_NUM_THREADS": str(threads), "TF_NUM_INTRAOP_THREADS": str(threads), "TF_NUM_INTEROP_THREADS": "1"}
+
+
+def build_tasks(schools, stages, detector_slots, extra_args):
+    """
+    Returns:
+        list: Tasks in dependency order; a dependency on a stage that is not run is dropped
+    """
+    python = sys.executable
+    cpu_per_slot = max(1, (os.cpu_count() or 1) // detector_slots)
+    tasks = []
+    for school in schools:
+        raw_csv = os.path.join(RAW_DIR, f"{school}-school-image-urls-unique.csv")
+        crawled = crawl_csv(school) if "crawl" in stages else os.path.join(RAW_DIR, f"{school}-school-image-urls.csv")
+        dedup_input = crawled if "crawl" in stages or os.path.exists(crawled) else raw_csv
+        deduplicated = os.path.join(RAW_DIR, "deduplicate", f"{school}-school-image-urls-unique.csv")
+        faces = os.path.join(STORE_DIR, "faces", f"school={school}", "part-0.parquet")
+        detect_stamp = os.path.join(LOG_DIR, f"{school}.detect.stamp")
+        specs = {
+            "crawl": ("data_collection", [python, "async_crawler.py", "--schools", school, "--browser-slots", "1",
+                                          "--output-dir", "../../data/raw"], [], [crawled]),
+            "dedup": ("data_cleaning", [python, "deduplicate.py", "--inputs", os.path.relpath(
+                dedup_input, os.path.join(SRC_DIR, "data_cleaning"))], [dedup_input], [deduplicated]),
+            "detect": ("data_cleaning", [python, "data-cleaning.py", "--school", school,
+                                         "--detect-workers", str(cpu_per_slot)], [deduplicated], [detect_stamp]),
+            "demographics": ("image_analysis", [python, "demographs.py", "--school", school],
+                             [faces], [os.path.join(RESULTS_DIR, f"{school}_demographs.json")]),
+            "sacred": ("image_analysis", [python, "sacred.py", "--school", school],
+                       [deduplicated], [os.path.join(RESULTS_DIR, f"{school}_sacred_images.csv")]),
+        }
+        # TensorFlow threads per process, so concurrent detector slots don't oversubscribe the CPU:
+        # detect runs cpu_per_slot single-threaded MTCNN processes, demographics one process
+        thread_env = {"detect": threads_env(1), "demographics": threads_env(cpu_per_slot)}
+        stamps = {"detect": detect_stamp}
+        by_stage = {}
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            script_dir, command, inputs, outputs = specs[stage]
+            command = command + shlex.split(extra_args.get(stage, ""))
+            task = Task(school, stage, os.path.join(SRC_DIR, script_dir), command, inputs, outputs,
+                        thread_env.get(stage), stamps.get(stage))
+            task.deps = [by_stage[dep] for dep in DEPENDS_ON[stage] if dep in by_stage]
+            by_stage[stage] = task
+            tasks.append(task)
+    return tasks
+
+
+class Scheduler:
+    """
+    Runs tasks on a thread pool as soon as their dependencies are done and a slot
+    of their resource is free. A failed task blocks everything downstream of it
+    (in that school only).
+
+    Args:
+        tasks (list): Tasks in dependency order
+        caps (dict): Concurrent tasks allowed per resource
+        jobs (int): Concurrent tasks overall
+        force (bool): Run tasks even if their outputs are up to date
+    """
+
+    def __init__(self, tasks, caps, jobs, force=False):
+        self.tasks = tasks
+        self.caps = caps
+        self.jobs = jobs
+        self.force = force
+        self.in_use = {resource: 0 for resource in caps}
+        self.last_release = {}  # resource -> task that most recently gave a slot back
+        self.started = None
+        self._print_lock = threading.Lock()
+
+    def log(self, message):
+        with self._print_lock:
+            print(f"[{time.perf_counter() - self.started:7.1f}s] {message}", flush=True)
+
+    def execute(self, task):
+        """Runs one task's command (in a pool thread); returns True on success."""
+        os.makedirs(LOG_DIR, exist_ok=True)
+        log_path = os.path.join(LOG_DIR, f"{task.name}.log")
+        started = time.perf_counter()
+        with open(log_path, "w") as log:
+            log.write(f"$ (cd {task.script_dir} && {shlex.join(task.command)})\n\n")
+            log.flush()
+            returncode = subprocess.call(task.command, cwd=task.script_dir, stdin=subprocess.DEVNULL,
+                                         stdout=log, stderr=subprocess.STDOUT,
+                                         env=dict(os.environ, PYTHONUNBUFFERED="1", **task.env))
+        task.seconds = time.perf_counter() - started
+        if returncode == 0 and task.stamp:
+            with open(task.stamp, "w"):
+                pass
+        return returncode == 0
+
+    def ready(self, task):
+        return task.status == "pending" and all(dep.status in ("ok", "skipped") for dep in task.deps)
+
+    def run(self):
+        self.started = time.perf_counter()
+        running = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while True:
+                for task in self.tasks:
+                    if task.status == "pending" and any(dep.status in ("failed", "blocked") for dep in task.deps):
+                        task.status = "blocked"
+                        self.log(f"⛔ {task.name} blocked by a failed dependency")
+                    if not self.ready(task):
+                        continue
+                    if not self.force and task.up_to_date():
+                        task.status = "skipped"
+                        task.finished_at = time.perf_counter() - self.started
+                        self.log(f"⏭️ {task.name} up to date")
+                        continue
+                    if len(running) >= self.jobs or self.in_use[task.resource] >= self.caps[task.resource]:
+                        continue
+                    task.status = "running"
+                    task.started_at = time.perf_counter() - self.started
+                    gates = task.deps + ([self.last_release[task.resource]] if task.resource in self.last_release else [])
+                    task.gated_by = max(gates, key=lambda gate: gate.finished_at, default=None)
+                    self.in_use[task.resource] += 1
+                    running[executor.submit(self.execute, task)] = task
+                    self.log(f"▶️ {task.name} ({task.resource})")
+                if not running:
+                    # Skips can make new tasks ready without anything running
+                    if any(self.ready(task) for task in self.tasks):
+                        continue
+                    break
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    self.in_use[task.resource] -= 1
+                    try:
+                        ok = future.result()
+                    except Exception as e:
+                        self.log(f"❌ {task.name}: {e}")
+                        ok = False
+                    task.status = "ok" if ok else "failed"
+                    task.finished_at = time.perf_counter() - self.started
+                    self.last_release[task.resource] = task
+                    self.log(f"{'✅' if ok else '❌'} {task.name} {task.status} in {task.seconds:.1f}s"
+                             + ("" if ok else f" (see {os.path.join(LOG_DIR, task.name + '.log')})"))
+        return time.perf_counter() - self.started
+
+
+def critical_path(tasks):
+    """
+    Walks back from the task that finished last through what each task waited for
+    before it could start: its last dependency, or the task that freed its resource slot.
+
+    Returns:
+        list: (task, "dependency" | "resource" | None) pairs, first to last
+    """
+    finished = [task for task in tasks if task.status in ("ok", "failed")]
+    if not finished:
+        return []
+    task = max(finished, key=lambda t: t.finished_at)
+    path = []
+    while task is not None:
+        gate = task.gated_by
+        path.append((task, None if gate is None else "dependency" if gate in task.deps else "resource"))
+        task = gate
+    return path[::-1]
+
+
+def print_summary(tasks, wall, schools, stages):
+    print("\n📊 Pipeline summary")
+    width = max(len(school) for school in schools)
+    print(f"{'school':<{width}} " + " ".join(f"{stage:>14}" for stage in stages))
+    by_name = {task.name: task for task in tasks}
+    for school in schools:
+        cells = []
+        for stage in stages:
+            task = by_name.get(f"{school}.{stage}")
+            if task is None:
+                cells.append(f"{'-':>14}")
+            elif task.status in ("ok", "failed"):
+                cells.append(f"{task.status} {task.seconds:>6.1f}s".rjust(14))
+            else:
+                cells.append(f"{task.status:>14}")
+        print(f"{school:<{width}} " + " ".join(cells))
+
+    counts = {}
+    for task in tasks:
+        counts[task.status] = counts.get(task.status, 0) + 1
+    busy = sum(task.seconds for task in tasks)
+    print(f"\n⏱️ Wall time {wall:.1f}s for {busy:.1f}s of task time "
+          f"({busy / wall if wall else 0:.1f}x concurrency); "
+          + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+    path = critical_path(tasks)
+    if path:
+        steps = []
+        for task, reason in path:
+            steps.append(("" if reason != "resource" else f"[waits for {task.resource} slot] ")
+                         + f"{task.name} {task.seconds:.1f}s")
+        on_path = sum(task.seconds for task, _ in path)
+        print(f"🧭 Critical path ({on_path:.1f}s of task time, {100 * on_path / wall if wall else 0:.0f}% of wall "
+              f"time): " + " -> ".join(steps))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--schools", nargs="+", help="Schools to run (default: every school in data/raw)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=DEFAULT_STAGES,
+                        help="Stages to run (crawl re-crawls the live sites and is off by default)")
+    parser.add_argument("--jobs", type=int, default=8, help="Tasks running at once overall")
+    parser.add_argument("--browser-slots", type=int, default=2, help="Crawl tasks at once")
+    parser.add_argument("--detector-slots", type=int, default=1,
+                        help="Face detection / demographics tasks at once (CPU cores are split between them)")
+    parser.add_argument("--api-slots", type=int, default=2, help="Sacred-image (remote API) tasks at once")
+    parser.add_argument("--io-slots", type=int, default=4, help="Dedup tasks at once")
+    parser.add_argument("--extra", action="append", default=[], metavar="STAGE=ARGS",
+                        help="Extra arguments for one stage's script, e.g. demographics=\"--cascade\"")
+    parser.add_argument("--force", action="store_true", help="Run tasks even if their outputs are up to date")
+    parser.add_argument("--dry-run", action="store_true", help="Print the tasks and whether they are up to date")
+    args = parser.parse_args()
+
+    extra_args = {}
+    for item in args.extra:
+        stage, _, value = item.partition("=")
+        if stage not in STAGES:
+            parser.error(f"--extra: unknown stage '{stage}'")
+        extra_args[stage] = value
+
+    schools = args.schools or discover_schools()
+    stages = [stage for stage in STAGES if stage in args.stages]
+    caps = {"browser": args.browser_slots, "detector": args.detector_slots, "api": args.api_slots,
+            "io": args.io_slots}
+    if min(caps.values()) < 1 or args.jobs < 1:
+        parser.error("--jobs and every --*-slots must be at least 1")
+    tasks = build_tasks(schools, stages, args.detector_slots, extra_args)
+
+    if args.dry_run:
+        for task in tasks:
+            state = "up to date" if task.up_to_date() and not args.force else "would run"
+            after = ", ".join(dep.name for dep in task.deps) or "-"
+            print(f"{task.name:<32} {state:<10} after: {after:<28} $ {shlex.join(task.command[1:])}")
+        return
+
+    print(f"🚀 {len(tasks)} tasks ({len(schools)} schools x {len(stages)} stages), caps: "
+          + ", ".join(f"{resource} {cap}" for resource, cap in caps.items()))
+    wall = Scheduler(tasks, caps, args.jobs, args.force).run()
+    print_summary(tasks, wall, schools, stages)
+    if any(task.status in ("failed", "blocked") for task in tasks):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
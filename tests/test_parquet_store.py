@@ -0,0 +1,34 @@
+"""Imported legacy results and native demographs.py results must land in the predictions table alike."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "data_store"))
+
+from parquet_store import ParquetStore, import_school, prediction_rows  # noqa: E402
+
+
+def test_imported_and_native_predictions_agree(tmp_path):
+    raw_dir = tmp_path / "raw"
+    raw_dir.mkdir()
+    (raw_dir / "demo-school-image-urls-unique.csv").write_text(
+        "Image URL,Page URL\nhttps://demo.org/a.jpg,https://demo.org/\n", encoding="utf-8")
+    # Legacy tree written by demographs.py: results/<school>/<race>/<gender>/<crop>
+    crop_dir = tmp_path / "results" / "demo" / "latino_hispanic" / "man"
+    crop_dir.mkdir(parents=True)
+    (crop_dir / "img1_face_1.jpg").write_bytes(b"")
+    processed_dir = tmp_path / "processed"
+    processed_dir.mkdir()
+
+    store = ParquetStore(str(tmp_path / "store"))
+    import_school(store, "demo", str(raw_dir), str(tmp_path / "results"), str(processed_dir))
+    imported = store.read("predictions", ["final_race", "final_gender"]).to_pylist()[0]
+
+    # The debug-log entry demographs.py writes for the same crop
+    native_log = [{"image": "img1_face_1.jpg", "final_race": "latino hispanic", "final_gender": "man",
+                   "confidence": 0.91, "backends": {"mtcnn": {}}}]
+    store.write("predictions", "native", prediction_rows(native_log))
+    native = store.read("predictions", ["final_race", "final_gender"],
+                        [("school", "=", "native")]).to_pylist()[0]
+
+    assert imported == native == {"final_race": "latino hispanic", "final_gender": "man"}